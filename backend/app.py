@@ -1,19 +1,197 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, abort, g, has_app_context, has_request_context, request, jsonify, send_file, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from datetime import datetime
+import click
+from collections import Counter
+from datetime import datetime, timedelta
 import os
-import json
+import heapq
+import itertools
+import threading
+import time
+from urllib.parse import urlsplit
+
+import bulk
+from blobstore import THUMBNAIL_SIZES, BlobStore, UnsupportedImage, decode_data_uri, is_blob_id
+from cache import MemoryStore, ResponseCache, create_store
+from compression import Compressor
+from entitlements import EntitlementCache
+from events import ENTITLEMENTS_CHANNEL, chat_channel, create_event_bus, owner_channel, user_channel
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, RequestMetrics, family
+import migrations
+from profiling import RequestProfiler
+import storage
+from querycount import QueryBudgetExceeded, QueryCounter
+from pagination import (
+    DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT, decode_cursor, encode_cursor, is_page_request,
+    keyset_after, keyset_order_by, keyset_page, page_args, page_body
+)
+from serializers import (
+    Field, FieldError, RowSchema, check_fields, dumps, fields_arg, json_response, nested_fields, or_false, or_zero
+)
+from writebehind import WriteBehindQueue
+from spatial import (
+    GEOHASH_PRECISION, check_position, check_radius, cover_bbox, encode_geohash, haversine_m,
+    parse_bbox, prefix_upper_bound, radius_to_bbox
+)
 
 app = Flask(__name__)
 CORS(app)
 
-# Database configuration
+# Database configuration (URL, pool and SQLite pragmas live in storage.py)
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(basedir, "restroom_finder.db")}'
+storage.configure(app, basedir)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-db = SQLAlchemy(app)
+# Sessions are request scoped, so objects need not be reloaded after commit
+# just to build the response (one SELECT per object otherwise)
+db = SQLAlchemy(app, session_options={'expire_on_commit': False})
+with app.app_context():
+    storage.install_sqlite_pragmas(db.engine)
+# Push channel for committed chat messages and notifications (see events.py)
+event_bus = create_event_bus()
+# Cached restroom listings, invalidated by every write that changes them
+response_cache = ResponseCache(create_store(), ttl=int(os.environ.get('RESPONSE_CACHE_TTL', 60)))
+entitlement_cache = EntitlementCache(create_store(), ttl=int(os.environ.get('ENTITLEMENT_CACHE_TTL', 300)))
+RESTROOMS_CACHE = 'restrooms'
+CATALOG_CACHE = 'catalog'
+
+# Uploaded images, stored once per content hash (see blobstore.py). Payloads
+# reference them by absolute URL, PUBLIC_BASE_URL + IMAGE_URL_PREFIX + id;
+# inline data: URIs sent by older clients are moved into the store when they
+# are saved.
+blob_store = BlobStore(os.environ.get('BLOB_STORE_DIR', os.path.join(basedir, 'blobs')))
+IMAGE_URL_PREFIX = '/api/images/'
+# The mobile app cannot resolve relative URLs, so image URLs are absolute.
+# Without PUBLIC_BASE_URL they use the host the request came in on; set it
+# behind a proxy that rewrites Host.
+PUBLIC_BASE_URL = os.environ.get('PUBLIC_BASE_URL', '').rstrip('/')
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', 10 * 1024 * 1024))
+IMAGE_MAX_AGE = 365 * 24 * 3600
+# Let a fronting nginx/Apache send image files (X-Sendfile) instead of the worker
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+
+# SQL statements each endpoint may run per request (None: grows with the
+# input); benchmarks/check_query_budgets.py exercises every route against it.
+# Streamed bodies (timeline, export, events) query after the request returns
+# and are not counted.
+QUERY_BUDGETS = {
+    'get_restrooms': 2,  # 1 + images with ?include=images
+    'recommend_restrooms': 6,  # up to 5 widening searches + images
+    'get_restroom_catalog': 3,
+    'get_restroom_status': 2,
+    'get_restroom_details': 3,
+    'upload_images': 0,
+    'get_image': 0,
+    'create_user': 1,
+    'create_review': 3,
+    'send_message': 1,
+    'get_messages': 2,
+    'request_navigation': 1,
+    'notify_arrival': 1,
+    'notify_owner': 1,
+    'register_user': 2,
+    'login_user': 2,
+    'check_username': 1,
+    'get_user_history': 2,
+    'get_user_timeline': 0,
+    'start_using_restroom': 5,
+    'stop_using_restroom': 5,
+    'register_owner': None,  # 2 + one INSERT per restroom
+    'get_owner_restrooms': 1,
+    'get_owner_restrooms_by_email': 3,
+    'create_restroom': 4,
+    'update_restroom': 4,
+    'import_owner_restrooms': None,  # 1 + 1 per chunk (2 with images), grows with the upload
+    'export_restrooms': 0,
+    'get_owner_notifications': 1,
+    'get_owner_unread_count': 1,
+    'mark_notification_read': 3,
+    'mark_owner_notifications_read': 3,  # 4 where UPDATE ... RETURNING is unsupported
+    'stream_events': 1,
+    'get_cache_stats': 0,
+    'get_metrics': 0,
+    'create_payment': 3,
+    'confirm_payment': 3,
+    'get_owner_payments': 1,
+    'get_user_payments': 1,
+    'check_payment_status': 1,
+}
+query_counter = QueryCounter(QUERY_BUDGETS)
+with app.app_context():
+    query_counter.install(db.engine)
+# QUERY_BUDGET_STRICT=1 fails over-budget requests instead of logging them.
+# Writes are refused before they commit; a request over budget only after
+# its commit is logged, so a client never gets an error for a saved write.
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT') == '1'
+
+@db.event.listens_for(db.session, 'before_commit')
+def enforce_query_budget(session):
+    recording = query_counter.current() if has_request_context() else None
+    if recording is None or request.endpoint is None:
+        return
+    error = query_counter.over_budget(request.endpoint, recording)
+    if error and QUERY_BUDGET_STRICT:
+        raise QueryBudgetExceeded(error)
+
+@db.event.listens_for(db.session, 'after_commit')
+def note_request_commit(session):
+    recording = query_counter.current() if has_request_context() else None
+    if recording is not None:
+        recording.committed = True
+
+# Per-route latency, SQL and encoding metrics, scraped from /metrics
+request_metrics = RequestMetrics()
+# Profiles of requests sent with X-Profile: <PROFILE_TOKEN>, and of sampled
+# requests (PROFILE_SAMPLE_RATE) slower than PROFILE_SLOW_MS
+request_profiler = RequestProfiler(
+    os.environ.get('PROFILE_DIR', os.path.join(basedir, 'profiles')),
+    token=os.environ.get('PROFILE_TOKEN'),
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+    slow_ms=int(os.environ.get('PROFILE_SLOW_MS', 500)),
+    engine=os.environ.get('PROFILER', 'cprofile')
+)
+
+@app.before_request
+def start_request_instrumentation():
+    g.request_started = time.perf_counter()
+    query_counter.start()
+    g.profile = request_profiler.start(request.headers) if request_profiler.enabled else None
+
+@app.after_request
+def finish_request_instrumentation(response):
+    elapsed = time.perf_counter() - g.request_started
+    if g.profile is not None:
+        path = request_profiler.finish(g.profile, request.endpoint, elapsed)
+        if path:
+            print(f"Profile of {request.method} {request.path} written to {path}")
+    recording = query_counter.stop()
+    if recording is None:
+        return response
+    request_metrics.observe(
+        request.endpoint or 'unmatched', request.method, response.status_code, elapsed,
+        sql_seconds=recording.seconds,
+        queries=recording.count,
+        serialization_seconds=g.get('serialization_seconds', 0.0),
+        size=None if response.is_streamed else response.content_length
+    )
+    if request.endpoint is None:
+        return response
+    response.headers['X-Query-Count'] = str(recording.count)
+    error = query_counter.over_budget(request.endpoint, recording)
+    if error:
+        if QUERY_BUDGET_STRICT and not recording.committed and response.status_code < 500:
+            raise QueryBudgetExceeded(error)
+        print(f"Query budget exceeded: {error}")
+    return response
+
+# gzip (or brotli) for response bodies of at least COMPRESS_MIN_BYTES. Runs
+# before the instrumentation above, so metrics see the bytes actually sent.
+compressor = Compressor(int(os.environ.get('COMPRESS_MIN_BYTES', 1024)))
+
+@app.after_request
+def compress_response(response):
+    return compressor(response, request.accept_encodings)
 
 # Models
 class Restroom(db.Model):
@@ -22,22 +200,93 @@ class Restroom(db.Model):
     address = db.Column(db.String(200), nullable=False)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
+    # Geohash of (latitude, longitude), kept in sync by the listener below
+    geohash = db.Column(db.String(GEOHASH_PRECISION), nullable=True, index=True)
     is_free = db.Column(db.Boolean, default=True)
     price = db.Column(db.Integer, default=0)  # VND
     current_users = db.Column(db.Integer, default=0)
     rating = db.Column(db.Float, default=0.0)
     total_reviews = db.Column(db.Integer, default=0)
+    # Running sum of review stars; rating == rating_sum / total_reviews
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     admin_contact = db.Column(db.String(100), nullable=True)
     image_url = db.Column(db.String(500), nullable=True)
-    owner_id = db.Column(db.Integer, db.ForeignKey('owner.id'), nullable=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('owner.id'), nullable=True, index=True)
     # Toilet facilities
     male_standing = db.Column(db.Integer, default=0)
     male_sitting = db.Column(db.Integer, default=0)
     female_sitting = db.Column(db.Integer, default=0)
     disabled_access = db.Column(db.Boolean, default=False)
-    # Multiple images as JSON string
-    images = db.Column(db.Text, nullable=True)  # JSON array of image URLs
+    # Photos live in RestroomImage, loaded only by requests that show them
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Version stamps (see version_stamp) of the last change to the static
+    # fields (catalog) and the live fields (current_users/rating/total_reviews)
+    catalog_version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0', index=True)
+    status_version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0', index=True)
+
+@db.event.listens_for(Restroom, 'before_insert')
+@db.event.listens_for(Restroom, 'before_update')
+def sync_restroom_geohash(mapper, connection, restroom):
+    if restroom.latitude is not None and restroom.longitude is not None:
+        restroom.geohash = encode_geohash(restroom.latitude, restroom.longitude)
+
+class RestroomImage(db.Model):
+    __table_args__ = (
+        # One index serves per-restroom lookups in display order
+        db.Index('ix_restroom_image_restroom_id_position', 'restroom_id', 'position', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    restroom_id = db.Column(db.Integer, db.ForeignKey('restroom.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    ref = db.Column(db.Text, nullable=False)  # blob id (see blobstore.py) or an external URL
+
+# Catalog and status versions are wall-clock stamps in milliseconds, written
+# on each changed restroom row. A shared counter row would order them exactly,
+# but every occupancy, review and catalog write would then queue on that one
+# row's lock, serializing all writes across restrooms on a server database.
+# A stamp is taken before its transaction commits, so a row can become
+# visible after a reader has already returned a later version; delta reads
+# therefore re-send rows stamped within VERSION_OVERLAP_MS before ?since=.
+# Clients must treat deltas as upserts. The window must exceed the longest
+# write transaction plus clock skew between app servers.
+CATALOG_VERSION = 'catalog'
+STATUS_VERSION = 'status'
+VERSION_COLUMNS = {CATALOG_VERSION: Restroom.catalog_version, STATUS_VERSION: Restroom.status_version}
+VERSION_OVERLAP_MS = int(os.environ.get('VERSION_OVERLAP_MS', 10000))
+
+def version_stamp():
+    """Version for the rows the current transaction changes"""
+    return int(time.time() * 1000)
+
+def current_version(counter):
+    return current_versions(counter)[counter]
+
+def latest_versions_query(*counters):
+    # One MAX() subquery each, so every one is a single index seek
+    return db.select(*(
+        db.select(db.func.max(VERSION_COLUMNS[counter])).scalar_subquery() for counter in counters
+    ))
+
+def current_versions(*counters):
+    """Latest version stamped on any restroom, per counter, in one query"""
+    row = db.session.execute(latest_versions_query(*counters)).one()
+    return {counter: value or 0 for counter, value in zip(counters, row)}
+
+def changed_since(counter, since):
+    """Criterion for restrooms whose version may be newer than ``since``"""
+    return VERSION_COLUMNS[counter] > since - VERSION_OVERLAP_MS
+
+def mark_catalog_changed(*criteria):
+    """Stamp restrooms whose static fields were created or edited"""
+    db.session.flush()
+    version = version_stamp()
+    db.session.execute(
+        db.update(Restroom)
+        .where(*criteria)
+        .values(catalog_version=version, status_version=version)
+        .execution_options(synchronize_session=False)
+    )
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -50,6 +299,11 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Review(db.Model):
+    __table_args__ = (
+        db.Index('ix_review_restroom_id_created_at', 'restroom_id', 'created_at'),
+        db.Index('ix_review_user_id_created_at', 'user_id', 'created_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     restroom_id = db.Column(db.Integer, db.ForeignKey('restroom.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -59,6 +313,11 @@ class Review(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class ChatMessage(db.Model):
+    __table_args__ = (
+        # Serves the per-room cursor queries in get_messages
+        db.Index('ix_chat_message_restroom_id_id', 'restroom_id', 'id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     restroom_id = db.Column(db.Integer, db.ForeignKey('restroom.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -68,6 +327,12 @@ class ChatMessage(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class UsageHistory(db.Model):
+    __table_args__ = (
+        db.Index('ix_usage_history_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_usage_history_user_id_restroom_id_end_time', 'user_id', 'restroom_id', 'end_time'),
+        db.Index('ix_usage_history_restroom_id_end_time', 'restroom_id', 'end_time'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     restroom_id = db.Column(db.Integer, db.ForeignKey('restroom.id'), nullable=False)
@@ -77,20 +342,29 @@ class UsageHistory(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
-    user = db.relationship('User', backref='usage_history')
-    restroom = db.relationship('Restroom', backref='usage_history')
+    # Routes select the columns they need; walking these per row would be N+1
+    user = db.relationship('User', backref='usage_history', lazy='raise_on_sql')
+    restroom = db.relationship('Restroom', backref='usage_history', lazy='raise_on_sql')
 
 class Owner(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(100), nullable=False, unique=True)
     phone = db.Column(db.String(20), nullable=False)
+    # Maintained with the notification writes; see rebuild_unread_counters()
+    unread_notifications = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     restrooms = db.relationship('Restroom', backref='owner', lazy=True)
 
 class Notification(db.Model):
+    __table_args__ = (
+        db.Index('ix_notification_owner_id_created_at', 'owner_id', 'created_at'),
+        # Serves bulk mark-read (by ids or up to a watermark id)
+        db.Index('ix_notification_owner_id_is_read_id', 'owner_id', 'is_read', 'id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     owner_id = db.Column(db.Integer, db.ForeignKey('owner.id'), nullable=False)
     restroom_id = db.Column(db.Integer, db.ForeignKey('restroom.id'), nullable=False)
@@ -101,9 +375,16 @@ class Notification(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
-    restroom = db.relationship('Restroom', backref='notifications')
+    restroom = db.relationship('Restroom', backref='notifications', lazy='raise_on_sql')
 
 class Payment(db.Model):
+    __table_args__ = (
+        # Covers the entitlement lookup: no table access needed
+        db.Index('ix_payment_entitlement', 'user_id', 'restroom_id', 'status', 'created_at', 'confirmed_at'),
+        db.Index('ix_payment_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_payment_owner_id_created_at', 'owner_id', 'created_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     restroom_id = db.Column(db.Integer, db.ForeignKey('restroom.id'), nullable=False)
@@ -117,61 +398,471 @@ class Payment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships - use different backref names to avoid conflicts
-    user = db.relationship('User', backref='user_payments')
-    restroom = db.relationship('Restroom', backref='restroom_payments')
-    owner = db.relationship('Owner', backref='owner_payments')
+    user = db.relationship('User', backref='user_payments', lazy='raise_on_sql')
+    restroom = db.relationship('Restroom', backref='restroom_payments', lazy='raise_on_sql')
+    owner = db.relationship('Owner', backref='owner_payments', lazy='raise_on_sql')
+
+def public_url(path):
+    """Absolute URL of a path on this server"""
+    if PUBLIC_BASE_URL:
+        return PUBLIC_BASE_URL + path
+    return request.host_url.rstrip('/') + path if has_request_context() else path
+
+def image_blob_id(value):
+    """The blob id in one of our image URLs (absolute or relative), or None"""
+    path = urlsplit(value).path
+    if path.startswith(IMAGE_URL_PREFIX) and is_blob_id(path[len(IMAGE_URL_PREFIX):]):
+        return path[len(IMAGE_URL_PREFIX):]
+    return None
+
+# Image references: blob ids are stored, absolute URLs of the image route are sent
+def image_ref(value):
+    return public_url(IMAGE_URL_PREFIX + value) if is_blob_id(value) else value
+
+def store_image(value):
+    """The value to save for an image reference sent by a client.
+    
+    Inline data: URIs are written to the blob store and our own image URLs
+    reduced to their id; other values (external URLs, paths) are kept as
+    they are, as are data: URIs in a format the store does not accept.
+    """
+    if not isinstance(value, str):
+        return value
+    blob_id = image_blob_id(value)
+    if blob_id is not None:
+        return blob_id
+    data = decode_data_uri(value)
+    if data is None:
+        return value
+    try:
+        return blob_store.put(data)[0]
+    except UnsupportedImage:
+        return value
+
+def restroom_image_rows(restroom_id, values):
+    """RestroomImage rows for a list of image references sent by a client"""
+    values = [value for value in values or () if isinstance(value, str) and value]
+    return [{'restroom_id': restroom_id, 'position': position, 'ref': store_image(value)}
+            for position, value in enumerate(values)]
+
+def set_restroom_images(restroom_id, values):
+    """Replace a restroom's images, keeping the order they were sent in"""
+    db.session.execute(db.delete(RestroomImage).where(RestroomImage.restroom_id == restroom_id))
+    rows = restroom_image_rows(restroom_id, values)
+    if rows:
+        db.session.execute(db.insert(RestroomImage), rows)
+
+def restroom_images(restroom_ids=None):
+    """Restroom id -> image URLs in display order, in one query (all restrooms without ids)"""
+    query = db.session.query(RestroomImage.restroom_id, RestroomImage.ref)
+    if restroom_ids is not None:
+        if not restroom_ids:
+            return {}
+        query = query.filter(RestroomImage.restroom_id.in_(restroom_ids))
+    images = {}
+    for restroom_id, ref in query.order_by(RestroomImage.restroom_id, RestroomImage.position):
+        images.setdefault(restroom_id, []).append(image_ref(ref))
+    return images
+
+def wants_images(args):
+    return 'images' in args.get('include', '').split(',') or 'images' in (fields_arg(args) or ())
+
+def include_images(items, every_restroom=False):
+    """Add 'images' to serialized restrooms when the request asks with ?include=images.
+    
+    ?fields=...,images asks for them too. Pass every_restroom=True when items
+    hold the whole table, so the images are read without an IN list.
+    """
+    if not wants_images(request.args):
+        return items
+    images = restroom_images(None if every_restroom else [item['id'] for item in items])
+    for item in items:
+        item['images'] = images.get(item['id'], [])
+    return items
+
+# Response schemas: the columns each payload selects and how rows become JSON
+RESTROOM_FACILITY_FIELDS = (
+    Field('male_standing', Restroom.male_standing, or_zero),
+    Field('male_sitting', Restroom.male_sitting, or_zero),
+    Field('female_sitting', Restroom.female_sitting, or_zero),
+    Field('disabled_access', Restroom.disabled_access, or_false),
+)
+RESTROOM_SUMMARY_SCHEMA = RowSchema(
+    Restroom.id, Restroom.name, Restroom.address, Restroom.latitude, Restroom.longitude,
+    Restroom.is_free, Restroom.price, Restroom.current_users, Restroom.rating, Restroom.total_reviews,
+    Restroom.admin_contact, Restroom.image_url
+)
+# Images are not columns of these rows; see include_images()
+RESTROOM_SCHEMA = RowSchema(*RESTROOM_SUMMARY_SCHEMA.fields, *RESTROOM_FACILITY_FIELDS)
+OWNER_RESTROOM_SCHEMA = RowSchema(*RESTROOM_SCHEMA.fields, Restroom.created_at)
+RESTROOM_CATALOG_SCHEMA = RowSchema(
+    Restroom.id, Restroom.name, Restroom.address, Restroom.latitude, Restroom.longitude,
+    Restroom.is_free, Restroom.price, Restroom.admin_contact, Restroom.image_url,
+    *RESTROOM_FACILITY_FIELDS
+)
+REVIEW_SCHEMA = RowSchema(
+    Review.id, Review.rating, Review.comment, Field('image_path', Review.image_path, image_ref), Review.created_at
+)
+# Detail fields ?fields= may name besides the restroom's own, e.g. reviews.rating
+RESTROOM_DETAIL_EXTRA_FIELDS = ('images', 'reviews', *(f'reviews.{name}' for name in REVIEW_SCHEMA.field_names))
+CHAT_MESSAGE_SCHEMA = RowSchema(
+    ChatMessage.id, ChatMessage.user_id, ChatMessage.message, ChatMessage.message_type,
+    ChatMessage.is_from_admin, ChatMessage.created_at
+)
+NOTIFICATION_SCHEMA = RowSchema(
+    Notification.id, Notification.type, Notification.message, Notification.is_read, Notification.created_at,
+    Field('restroom.id', Restroom.id), Field('restroom.name', Restroom.name)
+)
+USAGE_HISTORY_SCHEMA = RowSchema(
+    UsageHistory.id, Field('type', db.literal('usage')),
+    Field('restroom_name', Restroom.name), Field('restroom_address', Restroom.address),
+    UsageHistory.start_time, UsageHistory.end_time, UsageHistory.duration_minutes, UsageHistory.created_at
+)
+REVIEW_HISTORY_SCHEMA = RowSchema(
+    Review.id, Field('type', db.literal('review')),
+    Field('restroom_name', Restroom.name), Field('restroom_address', Restroom.address),
+    Review.rating, Review.comment, Field('image_path', Review.image_path, image_ref), Review.created_at
+)
+OWNER_PAYMENT_SCHEMA = RowSchema(
+    Payment.id, Field('user_name', User.username), Field('restroom_name', Restroom.name),
+    Payment.method, Payment.amount, Payment.status,
+    Field('transfer_image_path', Payment.transfer_image_path, image_ref), Payment.note,
+    Payment.created_at, Payment.confirmed_at
+)
+USER_PAYMENT_SCHEMA = RowSchema(
+    Payment.id, Field('restroom_name', Restroom.name), Payment.method, Payment.amount, Payment.status,
+    Payment.note, Payment.created_at, Payment.confirmed_at
+)
+
+# Keyset pagination: ?limit= and ?cursor= switch list endpoints to pages of
+# {'items': [...], 'next_cursor': ...}; without them they return every row
+OWNER_RESTROOM_PAGE_KEYS = (Restroom.id,)
+PAYMENT_PAGE_KEYS = (Payment.created_at, Payment.id)
+
+def paginated_response(query, schema, keys, descending=False,
+                       default_limit=DEFAULT_PAGE_LIMIT, max_limit=MAX_PAGE_LIMIT, transform=None):
+    """A keyset page of query; transform, if given, post-processes the serialized items"""
+    try:
+        cursor, limit = page_args(request.args, default_limit, max_limit)
+        rows, next_cursor = keyset_page(query, keys, cursor, limit, descending)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    items = schema.many(rows)
+    return json_response(page_body(transform(items) if transform else items, next_cursor))
+
+def projection(schema, *hidden, extra=()):
+    """schema narrowed to the request's ?fields= (see RowSchema.project).
+    
+    hidden are columns the route reads off the rows without sending them;
+    extra are names the route serves itself, such as images.
+    """
+    names = fields_arg(request.args)
+    check_fields(names, schema, extra=extra)
+    return schema.project(names, hidden)
+
+def field_requested(name):
+    names = fields_arg(request.args)
+    return names is None or name in names
+
+@app.errorhandler(FieldError)
+def field_error(e):
+    return jsonify({'error': str(e)}), 400
 
 # API Routes
+DEFAULT_SEARCH_RADIUS_M = 2000
+DEFAULT_NEARBY_LIMIT = 50
+MAX_NEARBY_LIMIT = 500
+
+def restrooms_in_bbox_query(min_lat, min_lng, max_lat, max_lng):
+    """Query restrooms inside a bounding box through the geohash index"""
+    cells = cover_bbox(min_lat, min_lng, max_lat, max_lng)
+    ranges = [db.and_(Restroom.geohash >= cell, Restroom.geohash < prefix_upper_bound(cell))
+              for cell in cells]
+    return Restroom.query.filter(
+        db.or_(*ranges),
+        Restroom.latitude.between(min_lat, max_lat),
+        Restroom.longitude.between(min_lng, max_lng)
+    )
+
+def restrooms_in_bbox(min_lat, min_lng, max_lat, max_lng, schema=RESTROOM_SCHEMA):
+    return restrooms_in_bbox_query(min_lat, min_lng, max_lat, max_lng).with_entities(*schema.columns).all()
+
+def has_position():
+    """Whether the request ranks around the caller's coordinates"""
+    return 'lat' in request.args or 'lng' in request.args
+
+# Searches around the caller's position almost never repeat, so only the full
+# list and map boxes are cached
 @app.route('/api/restrooms', methods=['GET'])
+@response_cache.cached(RESTROOMS_CACHE, unless=has_position)
 def get_restrooms():
-    restrooms = Restroom.query.all()
-    return jsonify([{
-        'id': r.id,
-        'name': r.name,
-        'address': r.address,
-        'latitude': r.latitude,
-        'longitude': r.longitude,
-        'is_free': r.is_free,
-        'price': r.price,
-        'current_users': r.current_users,
-        'rating': r.rating,
-        'total_reviews': r.total_reviews,
-        'admin_contact': r.admin_contact,
-        'image_url': r.image_url,
-        'male_standing': r.male_standing or 0,
-        'male_sitting': r.male_sitting or 0,
-        'female_sitting': r.female_sitting or 0,
-        'disabled_access': r.disabled_access or False,
-        'images': json.loads(r.images) if r.images else []
-    } for r in restrooms])
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    bbox = request.args.get('bbox')
+    
+    # Without a location the full catalog is returned, as before
+    if lat is None and lng is None and not bbox:
+        schema = projection(RESTROOM_SCHEMA, extra=('images',))
+        rows = db.session.query(*schema.columns).all()
+        return json_response(include_images(schema.many(rows), every_restroom=True))
+    
+    if (lat is None) != (lng is None):
+        return jsonify({'error': 'lat and lng must be given together'}), 400
+    
+    limit = request.args.get('limit', DEFAULT_NEARBY_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_NEARBY_LIMIT))
+    radius_m = request.args.get('radius_m', type=float)
+    try:
+        if lat is not None:
+            check_position(lat, lng)
+        if radius_m is not None:
+            check_radius(radius_m)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Coordinates are read for ranking even when not requested
+    schema = projection(RESTROOM_SCHEMA, Restroom.latitude, Restroom.longitude, extra=('images', 'distance'))
+    
+    if bbox:
+        # The box bounds the search; radius_m only narrows it when given
+        try:
+            min_lat, min_lng, max_lat, max_lng = parse_bbox(bbox)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        candidates = restrooms_in_bbox(min_lat, min_lng, max_lat, max_lng, schema)
+        include_distance = lat is not None
+        if lat is None:
+            # Rank around the center of the box
+            lat, lng = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+    else:
+        include_distance = True
+        radius_m = radius_m or DEFAULT_SEARCH_RADIUS_M
+        candidates = restrooms_in_bbox(*radius_to_bbox(lat, lng, radius_m), schema)
+    
+    ranked = []
+    for r in candidates:
+        distance = haversine_m(lat, lng, r.latitude, r.longitude)
+        if radius_m is None or distance <= radius_m:
+            ranked.append((distance, r))
+    ranked.sort(key=lambda item: item[0])
+    
+    include_distance = include_distance and field_requested('distance')
+    results = []
+    for distance, r in ranked[:limit]:
+        item = schema.serialize(r)
+        if include_distance:
+            item['distance'] = round(distance)
+        results.append(item)
+    return json_response(include_images(results))
+
+# Recommendations rank by a score in metres: the walking distance plus a
+# penalty for a busy or poorly rated restroom, so a full restroom counts as
+# RECOMMEND_FULL_PENALTY_M further away and each missing star as
+# RECOMMEND_STAR_PENALTY_M. Restrooms without reviews count as UNRATED_STARS.
+RECOMMEND_FULL_PENALTY_M = float(os.environ.get('RECOMMEND_FULL_PENALTY_M', 500))
+RECOMMEND_STAR_PENALTY_M = float(os.environ.get('RECOMMEND_STAR_PENALTY_M', 100))
+UNRATED_STARS = 3.0
+DEFAULT_RECOMMEND_LIMIT = 5
+MAX_RECOMMEND_LIMIT = 50
+# Without ?radius_m= the search starts small and doubles until the best
+# matches are certain, so dense areas only read the rows right around the user
+RECOMMEND_START_RADIUS_M = 500
+MAX_RECOMMEND_RADIUS_M = 16 * RECOMMEND_START_RADIUS_M
+FACILITY_COLUMNS = {column.key: column for column in (
+    Restroom.male_standing, Restroom.male_sitting, Restroom.female_sitting
+)}
+GENDER_FACILITIES = {
+    'male': (Restroom.male_standing, Restroom.male_sitting),
+    'female': (Restroom.female_sitting,),
+}
+
+# Query-string filters, parsed with the import validators
+RECOMMEND_FILTERS = (
+    bulk.Field('is_free', bulk.boolean, default=False),
+    bulk.Field('max_price', bulk.count),
+    bulk.Field('disabled_access', bulk.boolean, default=False),
+    bulk.Field('gender', bulk.choice(GENDER_FACILITIES)),
+    bulk.Field('facilities', bulk.choice_list(FACILITY_COLUMNS), default=()),
+)
+
+def recommendation_filters(args):
+    """SQL conditions for the filters in args; raises ValueError naming a bad one"""
+    values = bulk.validate(args.to_dict(), RECOMMEND_FILTERS)
+    # Boolean filters only narrow the search when true
+    conditions = []
+    if values['is_free']:
+        conditions.append(Restroom.is_free.is_(True))
+    if values['max_price'] is not None:
+        conditions.append(db.or_(Restroom.is_free.is_(True), Restroom.price <= values['max_price']))
+    if values['disabled_access']:
+        conditions.append(Restroom.disabled_access.is_(True))
+    if values['gender']:
+        # Any of the gender's facilities will do
+        conditions.append(db.or_(*(column > 0 for column in GENDER_FACILITIES[values['gender']])))
+    conditions.extend(FACILITY_COLUMNS[name] > 0 for name in values['facilities'])
+    return conditions
+
+def recommendation_score(distance, restroom):
+    capacity = (restroom.male_standing or 0) + (restroom.male_sitting or 0) + (restroom.female_sitting or 0)
+    occupancy = (restroom.current_users or 0) / (capacity or 1)
+    stars = restroom.rating if restroom.total_reviews else UNRATED_STARS
+    return (distance + RECOMMEND_FULL_PENALTY_M * occupancy
+            + RECOMMEND_STAR_PENALTY_M * (5 - (stars or 0)))
+
+@app.route('/api/restrooms/recommend', methods=['GET'])
+def recommend_restrooms():
+    """The best restrooms near ?lat=&lng= that match the filters, best first
+
+    Not response-cached: every caller's position is a different key.
+    """
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    if lat is None or lng is None:
+        return jsonify({'error': 'lat and lng are required'}), 400
+    limit = request.args.get('limit', DEFAULT_RECOMMEND_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_RECOMMEND_LIMIT))
+    radius_m = request.args.get('radius_m', type=float)
+    try:
+        check_position(lat, lng)
+        if radius_m is not None:
+            check_radius(radius_m)
+        conditions = recommendation_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # The score reads these even when ?fields= leaves them out
+    schema = projection(
+        RESTROOM_SCHEMA, Restroom.latitude, Restroom.longitude, Restroom.current_users, Restroom.rating,
+        Restroom.total_reviews, *FACILITY_COLUMNS.values(), extra=('images', 'distance', 'score')
+    )
+
+    radius = radius_m or RECOMMEND_START_RADIUS_M
+    while True:
+        rows = restrooms_in_bbox_query(*radius_to_bbox(lat, lng, radius)).filter(
+            *conditions
+        ).with_entities(*schema.columns)
+        distances = ((haversine_m(lat, lng, r.latitude, r.longitude), r) for r in rows)
+        # Top-k heap over the candidates as they stream in
+        best = heapq.nsmallest(limit, (
+            (recommendation_score(distance, r), distance, r) for distance, r in distances if distance <= radius
+        ), key=lambda item: item[0])
+        # A restroom further out scores at least its distance, so once the
+        # k-th best scores within the radius widening cannot change the result
+        if radius_m or radius >= MAX_RECOMMEND_RADIUS_M or (len(best) == limit and best[-1][0] <= radius):
+            break
+        radius = min(radius * 2, MAX_RECOMMEND_RADIUS_M)
+
+    include_distance = field_requested('distance')
+    include_score = field_requested('score')
+    results = []
+    for score, distance, r in best:
+        item = schema.serialize(r)
+        if include_distance:
+            item['distance'] = round(distance)
+        if include_score:
+            item['score'] = round(score)
+        results.append(item)
+    return json_response(include_images(results))
+
+# Static catalog and live status, so map refreshes only fetch what changes
+CATALOG_MAX_AGE_SECONDS = int(os.environ.get('CATALOG_MAX_AGE_SECONDS', 3600))
+MAX_STATUS_IDS = 500
+
+@app.route('/api/restrooms/catalog', methods=['GET'])
+@response_cache.cached(CATALOG_CACHE, cache_control=f'public, max-age={CATALOG_MAX_AGE_SECONDS}')
+def get_restroom_catalog():
+    """Static restroom fields, optionally only those changed after ?since=<version>"""
+    since = request.args.get('since', type=int)
+    bbox = request.args.get('bbox')
+    
+    # Read the version first: rows changed meanwhile are sent again next time
+    version = current_version(CATALOG_VERSION)
+    if bbox:
+        try:
+            query = restrooms_in_bbox_query(*parse_bbox(bbox))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        query = Restroom.query
+    if since is not None:
+        # Ordered along ix_restroom_catalog_version so deltas avoid a scan
+        query = query.filter(changed_since(CATALOG_VERSION, since)).order_by(
+            Restroom.catalog_version, Restroom.id)
+    else:
+        query = query.order_by(Restroom.id)
+    
+    schema = projection(RESTROOM_CATALOG_SCHEMA, extra=('images',))
+    rows = query.with_entities(*schema.columns).all()
+    every_restroom = since is None and not bbox
+    return json_response({
+        'version': version,
+        'restrooms': include_images(schema.many(rows), every_restroom)
+    })
+
+@app.route('/api/restrooms/status', methods=['GET'])
+def get_restroom_status():
+    """Live occupancy and rating for the restrooms in view.
+    
+    Select restrooms with ?ids=1,2,3, ?bbox=... or ?lat=&lng=&radius_m=, and
+    pass ?since=<version> to get only those changed after that version.
+    Each entry is id -> [current_users, rating, total_reviews].
+    """
+    since = request.args.get('since', type=int)
+    ids = request.args.get('ids')
+    bbox = request.args.get('bbox')
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    
+    versions = current_versions(STATUS_VERSION, CATALOG_VERSION)
+    columns = (Restroom.id, Restroom.current_users, Restroom.rating, Restroom.total_reviews)
+    try:
+        if ids:
+            id_list = [int(i) for i in ids.split(',')][:MAX_STATUS_IDS]
+            query = db.session.query(*columns).filter(Restroom.id.in_(id_list))
+        elif bbox:
+            query = restrooms_in_bbox_query(*parse_bbox(bbox)).with_entities(*columns)
+        elif lat is not None and lng is not None:
+            radius_m = request.args.get('radius_m', DEFAULT_SEARCH_RADIUS_M, type=float)
+            check_position(lat, lng)
+            check_radius(radius_m)
+            query = restrooms_in_bbox_query(*radius_to_bbox(lat, lng, radius_m)).with_entities(*columns)
+        else:
+            return jsonify({'error': 'ids, bbox or lat/lng is required'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if since is not None:
+        query = query.filter(changed_since(STATUS_VERSION, since))
+    
+    return json_response({
+        'version': versions[STATUS_VERSION],
+        'catalog_version': versions[CATALOG_VERSION],
+        'restrooms': {
+            str(restroom_id): [current_users or 0, round(rating or 0, 2), total_reviews or 0]
+            for restroom_id, current_users, rating, total_reviews in query.all()
+        }
+    })
 
 @app.route('/api/restrooms/<int:restroom_id>', methods=['GET'])
+@response_cache.cached(RESTROOMS_CACHE)
 def get_restroom_details(restroom_id):
-    restroom = Restroom.query.get_or_404(restroom_id)
-    reviews = Review.query.filter_by(restroom_id=restroom_id).order_by(Review.created_at.desc()).limit(10).all()
-    
-    return jsonify({
-        'id': restroom.id,
-        'name': restroom.name,
-        'address': restroom.address,
-        'latitude': restroom.latitude,
-        'longitude': restroom.longitude,
-        'is_free': restroom.is_free,
-        'price': restroom.price,
-        'current_users': restroom.current_users,
-        'rating': restroom.rating,
-        'total_reviews': restroom.total_reviews,
-        'admin_contact': restroom.admin_contact,
-        'image_url': restroom.image_url,
-        'images': json.loads(restroom.images) if restroom.images else [],
-        'reviews': [{
-            'id': rev.id,
-            'rating': rev.rating,
-            'comment': rev.comment,
-            'image_path': rev.image_path,
-            'created_at': rev.created_at.isoformat()
-        } for rev in reviews]
-    })
+    fields = fields_arg(request.args)
+    check_fields(fields, RESTROOM_SUMMARY_SCHEMA, extra=RESTROOM_DETAIL_EXTRA_FIELDS)
+    schema = RESTROOM_SUMMARY_SCHEMA.project(fields)
+    restroom = db.session.query(*schema.columns).filter(Restroom.id == restroom_id).first()
+    if restroom is None:
+        abort(404)
+    
+    data = schema.serialize(restroom)
+    # Images and reviews are only queried when asked for (always without ?fields=)
+    if fields is None or 'images' in fields:
+        data['images'] = restroom_images([restroom_id]).get(restroom_id, [])
+    review_fields = nested_fields(fields, 'reviews')
+    if review_fields is None or review_fields:
+        review_schema = REVIEW_SCHEMA.project(review_fields)
+        reviews = db.session.query(*review_schema.columns).filter(
+            Review.restroom_id == restroom_id
+        ).order_by(Review.created_at.desc()).limit(10).all()
+        data['reviews'] = review_schema.many(reviews)
+    return json_response(data)
 
 @app.route('/api/users', methods=['POST'])
 def create_user():
@@ -185,6 +876,15 @@ def create_user():
         'username': user.username
     }), 201
 
+GUEST_NAME = "Khách"
+
+def restroom_for_notification(restroom_id, user_id):
+    """Restroom owner, name and the acting user's name in one query (None if no such restroom)"""
+    username = db.select(User.username).where(User.id == user_id).scalar_subquery()
+    return db.session.query(
+        Restroom.owner_id, Restroom.name, username.label('username')
+    ).filter(Restroom.id == restroom_id).first()
+
 @app.route('/api/reviews', methods=['POST'])
 def create_review():
     data = request.get_json()
@@ -194,37 +894,106 @@ def create_review():
         user_id=data['user_id'],
         rating=data['rating'],
         comment=data.get('comment', ''),
-        image_path=data.get('image_path', '')
+        image_path=store_image(data.get('image_path', ''))
     )
     
     db.session.add(review)
     
-    # Update restroom rating
-    restroom = Restroom.query.get(data['restroom_id'])
-    reviews = Review.query.filter_by(restroom_id=data['restroom_id']).all()
-    total_rating = sum(r.rating for r in reviews) + data['rating']
-    total_reviews = len(reviews) + 1
-    restroom.rating = total_rating / total_reviews
-    restroom.total_reviews = total_reviews
+    # Update restroom rating in a single atomic UPDATE. SET expressions see the
+    # pre-update row, so concurrent reviews cannot overwrite each other.
+    restroom = restroom_for_notification(data['restroom_id'], data.get('user_id'))
+    if restroom is None:
+        abort(404)
+    db.session.execute(
+        db.update(Restroom)
+        .where(Restroom.id == data['restroom_id'])
+        .values(
+            rating_sum=Restroom.rating_sum + data['rating'],
+            total_reviews=Restroom.total_reviews + 1,
+            rating=db.cast(Restroom.rating_sum + data['rating'], db.Float) / (Restroom.total_reviews + 1),
+            status_version=version_stamp()
+        )
+        .execution_options(synchronize_session=False)
+    )
     
     # Send notification to owner if restroom has owner
+    notification = None
     if restroom.owner_id:
-        user = User.query.get(data['user_id']) if data.get('user_id') else None
-        username = user.username if user else "Khách"
+        username = restroom.username or GUEST_NAME
         
-        notification = Notification(
+        notification = dict(
             owner_id=restroom.owner_id,
             restroom_id=data['restroom_id'],
             user_id=data.get('user_id'),
             type='review',
             message=f'{username} đã đánh giá {data["rating"]} sao cho {restroom.name}'
         )
-        db.session.add(notification)
     
     db.session.commit()
+    response_cache.invalidate(RESTROOMS_CACHE)
+    if notification:
+        enqueue_notification(**notification)
     
     return jsonify({'message': 'Review created successfully'}), 201
 
+def publish_notification(notification, restroom_name):
+    """Push a committed notification to its owner's (and user's) stream"""
+    item = NOTIFICATION_SCHEMA.from_object(notification, **{
+        'restroom.id': notification.restroom_id,
+        'restroom.name': restroom_name
+    })
+    event_bus.publish(owner_channel(notification.owner_id), 'notification', item)
+    if notification.type == 'payment_status' and notification.user_id:
+        event_bus.publish(user_channel(notification.user_id), 'notification', item)
+
+def write_notifications(batch):
+    """Insert queued notifications in one transaction, then publish them"""
+    if not has_app_context():
+        # Called from the queue's worker thread
+        with app.app_context():
+            return write_notifications(batch)
+    # Synchronous writes (queue full or disabled) reuse the request's session
+    # and pooled connection; they are back-pressure, not the route's own SQL,
+    # so they are not charged to its query budget
+    with query_counter.paused():
+        notifications = [Notification(**values) for values in batch]
+        try:
+            db.session.add_all(notifications)
+            unread = Counter(n.owner_id for n in notifications if not n.is_read)
+            if unread:
+                # Core UPDATE, executemany over the owners in this batch
+                owners = Owner.__table__
+                db.session.execute(
+                    owners.update().where(owners.c.id == db.bindparam('owner_id')).values(
+                        unread_notifications=owners.c.unread_notifications + db.bindparam('count')
+                    ),
+                    [{'owner_id': owner_id, 'count': count} for owner_id, count in unread.items()]
+                )
+            db.session.commit()
+        except Exception:
+            # Leave the session usable for the queue's retry (and the request)
+            db.session.rollback()
+            raise
+        restroom_ids = {n.restroom_id for n in notifications}
+        names = dict(db.session.query(Restroom.id, Restroom.name).filter(Restroom.id.in_(restroom_ids)))
+    for notification in notifications:
+        publish_notification(notification, names.get(notification.restroom_id))
+
+# Notifications are written behind the request; NOTIFICATION_QUEUE_SIZE=0
+# writes each one synchronously instead
+notification_queue = WriteBehindQueue(
+    write_notifications,
+    max_size=int(os.environ.get('NOTIFICATION_QUEUE_SIZE', 10000)),
+    interval=int(os.environ.get('NOTIFICATION_FLUSH_MS', 50)) / 1000,
+    name='notification-writer'
+)
+
+def enqueue_notification(**values):
+    """Queue a notification; it is stored and pushed within one flush interval"""
+    values.setdefault('created_at', datetime.utcnow())
+    values.setdefault('is_read', False)
+    notification_queue.put(values)
+
 @app.route('/api/chat/messages', methods=['POST'])
 def send_message():
     data = request.get_json()
@@ -239,25 +1008,25 @@ def send_message():
     
     db.session.add(message)
     db.session.commit()
+    event_bus.publish(chat_channel(message.restroom_id), 'chat_message', CHAT_MESSAGE_SCHEMA.from_object(message))
     
-    return jsonify({'message': 'Message sent successfully'}), 201
+    return jsonify({'message': 'Message sent successfully', 'id': message.id}), 201
 
 @app.route('/api/restrooms/<int:restroom_id>/navigation', methods=['POST'])
 def request_navigation(restroom_id):
     data = request.get_json()
     user_id = data.get('user_id')
     
-    # Get restroom and owner
-    restroom = Restroom.query.get_or_404(restroom_id)
+    # Get restroom, owner and user info for the notification
+    restroom = restroom_for_notification(restroom_id, user_id)
+    if restroom is None:
+        abort(404)
     if not restroom.owner_id:
         return jsonify({'error': 'Restroom has no owner'}), 400
-    
-    # Get user info for notification
-    user = User.query.get(user_id) if user_id else None
-    username = user.username if user else "Khách"
+    username = restroom.username or GUEST_NAME
     
     # Create notification for owner
-    notification = Notification(
+    enqueue_notification(
         owner_id=restroom.owner_id,
         restroom_id=restroom_id,
         user_id=user_id,
@@ -265,9 +1034,6 @@ def request_navigation(restroom_id):
         message=f'{username} đang xin chỉ đường đến {restroom.name}'
     )
     
-    db.session.add(notification)
-    db.session.commit()
-    
     return jsonify({'message': 'Navigation request sent to owner'}), 201
 
 @app.route('/api/restrooms/<int:restroom_id>/arrival', methods=['POST'])
@@ -275,17 +1041,16 @@ def notify_arrival(restroom_id):
     data = request.get_json()
     user_id = data.get('user_id')
     
-    # Get restroom and owner
-    restroom = Restroom.query.get_or_404(restroom_id)
+    # Get restroom, owner and user info for the notification
+    restroom = restroom_for_notification(restroom_id, user_id)
+    if restroom is None:
+        abort(404)
     if not restroom.owner_id:
         return jsonify({'error': 'Restroom has no owner'}), 400
-    
-    # Get user info for notification
-    user = User.query.get(user_id) if user_id else None
-    username = user.username if user else "Khách"
+    username = restroom.username or GUEST_NAME
     
     # Create notification for owner
-    notification = Notification(
+    enqueue_notification(
         owner_id=restroom.owner_id,
         restroom_id=restroom_id,
         user_id=user_id,
@@ -293,9 +1058,6 @@ def notify_arrival(restroom_id):
         message=f'{username} đã đến {restroom.name}'
     )
     
-    db.session.add(notification)
-    db.session.commit()
-    
     return jsonify({'message': 'Arrival notification sent to owner'}), 201
 
 @app.route('/api/restrooms/<int:restroom_id>/notify-owner', methods=['POST'])
@@ -305,17 +1067,16 @@ def notify_owner(restroom_id):
     notification_type = data.get('type')
     message = data.get('message')
     
-    # Get restroom and owner
-    restroom = Restroom.query.get_or_404(restroom_id)
+    # Get restroom, owner and user info for the notification
+    restroom = restroom_for_notification(restroom_id, user_id)
+    if restroom is None:
+        abort(404)
     if not restroom.owner_id:
         return jsonify({'error': 'Restroom has no owner'}), 400
-    
-    # Get user info for notification
-    user = User.query.get(user_id) if user_id else None
-    username = user.username if user else "Khách"
+    username = restroom.username or GUEST_NAME
     
     # Create notification for owner
-    notification = Notification(
+    enqueue_notification(
         owner_id=restroom.owner_id,
         restroom_id=restroom_id,
         user_id=user_id,
@@ -323,23 +1084,68 @@ def notify_owner(restroom_id):
         message=f'{username}: {message}'
     )
     
-    db.session.add(notification)
-    db.session.commit()
-    
     return jsonify({'message': 'Notification sent to owner'}), 201
 
+DEFAULT_CHAT_PAGE_SIZE = 100
+MAX_CHAT_PAGE_SIZE = 500
+CHAT_MESSAGE_PAGE_KEYS = (ChatMessage.id,)
+MAX_CHAT_WAIT_SECONDS = 30
+
+def newer_chat_messages(restroom_id, since_id, limit, schema=CHAT_MESSAGE_SCHEMA):
+    """Select messages after since_id, oldest first (also run by the ASGI long-poll)"""
+    return db.select(*schema.columns).where(
+        ChatMessage.restroom_id == restroom_id,
+        ChatMessage.id > since_id
+    ).order_by(ChatMessage.id.asc()).limit(limit)
+
 @app.route('/api/chat/messages/<int:restroom_id>', methods=['GET'])
 def get_messages(restroom_id):
-    messages = ChatMessage.query.filter_by(restroom_id=restroom_id).order_by(ChatMessage.created_at.asc()).all()
-    
-    return jsonify([{
-        'id': msg.id,
-        'user_id': msg.user_id,
-        'message': msg.message,
-        'message_type': msg.message_type,
-        'is_from_admin': msg.is_from_admin,
-        'created_at': msg.created_at.isoformat()
-    } for msg in messages])
+    since_id = request.args.get('since_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    schema = projection(CHAT_MESSAGE_SCHEMA, *CHAT_MESSAGE_PAGE_KEYS)
+    
+    if since_id is None and before_id is None and is_page_request(request.args):
+        # Keyset pages from the newest message backwards
+        query = db.session.query(*schema.columns).filter(ChatMessage.restroom_id == restroom_id)
+        return paginated_response(query, schema, CHAT_MESSAGE_PAGE_KEYS, descending=True,
+                                  default_limit=DEFAULT_CHAT_PAGE_SIZE, max_limit=MAX_CHAT_PAGE_SIZE)
+    
+    # Without a cursor the full history is returned, as before
+    if since_id is None and before_id is None:
+        messages = db.session.query(*schema.columns).filter(
+            ChatMessage.restroom_id == restroom_id
+        ).order_by(ChatMessage.id.asc()).all()
+        return json_response(schema.many(messages))
+    
+    limit = request.args.get('limit', DEFAULT_CHAT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_CHAT_PAGE_SIZE))
+    
+    if before_id is not None:
+        # Older page: newest first from the index, returned oldest first
+        messages = db.session.query(*schema.columns).filter(
+            ChatMessage.restroom_id == restroom_id,
+            ChatMessage.id < before_id
+        ).order_by(ChatMessage.id.desc()).limit(limit).all()
+        messages.reverse()
+        return json_response(schema.many(messages))
+    
+    def newer_messages():
+        return db.session.execute(newer_chat_messages(restroom_id, since_id, limit, schema)).all()
+    
+    wait = min(request.args.get('wait', 0, type=float), MAX_CHAT_WAIT_SECONDS)
+    if wait <= 0:
+        return json_response(schema.many(newer_messages()))
+    
+    # Long-poll: subscribe before querying so no message slips in between,
+    # then release the DB session while idle and query again once woken
+    with event_bus.subscribe([chat_channel(restroom_id)]) as subscription:
+        messages = newer_messages()
+        if not messages:
+            db.session.remove()
+            subscription.get(timeout=wait)
+            messages = newer_messages()
+    
+    return json_response(schema.many(messages))
 
 # Authentication APIs
 @app.route('/api/auth/register', methods=['POST'])
@@ -352,11 +1158,12 @@ def register_user():
     if not username or not password:
         return jsonify({'error': 'Username and password are required'}), 400
     
-    # Check if username already exists
-    existing_user = User.query.filter_by(username=username).first()
-    existing_owner = Owner.query.filter_by(email=username).first()
+    # Check if username already exists (as a user or an owner email)
+    taken = db.session.query(
+        db.exists().where(User.username == username) | db.exists().where(Owner.email == username)
+    ).scalar()
     
-    if existing_user or existing_owner:
+    if taken:
         return jsonify({'error': 'Username already exists'}), 409
     
     if role == 'owner':
@@ -430,68 +1237,274 @@ def check_username(username):
     return jsonify({'exists': existing_user is not None})
 
 # User history APIs
+USAGE_HISTORY_PAGE_KEYS = (UsageHistory.created_at, UsageHistory.id)
+REVIEW_HISTORY_PAGE_KEYS = (Review.created_at, Review.id)
+# Marks a history list the client has already paged to the end
+HISTORY_PAGE_DONE = 'done'
+
+def user_usage_history_query(user_id, schema=USAGE_HISTORY_SCHEMA):
+    return db.session.query(*schema.columns).join(
+        Restroom, UsageHistory.restroom_id == Restroom.id
+    ).filter(UsageHistory.user_id == user_id)
+
+def user_review_history_query(user_id, schema=REVIEW_HISTORY_SCHEMA):
+    return db.session.query(*schema.columns).join(
+        Restroom, Review.restroom_id == Restroom.id
+    ).filter(Review.user_id == user_id)
+
+def history_projections(always=('id',)):
+    """Usage and review history schemas narrowed to ?fields=, which applies to both lists"""
+    names = fields_arg(request.args)
+    check_fields(names, USAGE_HISTORY_SCHEMA, REVIEW_HISTORY_SCHEMA)
+    return (USAGE_HISTORY_SCHEMA.project(names, USAGE_HISTORY_PAGE_KEYS, always),
+            REVIEW_HISTORY_SCHEMA.project(names, REVIEW_HISTORY_PAGE_KEYS, always))
+
+def user_history_page(user_id, cursor, limit, schemas=(USAGE_HISTORY_SCHEMA, REVIEW_HISTORY_SCHEMA)):
+    """Next page of both history lists, up to ``limit`` rows each.
+    
+    The cursor holds one position per list; a list that has been paged to
+    its end is marked done and no longer queried.
+    """
+    if cursor is None:
+        cursor = [None, None]
+    if len(cursor) != 2:
+        raise ValueError('Invalid cursor')
+    
+    usage_schema, review_schema = schemas
+    body = {}
+    next_positions = []
+    for name, schema, query, keys, position in (
+        ('usage_history', usage_schema, user_usage_history_query(user_id, usage_schema), USAGE_HISTORY_PAGE_KEYS,
+         cursor[0]),
+        ('reviews', review_schema, user_review_history_query(user_id, review_schema), REVIEW_HISTORY_PAGE_KEYS,
+         cursor[1]),
+    ):
+        if position == HISTORY_PAGE_DONE:
+            body[name] = []
+            next_positions.append(HISTORY_PAGE_DONE)
+            continue
+        if position is not None and not isinstance(position, list):
+            raise ValueError('Invalid cursor')
+        rows, next_cursor = keyset_page(query, keys, position, limit, descending=True)
+        body[name] = schema.many(rows)
+        next_positions.append(decode_cursor(next_cursor) if next_cursor else HISTORY_PAGE_DONE)
+    
+    done = all(position == HISTORY_PAGE_DONE for position in next_positions)
+    body['next_cursor'] = None if done else encode_cursor(next_positions)
+    return body
+
 @app.route('/api/users/<int:user_id>/history', methods=['GET'])
 def get_user_history(user_id):
+    usage_schema, review_schema = history_projections()
+    if is_page_request(request.args):
+        try:
+            cursor, limit = page_args(request.args)
+            return json_response(user_history_page(user_id, cursor, limit, (usage_schema, review_schema)))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
     # Get usage history
-    usage_history = db.session.query(UsageHistory, Restroom).join(
-        Restroom, UsageHistory.restroom_id == Restroom.id
-    ).filter(UsageHistory.user_id == user_id).order_by(
-        UsageHistory.created_at.desc()
-    ).all()
+    usage_history = user_usage_history_query(user_id, usage_schema).order_by(UsageHistory.created_at.desc()).all()
     
     # Get user reviews
-    reviews = db.session.query(Review, Restroom).join(
-        Restroom, Review.restroom_id == Restroom.id
-    ).filter(Review.user_id == user_id).order_by(
-        Review.created_at.desc()
-    ).all()
-    
-    history_data = []
-    for usage, restroom in usage_history:
-        history_data.append({
-            'id': usage.id,
-            'type': 'usage',
-            'restroom_name': restroom.name,
-            'restroom_address': restroom.address,
-            'start_time': usage.start_time.isoformat(),
-            'end_time': usage.end_time.isoformat() if usage.end_time else None,
-            'duration_minutes': usage.duration_minutes,
-            'created_at': usage.created_at.isoformat()
-        })
-    
-    review_data = []
-    for review, restroom in reviews:
-        review_data.append({
-            'id': review.id,
-            'type': 'review',
-            'restroom_name': restroom.name,
-            'restroom_address': restroom.address,
-            'rating': review.rating,
-            'comment': review.comment,
-            'image_path': review.image_path,
-            'created_at': review.created_at.isoformat()
-        })
+    reviews = user_review_history_query(user_id, review_schema).order_by(Review.created_at.desc()).all()
     
-    return jsonify({
-        'usage_history': history_data,
-        'reviews': review_data
+    return json_response({
+        'usage_history': usage_schema.many(usage_history),
+        'reviews': review_schema.many(reviews)
     })
 
+# Timeline entries are ordered newest first by (created_at, type, id), so
+# every entry keeps those fields whatever ?fields= asks for
+TIMELINE_STREAMS = (
+    ('usage', user_usage_history_query, USAGE_HISTORY_PAGE_KEYS),
+    ('review', user_review_history_query, REVIEW_HISTORY_PAGE_KEYS),
+)
+TIMELINE_KEY_FIELDS = ('id', 'type', 'created_at')
+TIMELINE_BATCH_SIZE = 500
+
+def timeline_key(item):
+    return item['created_at'], item['type'], item['id']
+
+def timeline_after(entry_type, keys, cursor):
+    """Criterion for one stream's entries that sort after the cursor entry"""
+    if len(cursor) != 3 or not isinstance(cursor[1], str):
+        raise ValueError('Invalid cursor')
+    created_at, cursor_type, cursor_id = cursor
+    if entry_type == cursor_type:
+        return keyset_after(keys, [created_at, cursor_id], descending=True)
+    try:
+        created_at = datetime.fromisoformat(created_at)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    # Other types break created_at ties by type name
+    return keys[0] <= created_at if entry_type < cursor_type else keys[0] < created_at
+
+def parse_timeline_bound(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO 8601 datetime')
+
+@app.route('/api/users/<int:user_id>/timeline', methods=['GET'])
+def get_user_timeline(user_id):
+    """Usage sessions and reviews merged into one list, newest first.
+    
+    ?since= and ?until= bound created_at (since inclusive, until exclusive).
+    With ?limit= (and ?cursor=) the response is one page; without it the
+    whole timeline is streamed. Each table is read in index order in batches
+    and the two cursors are merged lazily, so memory stays flat however long
+    the user's history is.
+    """
+    try:
+        since = parse_timeline_bound('since')
+        until = parse_timeline_bound('until')
+        cursor, limit = page_args(request.args) if is_page_request(request.args) else (None, None)
+        streams = []
+        schemas = history_projections(always=TIMELINE_KEY_FIELDS)
+        for (entry_type, base_query, keys), schema in zip(TIMELINE_STREAMS, schemas):
+            query = base_query(user_id, schema)
+            if since is not None:
+                query = query.filter(keys[0] >= since)
+            if until is not None:
+                query = query.filter(keys[0] < until)
+            if cursor is not None:
+                query = query.filter(timeline_after(entry_type, keys, cursor))
+            query = query.order_by(*keyset_order_by(keys, descending=True))
+            if limit is not None:
+                query = query.limit(limit + 1)
+            streams.append((schema, query.yield_per(TIMELINE_BATCH_SIZE)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def generate():
+        entries = heapq.merge(*(map(schema.serialize, rows) for schema, rows in streams),
+                              key=timeline_key, reverse=True)
+        if limit is not None:
+            entries = itertools.islice(entries, limit + 1)
+        yield b'{"items":['
+        last = None
+        for count, entry in enumerate(entries):
+            if limit is not None and count == limit:
+                # One entry past the page: there is a next page after ``last``
+                yield b'],"next_cursor":' + dumps(encode_cursor(timeline_key(last))) + b'}'
+                return
+            yield (b',' if count else b'') + dumps(entry)
+            last = entry
+        yield b'],"next_cursor":null}'
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+# Usage sessions never stopped by the client are closed after this long
+USAGE_SESSION_TIMEOUT_MINUTES = int(os.environ.get('USAGE_SESSION_TIMEOUT_MINUTES', 180))
+
+def adjust_current_users(restroom_id, delta):
+    """Atomically add delta to a restroom's occupancy, never going below zero"""
+    db.session.execute(
+        db.update(Restroom)
+        .where(Restroom.id == restroom_id)
+        .values(current_users=db.case(
+            (Restroom.current_users + delta < 0, 0),
+            else_=Restroom.current_users + delta
+        ), status_version=version_stamp())
+        .execution_options(synchronize_session=False)
+    )
+
+def close_usage_session(usage_id, start_time, end_time):
+    """Close an open usage row; returns False if another request closed it first"""
+    result = db.session.execute(
+        db.update(UsageHistory)
+        .where(UsageHistory.id == usage_id, UsageHistory.end_time.is_(None))
+        .values(end_time=end_time,
+                duration_minutes=int((end_time - start_time).total_seconds() / 60))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def expire_stale_sessions(now=None):
+    """Close usage sessions older than the timeout and free their users.
+    
+    The session is closed at start_time + timeout. Returns the number of
+    sessions expired.
+    """
+    now = now or datetime.utcnow()
+    timeout = timedelta(minutes=USAGE_SESSION_TIMEOUT_MINUTES)
+    stale = db.session.query(UsageHistory.id, UsageHistory.user_id, UsageHistory.restroom_id,
+                             UsageHistory.start_time).filter(
+        UsageHistory.end_time.is_(None),
+        UsageHistory.start_time < now - timeout
+    ).all()
+    
+    expired = 0
+    for usage_id, user_id, restroom_id, start_time in stale:
+        if close_usage_session(usage_id, start_time, start_time + timeout):
+            expired += 1
+            db.session.execute(
+                db.update(User)
+                .where(User.id == user_id, User.current_restroom_id == restroom_id)
+                .values(current_restroom_id=None, is_using=False, start_time=None)
+                .execution_options(synchronize_session=False)
+            )
+    db.session.commit()
+    return expired
+
+def reconcile_occupancy():
+    """Reset current_users to the number of open usage sessions.
+    
+    Returns the number of restrooms whose counter had drifted.
+    """
+    open_sessions = db.select(db.func.count(UsageHistory.id)).where(
+        UsageHistory.restroom_id == Restroom.id,
+        UsageHistory.end_time.is_(None)
+    ).scalar_subquery()
+    result = db.session.execute(
+        db.update(Restroom)
+        .where(db.func.coalesce(Restroom.current_users, 0) != open_sessions)
+        .values(current_users=open_sessions, status_version=version_stamp())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+def sweep_usage_sessions():
+    expired = expire_stale_sessions()
+    drifted = reconcile_occupancy()
+    if expired or drifted:
+        response_cache.invalidate(RESTROOMS_CACHE)
+    return expired, drifted
+
+@app.cli.command('sweep-usage')
+def sweep_usage_command():
+    """Expire abandoned usage sessions and reconcile occupancy counters"""
+    expired, drifted = sweep_usage_sessions()
+    print(f"Expired {expired} session(s), corrected {drifted} occupancy counter(s)")
+
+def run_usage_sweeper(interval_seconds):
+    """Background loop used by the development server"""
+    while True:
+        time.sleep(interval_seconds)
+        with app.app_context():
+            try:
+                sweep_usage_sessions()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Usage sweep failed: {e}")
+
 @app.route('/api/users/<int:user_id>/start-using/<int:restroom_id>', methods=['POST'])
 def start_using_restroom(user_id, restroom_id):
-    user = User.query.get_or_404(user_id)
-    restroom = Restroom.query.get_or_404(restroom_id)
+    found = db.session.query(User, Restroom.is_free).filter(
+        User.id == user_id
+    ).join(Restroom, Restroom.id == restroom_id).first()
+    if found is None:
+        abort(404)
+    user, is_free = found
     
     # Check if restroom requires payment
-    if not restroom.is_free:
-        # Check for confirmed payment
-        confirmed_payment = Payment.query.filter_by(
-            user_id=user_id,
-            restroom_id=restroom_id,
-            status='confirmed'
-        ).order_by(Payment.created_at.desc()).first()
-        
-        if not confirmed_payment:
+    if not is_free:
+        if payment_entitlement(user_id, restroom_id)['confirmed_payment_id'] is None:
             return jsonify({'error': 'Payment required', 'requires_payment': True}), 402
     
     # Update user status
@@ -499,18 +1512,18 @@ def start_using_restroom(user_id, restroom_id):
     user.is_using = True
     user.start_time = datetime.utcnow()
     
-    # Update restroom current users count
-    restroom.current_users += 1
-    
     # Create usage history record
     usage_history = UsageHistory(
         user_id=user_id,
         restroom_id=restroom_id,
         start_time=datetime.utcnow()
     )
-    
     db.session.add(usage_history)
+    
+    # Update restroom current users count with an atomic increment
+    adjust_current_users(restroom_id, 1)
     db.session.commit()
+    response_cache.invalidate(RESTROOMS_CACHE)
     
     return jsonify({'success': True})
 
@@ -519,23 +1532,16 @@ def stop_using_restroom(user_id):
     user = User.query.get_or_404(user_id)
     
     if user.current_restroom_id:
-        # Update restroom current users count
-        restroom = Restroom.query.get(user.current_restroom_id)
-        if restroom and restroom.current_users > 0:
-            restroom.current_users -= 1
+        usage_history = UsageHistory.query.filter_by(
+            user_id=user_id,
+            restroom_id=user.current_restroom_id,
+            end_time=None
+        ).first()
         
-        # Update usage history
-        if user.start_time:
-            usage_history = UsageHistory.query.filter_by(
-                user_id=user_id,
-                restroom_id=user.current_restroom_id,
-                end_time=None
-            ).first()
-            
-            if usage_history:
-                usage_history.end_time = datetime.utcnow()
-                duration = usage_history.end_time - usage_history.start_time
-                usage_history.duration_minutes = int(duration.total_seconds() / 60)
+        # Only the request that actually closes the session decrements the
+        # count, so a duplicate stop cannot push it below the real occupancy
+        if usage_history and close_usage_session(usage_history.id, usage_history.start_time, datetime.utcnow()):
+            adjust_current_users(user.current_restroom_id, -1)
     
     # Reset user status
     user.current_restroom_id = None
@@ -543,6 +1549,7 @@ def stop_using_restroom(user_id):
     user.start_time = None
     
     db.session.commit()
+    response_cache.invalidate(RESTROOMS_CACHE)
     
     return jsonify({'success': True})
 
@@ -587,7 +1594,10 @@ def register_owner():
             )
             db.session.add(restroom)
         
+        if restrooms_data:
+            mark_catalog_changed(Restroom.owner_id == owner.id)
         db.session.commit()
+        response_cache.invalidate(RESTROOMS_CACHE, CATALOG_CACHE)
         return jsonify({'status': 'success', 'owner_id': owner.id})
     
     except Exception as e:
@@ -595,50 +1605,26 @@ def register_owner():
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
 @app.route('/api/owner/<int:owner_id>/restrooms', methods=['GET'])
+@response_cache.cached(RESTROOMS_CACHE)
 def get_owner_restrooms(owner_id):
-    restrooms = Restroom.query.filter_by(owner_id=owner_id).all()
-    return jsonify([{
-        'id': r.id,
-        'name': r.name,
-        'address': r.address,
-        'latitude': r.latitude,
-        'longitude': r.longitude,
-        'is_free': r.is_free,
-        'price': r.price,
-        'current_users': r.current_users,
-        'rating': r.rating,
-        'total_reviews': r.total_reviews,
-        'admin_contact': r.admin_contact,
-        'image_url': r.image_url
-    } for r in restrooms])
+    schema = projection(RESTROOM_SUMMARY_SCHEMA, *OWNER_RESTROOM_PAGE_KEYS)
+    query = db.session.query(*schema.columns).filter(Restroom.owner_id == owner_id)
+    if is_page_request(request.args):
+        return paginated_response(query, schema, OWNER_RESTROOM_PAGE_KEYS)
+    return json_response(schema.many(query.all()))
 
 @app.route('/api/owner/<string:email>/restrooms', methods=['GET'])
+@response_cache.cached(RESTROOMS_CACHE)
 def get_owner_restrooms_by_email(email):
     owner = Owner.query.filter_by(email=email).first()
     if not owner:
         return jsonify({'error': 'Owner not found'}), 404
     
-    restrooms = Restroom.query.filter_by(owner_id=owner.id).all()
-    return jsonify([{
-        'id': r.id,
-        'name': r.name,
-        'address': r.address,
-        'latitude': r.latitude,
-        'longitude': r.longitude,
-        'is_free': r.is_free,
-        'price': r.price,
-        'current_users': r.current_users,
-        'rating': r.rating,
-        'total_reviews': r.total_reviews,
-        'admin_contact': r.admin_contact,
-        'image_url': r.image_url,
-        'male_standing': r.male_standing or 0,
-        'male_sitting': r.male_sitting or 0,
-        'female_sitting': r.female_sitting or 0,
-        'disabled_access': r.disabled_access or False,
-        'images': json.loads(r.images) if r.images else [],
-        'created_at': r.created_at.isoformat() if r.created_at else None
-    } for r in restrooms])
+    schema = projection(OWNER_RESTROOM_SCHEMA, *OWNER_RESTROOM_PAGE_KEYS, extra=('images',))
+    query = db.session.query(*schema.columns).filter(Restroom.owner_id == owner.id)
+    if is_page_request(request.args):
+        return paginated_response(query, schema, OWNER_RESTROOM_PAGE_KEYS, transform=include_images)
+    return json_response(include_images(schema.many(query.all())))
 
 @app.route('/api/owner/restrooms', methods=['POST'])
 def create_restroom():
@@ -657,11 +1643,6 @@ def create_restroom():
     male_toilets = data.get('maleToilets', {})
     female_toilets = data.get('femaleToilets', {})
     
-    # Handle images - convert array to JSON string
-    images_json = None
-    if data.get('images'):
-        images_json = json.dumps(data.get('images'))
-    
     restroom = Restroom(
         name=data['name'],
         address=data['address'],
@@ -674,12 +1655,17 @@ def create_restroom():
         male_standing=male_toilets.get('standing', 0),
         male_sitting=male_toilets.get('sitting', 0), 
         female_sitting=female_toilets.get('sitting', 0),
-        disabled_access=data.get('disabledAccess', False),
-        images=images_json
+        disabled_access=data.get('disabledAccess', False)
     )
     
     db.session.add(restroom)
+    db.session.flush()  # Get restroom ID
+    image_rows = restroom_image_rows(restroom.id, data.get('images'))
+    if image_rows:
+        db.session.execute(db.insert(RestroomImage), image_rows)
+    mark_catalog_changed(Restroom.id == restroom.id)
     db.session.commit()
+    response_cache.invalidate(RESTROOMS_CACHE, CATALOG_CACHE)
     
     return jsonify({'status': 'success', 'restroom_id': restroom.id})
 
@@ -716,47 +1702,385 @@ def update_restroom(restroom_id):
         female_toilets = data['femaleToilets']
         restroom.female_sitting = female_toilets.get('sitting', restroom.female_sitting)
     
-    # Handle images - convert array to JSON string
+    # Inline images are moved to the blob store; the table keeps their ids
     if 'images' in data:
-        images_json = None
-        if data.get('images'):
-            images_json = json.dumps(data.get('images'))
-        restroom.images = images_json
+        set_restroom_images(restroom_id, data.get('images'))
     
+    mark_catalog_changed(Restroom.id == restroom_id)
     db.session.commit()
+    response_cache.invalidate(RESTROOMS_CACHE, CATALOG_CACHE)
     
     return jsonify({'status': 'success', 'message': 'Restroom updated successfully'})
 
-@app.route('/api/owner/<string:email>/notifications', methods=['GET'])
-def get_owner_notifications(email):
+# Images
+def image_payload(blob_id):
+    return {
+        'id': blob_id,
+        'url': image_ref(blob_id),
+        'sizes': {size: f'{image_ref(blob_id)}?size={size}' for size in blob_store.sizes(blob_id)},
+    }
+
+@app.route('/api/images', methods=['POST'])
+def upload_images():
+    """Store images sent as multipart form files (field "file", repeatable).
+    
+    Identical files are stored once; the response lists each file's id and
+    URLs, in upload order. Reference an image elsewhere by its URL or id.
+    """
+    files = request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'Send images as multipart form field "file"'}), 400
+    
+    images = []
+    for upload in files:
+        data = upload.stream.read(MAX_IMAGE_BYTES + 1)
+        if len(data) > MAX_IMAGE_BYTES:
+            return jsonify({'error': f'{upload.filename or "image"} is larger than {MAX_IMAGE_BYTES} bytes'}), 413
+        try:
+            blob_id, _ = blob_store.put(data)
+        except UnsupportedImage:
+            return jsonify({'error': f'{upload.filename or "image"} is not a PNG, JPEG, GIF or WebP image'}), 400
+        images.append(image_payload(blob_id))
+    return jsonify({'images': images}), 201
+
+@app.route('/api/images/<blob_id>', methods=['GET'])
+def get_image(blob_id):
+    """Serve a stored image, or a pre-generated size with ?size=thumb|medium"""
+    size = request.args.get('size')
+    if size is not None and size not in THUMBNAIL_SIZES:
+        return jsonify({'error': f'size must be one of {", ".join(THUMBNAIL_SIZES)}'}), 400
+    found = blob_store.locate(blob_id, size)
+    if found is None:
+        return jsonify({'error': 'Image not found'}), 404
+    path, content_type = found
+    # Content never changes under an id: cache for good, revalidate by ETag;
+    # send_file hands the open file to the server (sendfile) where supported
+    response = send_file(path, mimetype=content_type, etag=f'{blob_id}-{size or "original"}',
+                         max_age=IMAGE_MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.cli.command('offload-images')
+@click.option('--batch-size', default=500, show_default=True)
+def offload_images_command(batch_size):
+    """Move inline data: URI images from the database into the blob store"""
+    moved = 0
+    for column in (RestroomImage.ref, Review.image_path, Payment.transfer_image_path):
+        model = column.class_
+        last_id = 0
+        while True:
+            rows = db.session.query(model.id, column).filter(
+                model.id > last_id, column.like('data:%')
+            ).order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+            changed = [(row_id, store_image(value)) for row_id, value in rows]
+            changed = [(row_id, value) for (row_id, value), (_, old) in zip(changed, rows) if value != old]
+            for row_id, value in changed:
+                db.session.execute(db.update(model).where(model.id == row_id).values({column.key: value}))
+            if model is RestroomImage and changed:
+                mark_catalog_changed(Restroom.id.in_(
+                    db.select(RestroomImage.restroom_id).where(RestroomImage.id.in_([row_id for row_id, _ in changed]))
+                ))
+            db.session.commit()
+            moved += len(changed)
+            last_id = rows[-1][0]
+    response_cache.invalidate(RESTROOMS_CACHE, CATALOG_CACHE)
+    print(f"Moved {moved} inline image(s) into {blob_store.root}")
+
+# Bulk import/export. Columns use the export names, so an export can be
+# edited and imported again (ids are ignored on import).
+RESTROOM_IMPORT_FIELDS = (
+    bulk.Field('name', bulk.text(100), required=True),
+    bulk.Field('address', bulk.text(200), required=True),
+    bulk.Field('latitude', bulk.number(-90, 90), required=True),
+    bulk.Field('longitude', bulk.number(-180, 180), required=True),
+    bulk.Field('is_free', bulk.boolean, default=True),
+    bulk.Field('price', bulk.count, default=0),
+    bulk.Field('admin_contact', bulk.text(100)),
+    bulk.Field('image_url', bulk.text(500)),
+    bulk.Field('male_standing', bulk.count, default=0),
+    bulk.Field('male_sitting', bulk.count, default=0),
+    bulk.Field('female_sitting', bulk.count, default=0),
+    bulk.Field('disabled_access', bulk.boolean, default=False),
+    bulk.Field('images', bulk.string_list),
+)
+RESTROOM_EXPORT_SCHEMA = RowSchema(
+    Restroom.id, Restroom.name, Restroom.address, Restroom.latitude, Restroom.longitude,
+    Restroom.is_free, Restroom.price, Restroom.admin_contact, Restroom.image_url,
+    *RESTROOM_FACILITY_FIELDS
+)
+RESTROOM_EXPORT_COLUMNS = [field.name for field in RESTROOM_EXPORT_SCHEMA.fields] + ['images']
+
+def import_restrooms(stream, fmt, owner=None, chunk_size=bulk.CHUNK_SIZE):
+    """Insert restrooms from a CSV/NDJSON byte stream.
+    
+    Valid rows are inserted one chunk per transaction with a single
+    executemany; invalid rows are skipped. Returns a bulk.ImportReport.
+    """
+    report = bulk.ImportReport()
+    now = datetime.utcnow()
+    try:
+        for chunk in bulk.validated_chunks(stream, fmt, RESTROOM_IMPORT_FIELDS, report, chunk_size):
+            # Core inserts skip the ORM listener, so set derived columns here
+            version = version_stamp()
+            images = [row.pop('images') for row in chunk]
+            for row in chunk:
+                row.update(
+                    geohash=encode_geohash(row['latitude'], row['longitude']),
+                    owner_id=owner.id if owner else None,
+                    admin_contact=row['admin_contact'] or (owner.email if owner else None),
+                    rating=0.0, total_reviews=0, rating_sum=0, current_users=0, created_at=now,
+                    catalog_version=version, status_version=version
+                )
+            if any(images):
+                # Ids in input order, to attach the images
+                result = db.session.execute(
+                    Restroom.__table__.insert().returning(Restroom.id, sort_by_parameter_order=True), chunk
+                )
+                image_rows = [row for restroom_id, values in zip(result.scalars(), images)
+                              for row in restroom_image_rows(restroom_id, values)]
+                if image_rows:
+                    db.session.execute(db.insert(RestroomImage), image_rows)
+            else:
+                db.session.connection().execute(Restroom.__table__.insert(), chunk)
+            db.session.commit()
+            report.imported += len(chunk)
+    finally:
+        db.session.rollback()
+        if report.imported:
+            response_cache.invalidate(RESTROOMS_CACHE, CATALOG_CACHE)
+    return report
+
+def restroom_export_stream(fmt, owner_id=None):
+    query = db.session.query(*RESTROOM_EXPORT_SCHEMA.columns)
+    if owner_id is not None:
+        query = query.filter(Restroom.owner_id == owner_id)
+    rows = query.order_by(Restroom.id).yield_per(1000)
+    return bulk.export_lines(restroom_export_items(rows), fmt, RESTROOM_EXPORT_COLUMNS)
+
+def restroom_export_items(rows):
+    # Images are read for 1000 restrooms at a time, not per row
+    for chunk in bulk.chunks(rows, 1000):
+        images = restroom_images([row.id for row in chunk])
+        for row in chunk:
+            item = RESTROOM_EXPORT_SCHEMA.serialize(row)
+            item['images'] = images.get(row.id, [])
+            yield item
+
+def bulk_format(default='ndjson'):
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt
+    return 'csv' if request.mimetype == 'text/csv' else default
+
+@app.route('/api/owner/<string:email>/restrooms/import', methods=['POST'])
+def import_owner_restrooms(email):
+    """Bulk-create an owner's restrooms from a CSV or NDJSON request body.
+    
+    The body is read as a stream; pick the format with ?format=csv|ndjson or
+    a text/csv Content-Type. Responds with the imported and failed counts and
+    the first errors by line number.
+    """
     owner = Owner.query.filter_by(email=email).first()
     if not owner:
         return jsonify({'error': 'Owner not found'}), 404
+    fmt = bulk_format()
+    if fmt not in bulk.FORMATS:
+        return jsonify({'error': f'format must be one of {", ".join(bulk.FORMATS)}'}), 400
     
-    notifications = Notification.query.filter_by(owner_id=owner.id).order_by(Notification.created_at.desc()).limit(50).all()
-    return jsonify([{
-        'id': n.id,
-        'type': n.type,
-        'message': n.message,
-        'is_read': n.is_read,
-        'created_at': n.created_at.isoformat(),
-        'restroom': {
-            'id': n.restroom.id,
-            'name': n.restroom.name
-        } if n.restroom else None
-    } for n in notifications])
+    report = import_restrooms(request.stream, fmt, owner)
+    return jsonify(report.as_dict()), 201 if report.imported else 200
+
+@app.route('/api/restrooms/export', methods=['GET'])
+def export_restrooms():
+    """Stream restrooms as NDJSON (default) or CSV; ?owner_id= narrows to one owner"""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in bulk.FORMATS:
+        return jsonify({'error': f'format must be one of {", ".join(bulk.FORMATS)}'}), 400
+    stream = restroom_export_stream(fmt, request.args.get('owner_id', type=int))
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(stream), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=restrooms.{fmt}'
+    return response
+
+@app.cli.command('import-restrooms')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), help='Defaults to the file extension')
+@click.option('--owner-email', help='Assign the restrooms to this owner')
+@click.option('--chunk-size', default=bulk.CHUNK_SIZE, show_default=True)
+def import_restrooms_command(path, fmt, owner_email, chunk_size):
+    """Bulk-import restrooms from a CSV or NDJSON file"""
+    owner = None
+    if owner_email:
+        owner = Owner.query.filter_by(email=owner_email).first()
+        if not owner:
+            raise click.ClickException(f'Owner not found: {owner_email}')
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+    start = time.perf_counter()
+    with open(path, 'rb') as stream:
+        report = import_restrooms(stream, fmt, owner, chunk_size)
+    for error in report.errors:
+        print(f"line {error['line']}: {error['error']}")
+    print(f"Imported {report.imported} restroom(s), {report.failed} failed, in {time.perf_counter() - start:.1f}s")
+
+@app.cli.command('export-restrooms')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), help='Defaults to the file extension')
+@click.option('--owner-id', type=int, help='Only this owner\'s restrooms')
+def export_restrooms_command(path, fmt, owner_id):
+    """Export restrooms to a CSV or NDJSON file"""
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+    with open(path, 'wb') as out:
+        for chunk in restroom_export_stream(fmt, owner_id):
+            out.write(chunk)
+    print(f"Exported restrooms to {path}")
+
+def owner_notifications_query(email, schema=NOTIFICATION_SCHEMA):
+    """The owner's latest notifications with restroom names, in one indexed query.
+    
+    Starts from the owner so an unknown email returns no rows and an owner
+    without notifications returns a single row whose notification is NULL.
+    """
+    return db.session.query(*schema.columns).select_from(Owner).outerjoin(
+        Notification, Notification.owner_id == Owner.id
+    ).outerjoin(
+        Restroom, Notification.restroom_id == Restroom.id
+    ).filter(Owner.email == email).order_by(Notification.created_at.desc()).limit(50)
+
+@app.route('/api/owner/<string:email>/notifications', methods=['GET'])
+def get_owner_notifications(email):
+    schema = projection(NOTIFICATION_SCHEMA)
+    rows = owner_notifications_query(email, schema).all()
+    if not rows:
+        return jsonify({'error': 'Owner not found'}), 404
+    notifications = [row for row in rows if row.id is not None]
+    return json_response(schema.many(notifications))
+
+@app.route('/api/owner/<string:email>/notifications/unread_count', methods=['GET'])
+def get_owner_unread_count(email):
+    unread = db.session.query(Owner.unread_notifications).filter(Owner.email == email).scalar()
+    if unread is None:
+        return jsonify({'error': 'Owner not found'}), 404
+    return jsonify({'unread_count': unread})
+
+def mark_notifications_read(owner_id, *criteria):
+    """Mark the owner's matching unread notifications read in one UPDATE.
+    
+    The counter is decremented by the rows actually changed, in the same
+    transaction, so repeated or overlapping calls never double count.
+    Returns the rows changed and the owner's new unread count, or None for
+    the count when nothing changed or the database cannot RETURN it.
+    """
+    unread = None
+    changed = db.session.execute(
+        db.update(Notification).where(
+            Notification.owner_id == owner_id, Notification.is_read == False, *criteria  # noqa: E712
+        ).values(is_read=True).execution_options(synchronize_session=False)
+    ).rowcount
+    if changed:
+        update = db.update(Owner).where(Owner.id == owner_id).values(
+            unread_notifications=Owner.unread_notifications - changed
+        )
+        if db.engine.dialect.update_returning:
+            unread = db.session.execute(update.returning(Owner.unread_notifications)).scalar()
+        else:
+            db.session.execute(update)
+    db.session.commit()
+    return changed, unread
 
 @app.route('/api/owner/notifications/<int:notification_id>/read', methods=['PUT'])
 def mark_notification_read(notification_id):
-    notification = Notification.query.get_or_404(notification_id)
-    notification.is_read = True
-    db.session.commit()
+    owner_id = db.session.query(Notification.owner_id).filter(Notification.id == notification_id).scalar()
+    if owner_id is None:
+        abort(404)
+    mark_notifications_read(owner_id, Notification.id == notification_id)
     return jsonify({'message': 'Notification marked as read'})
 
+@app.route('/api/owner/<string:email>/notifications/read', methods=['PUT'])
+def mark_owner_notifications_read(email):
+    """Bulk mark-read: ``{"ids": [...]}`` or ``{"up_to_id": N}`` (every notification with id <= N)"""
+    owner_id = db.session.query(Owner.id).filter(Owner.email == email).scalar()
+    if owner_id is None:
+        return jsonify({'error': 'Owner not found'}), 404
+    data = request.get_json(silent=True) or {}
+    ids, up_to_id = data.get('ids'), data.get('up_to_id')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            return jsonify({'error': 'ids must be a list of notification ids'}), 400
+        criterion = Notification.id.in_(ids)
+    elif up_to_id is not None:
+        if not isinstance(up_to_id, int) or isinstance(up_to_id, bool):
+            return jsonify({'error': 'up_to_id must be a notification id'}), 400
+        criterion = Notification.id <= up_to_id
+    else:
+        return jsonify({'error': 'Provide ids or up_to_id'}), 400
+    
+    marked, unread = mark_notifications_read(owner_id, criterion)
+    if unread is None:
+        unread = db.session.query(Owner.unread_notifications).filter(Owner.id == owner_id).scalar()
+    return jsonify({'marked': marked, 'unread_count': unread})
+
+# Server-Sent Events
+SSE_KEEPALIVE_SECONDS = 15
+
+@app.route('/api/events/stream', methods=['GET'])
+def stream_events():
+    """Push chat messages and notifications as they are committed.
+    
+    Subscribe with any of restroom_id (chat), owner_email/owner_id
+    (owner notifications) and user_id (payment status updates).
+    """
+    channels = []
+    restroom_id = request.args.get('restroom_id', type=int)
+    if restroom_id is not None:
+        channels.append(chat_channel(restroom_id))
+    
+    owner_id = request.args.get('owner_id', type=int)
+    owner_email = request.args.get('owner_email')
+    if owner_email:
+        owner = Owner.query.filter_by(email=owner_email).first()
+        if not owner:
+            return jsonify({'error': 'Owner not found'}), 404
+        owner_id = owner.id
+    if owner_id is not None:
+        channels.append(owner_channel(owner_id))
+    
+    user_id = request.args.get('user_id', type=int)
+    if user_id is not None:
+        channels.append(user_channel(user_id))
+    
+    if not channels:
+        return jsonify({'error': 'restroom_id, owner_email, owner_id or user_id is required'}), 400
+    
+    # Streams can stay open for hours; do not hold a DB connection meanwhile
+    db.session.remove()
+    subscription = event_bus.subscribe(channels)
+    
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                event = subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+                if event is None:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {dumps(event['data']).decode()}\n\n"
+        finally:
+            subscription.close()
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 # Initialize database and seed data
 def init_db():
     with app.app_context():
-        db.create_all()
+        ran = migrations.upgrade(db.engine, db.metadata)
+        if ran:
+            print(f"Applied migrations: {', '.join(ran)}")
         
         # Check if data already exists
         if Restroom.query.count() == 0 and Owner.query.count() == 0:
@@ -910,19 +2234,278 @@ def init_db():
                 db.session.add(restroom)
             
             db.session.commit()
+            # Seeded total_reviews have no Review rows behind them
+            rebuild_rating_aggregates()
             print("Database initialized with sample data!")
 
+def rebuild_unread_counters():
+    """Recompute every owner's unread counter from the notification table.
+    
+    Returns the number of owners whose counter had drifted.
+    """
+    actual = db.session.query(db.func.count(Notification.id)).filter(
+        Notification.owner_id == Owner.id, Notification.is_read == False  # noqa: E712
+    ).scalar_subquery()
+    drifted = db.session.execute(
+        db.update(Owner).where(Owner.unread_notifications != actual).values(unread_notifications=actual)
+    ).rowcount
+    db.session.commit()
+    return drifted
+
+def rebuild_rating_aggregates():
+    """Recompute rating_sum/total_reviews/rating from the Review table.
+    
+    Returns the number of restrooms whose stored aggregates had drifted.
+    Restrooms without reviews keep their current rating.
+    """
+    stats = db.session.query(
+        Review.restroom_id,
+        db.func.sum(Review.rating).label('rating_sum'),
+        db.func.count(Review.id).label('total_reviews')
+    ).group_by(Review.restroom_id).subquery()
+    
+    rows = db.session.query(
+        Restroom.id, Restroom.rating_sum, Restroom.total_reviews,
+        stats.c.rating_sum, stats.c.total_reviews
+    ).outerjoin(stats, stats.c.restroom_id == Restroom.id).all()
+    
+    drifted = []
+    for restroom_id, stored_sum, stored_count, actual_sum, actual_count in rows:
+        actual_sum = actual_sum or 0
+        actual_count = actual_count or 0
+        if stored_sum != actual_sum or stored_count != actual_count:
+            values = {'id': restroom_id, 'rating_sum': actual_sum, 'total_reviews': actual_count,
+                      'status_version': version_stamp()}
+            if actual_count:
+                values['rating'] = actual_sum / actual_count
+            drifted.append(values)
+    
+    for values in drifted:
+        db.session.execute(db.update(Restroom).where(Restroom.id == values.pop('id')).values(**values))
+    db.session.commit()
+    if drifted:
+        response_cache.invalidate(RESTROOMS_CACHE)
+    return len(drifted)
+
+@app.cli.command('rebuild-unread-counters')
+def rebuild_unread_counters_command():
+    """Recompute owner unread notification counters"""
+    drifted = rebuild_unread_counters()
+    print(f"Rebuilt unread counters, {drifted} owner(s) had drifted")
+
+@app.cli.command('rebuild-ratings')
+def rebuild_ratings_command():
+    """Recompute restroom rating aggregates from reviews"""
+    drifted = rebuild_rating_aggregates()
+    print(f"Rebuilt rating aggregates, {drifted} restroom(s) had drifted")
+
 def reset_db():
     """Reset database with new sample data"""
     with app.app_context():
         # Drop all tables
         db.drop_all()
-        # Recreate all tables  
-        db.create_all()
-        print("Database tables recreated!")
-        
-        # Call init_db to populate with new data
-        init_db()
+        db.session.execute(db.text('DROP TABLE IF EXISTS schema_migrations'))
+        db.session.commit()
+        print("Database tables dropped!")
+    
+    # init_db recreates the tables and populates them with new data
+    init_db()
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Create missing tables and apply pending schema migrations"""
+    ran = migrations.upgrade(db.engine, db.metadata)
+    print(f"Applied migrations: {', '.join(ran)}" if ran else "Database schema is up to date")
+
+@app.cli.command('db-status')
+def db_status_command():
+    """List schema migrations and whether they have been applied"""
+    for version, name, applied in migrations.status(db.engine):
+        print(f"{version:04d} {name} {'applied' if applied else 'pending'}")
+
+def hot_lookup_queries():
+    """The filtered lookups each route runs, keyed by route name"""
+    return {
+        'get_restrooms (radius/bbox)': restrooms_in_bbox_query(10.87, 106.78, 10.89, 106.80),
+        'recommend_restrooms (filtered)': restrooms_in_bbox_query(10.87, 106.78, 10.89, 106.80).filter(
+            Restroom.is_free.is_(True), Restroom.female_sitting > 0),
+        'get_restroom_catalog (since)': Restroom.query.filter(Restroom.catalog_version > 1).order_by(
+            Restroom.catalog_version, Restroom.id),
+        'get_restroom_status (since)': db.session.query(Restroom.id, Restroom.current_users).filter(
+            Restroom.status_version > 1),
+        'get_restroom_status (versions)': latest_versions_query(STATUS_VERSION, CATALOG_VERSION),
+        'get_restroom_details': Review.query.filter_by(restroom_id=1).order_by(Review.created_at.desc()).limit(10),
+        'restroom images (include=images)': db.session.query(RestroomImage.restroom_id, RestroomImage.ref).filter(
+            RestroomImage.restroom_id.in_([1, 2])).order_by(RestroomImage.restroom_id, RestroomImage.position),
+        'get_messages': ChatMessage.query.filter_by(restroom_id=1).order_by(ChatMessage.id.asc()),
+        'get_messages (since_id)': ChatMessage.query.filter(
+            ChatMessage.restroom_id == 1, ChatMessage.id > 1).order_by(ChatMessage.id.asc()).limit(100),
+        'get_messages (before_id)': ChatMessage.query.filter(
+            ChatMessage.restroom_id == 1, ChatMessage.id < 100).order_by(ChatMessage.id.desc()).limit(100),
+        'login_user': Owner.query.filter_by(email='owner@example.com'),
+        'check_username': User.query.filter_by(username='user'),
+        'get_user_history (usage)': db.session.query(UsageHistory, Restroom).join(
+            Restroom, UsageHistory.restroom_id == Restroom.id
+        ).filter(UsageHistory.user_id == 1).order_by(UsageHistory.created_at.desc()),
+        'get_user_history (reviews)': db.session.query(Review, Restroom).join(
+            Restroom, Review.restroom_id == Restroom.id
+        ).filter(Review.user_id == 1).order_by(Review.created_at.desc()),
+        'payment_entitlement': entitlement_query(1, 1),
+        'stop_using_restroom': UsageHistory.query.filter_by(user_id=1, restroom_id=1, end_time=None),
+        'get_owner_restrooms': Restroom.query.filter_by(owner_id=1),
+        'get_owner_notifications': owner_notifications_query('owner@example.com'),
+        'get_owner_unread_count': db.session.query(Owner.unread_notifications).filter(
+            Owner.email == 'owner@example.com'),
+        'mark_owner_notifications_read (up_to_id)': db.update(Notification).where(
+            Notification.owner_id == 1, Notification.is_read == False, Notification.id <= 100  # noqa: E712
+        ).values(is_read=True),
+        'get_owner_payments': db.session.query(Payment, User, Restroom).join(
+            User, Payment.user_id == User.id
+        ).join(
+            Restroom, Payment.restroom_id == Restroom.id
+        ).filter(Payment.owner_id == 1).order_by(Payment.created_at.desc()),
+        'get_user_payments': db.session.query(Payment, Restroom).join(
+            Restroom, Payment.restroom_id == Restroom.id
+        ).filter(Payment.user_id == 1).order_by(Payment.created_at.desc()),
+    }
+
+def keyset_page_queries():
+    """The page-after-cursor query of each paginated list, keyed by route name"""
+    pages = {
+        'get_messages (page)': (db.session.query(*CHAT_MESSAGE_SCHEMA.columns).filter(
+            ChatMessage.restroom_id == 1), CHAT_MESSAGE_PAGE_KEYS, [100], True),
+        'get_user_history (usage page)': (user_usage_history_query(1), USAGE_HISTORY_PAGE_KEYS,
+                                          ['2024-01-01T00:00:00', 100], True),
+        'get_user_history (reviews page)': (user_review_history_query(1), REVIEW_HISTORY_PAGE_KEYS,
+                                            ['2024-01-01T00:00:00', 100], True),
+        'get_owner_restrooms (page)': (db.session.query(*RESTROOM_SUMMARY_SCHEMA.columns).filter(
+            Restroom.owner_id == 1), OWNER_RESTROOM_PAGE_KEYS, [100], False),
+        'get_owner_payments (page)': (db.session.query(*OWNER_PAYMENT_SCHEMA.columns).join(
+            User, Payment.user_id == User.id
+        ).join(
+            Restroom, Payment.restroom_id == Restroom.id
+        ).filter(Payment.owner_id == 1), PAYMENT_PAGE_KEYS, ['2024-01-01T00:00:00', 100], True),
+        'get_user_payments (page)': (db.session.query(*USER_PAYMENT_SCHEMA.columns).join(
+            Restroom, Payment.restroom_id == Restroom.id
+        ).filter(Payment.user_id == 1), PAYMENT_PAGE_KEYS, ['2024-01-01T00:00:00', 100], True),
+    }
+    return {
+        route: query.filter(keyset_after(keys, cursor, descending)).order_by(
+            *keyset_order_by(keys, descending)).limit(DEFAULT_PAGE_LIMIT + 1)
+        for route, (query, keys, cursor, descending) in pages.items()
+    }
+
+def check_query_plans():
+    """Run EXPLAIN QUERY PLAN for every hot lookup.
+    
+    Returns a list of (route, plan detail) for lookups that scan a table,
+    and for keyset pages that sort their rows instead of reading them in
+    index order.
+    """
+    failures = []
+    connection = db.session.connection()
+    pages = keyset_page_queries()
+    for route, query in {**hot_lookup_queries(), **pages}.items():
+        statement = getattr(query, 'statement', query)
+        compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).all()
+        # Reading a subquery's own (already limited) output is not a table scan
+        subqueries = {row[-1].split()[-1] for row in plan if row[-1].startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+        for row in plan:
+            detail = row[-1]
+            if detail.startswith('SCAN ') and not detail.startswith('SCAN CONSTANT ROW') \
+                    and detail.split()[1] not in subqueries:
+                failures.append((route, detail))
+            elif route in pages and detail.startswith('USE TEMP B-TREE'):
+                failures.append((route, detail))
+    return failures
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if any hot lookup falls back to a table scan (SQLite only)"""
+    failures = check_query_plans()
+    for route, detail in failures:
+        print(f"{route}: {detail}")
+    if failures:
+        raise SystemExit(1)
+    print("All hot lookups use an index")
+
+# Payment entitlements: may a user enter a paid restroom?
+def entitlement_query(user_id, restroom_id):
+    """Latest confirmed and latest pending payment, in one round trip"""
+    def latest(status):
+        return db.select(Payment.status, Payment.id, Payment.confirmed_at).where(
+            Payment.user_id == user_id,
+            Payment.restroom_id == restroom_id,
+            Payment.status == status
+        ).order_by(Payment.created_at.desc()).limit(1).subquery()
+    return db.union_all(db.select(latest('confirmed')), db.select(latest('pending')))
+
+def load_entitlement(user_id, restroom_id):
+    """Read the entitlement from the database and refresh its cache entry"""
+    state = {'confirmed_payment_id': None, 'confirmed_at': None, 'pending_payment_id': None}
+    for status, payment_id, confirmed_at in db.session.execute(entitlement_query(user_id, restroom_id)):
+        if status == 'confirmed':
+            state['confirmed_payment_id'] = payment_id
+            state['confirmed_at'] = confirmed_at.isoformat() if confirmed_at else None
+        else:
+            state['pending_payment_id'] = payment_id
+    entitlement_cache.set(user_id, restroom_id, state)
+    return state
+
+def payment_entitlement(user_id, restroom_id):
+    return entitlement_cache.get(user_id, restroom_id) or load_entitlement(user_id, restroom_id)
+
+def refresh_entitlement(user_id, restroom_id):
+    """After a committed payment write: reload this process's entry and drop the other workers'"""
+    event_bus.publish(ENTITLEMENTS_CHANNEL, 'entitlement_changed',
+                      {'user_id': user_id, 'restroom_id': restroom_id, 'pid': os.getpid()})
+    return load_entitlement(user_id, restroom_id)
+
+def drop_stale_entitlement(event):
+    data = event['data']
+    # The publishing process has just reloaded its own entry
+    if data['pid'] != os.getpid():
+        entitlement_cache.invalidate(data['user_id'], data['restroom_id'])
+
+# A shared store (sqlite://, memcached://) is refreshed by the writer itself;
+# per-process stores need every worker told. Workers only hear each other
+# through a shared EVENT_BUS_URL, as for pushed events.
+if isinstance(entitlement_cache.store, MemoryStore):
+    event_bus.listen([ENTITLEMENTS_CHANNEL], drop_stale_entitlement)
+
+def cache_and_queue_metrics():
+    """Cache hit/miss counters and notification queue state, for /metrics"""
+    caches = {'response': response_cache.stats(), 'entitlement': entitlement_cache.stats()}
+    queue = notification_queue.stats()
+    lines = family('restroom_cache_hits_total', 'counter', 'Cache lookups answered from the cache.',
+                   [((('cache', name),), stats['hits']) for name, stats in caches.items()])
+    lines += family('restroom_cache_misses_total', 'counter', 'Cache lookups that went to the database.',
+                    [((('cache', name),), stats['misses']) for name, stats in caches.items()])
+    lines += family('restroom_notification_queue_depth', 'gauge', 'Notifications waiting to be written.',
+                    [((), queue['queued'])])
+    for key, help_text in (('written', 'Notifications written by the queue.'),
+                           ('batches', 'Transactions the queue committed.'),
+                           ('synchronous', 'Notifications written in the request (queue full or off).'),
+                           ('failed', 'Notifications the queue gave up on.')):
+        lines += family(f'restroom_notification_queue_{key}_total', 'counter', help_text, [((), queue[key])])
+    return lines
+
+request_metrics.register(cache_and_queue_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of this process's metrics"""
+    return Response(request_metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Hit/miss counters of this process's caches"""
+    return jsonify({
+        'response_cache': response_cache.stats(),
+        'entitlements': entitlement_cache.stats()
+    })
 
 # Payment APIs
 @app.route('/api/payments', methods=['POST'])
@@ -930,41 +2513,40 @@ def create_payment():
     data = request.json
     
     # Get the restroom and owner info
-    restroom = Restroom.query.get(data['restroom_id'])
+    restroom = db.session.query(Restroom.name, Owner.id.label('owner_id')).outerjoin(
+        Owner, Restroom.owner_id == Owner.id
+    ).filter(Restroom.id == data['restroom_id']).first()
     if not restroom:
         return jsonify({'error': 'Restroom not found'}), 404
-    
-    owner = Owner.query.get(restroom.owner_id)
-    if not owner:
+    if restroom.owner_id is None:
         return jsonify({'error': 'Owner not found'}), 404
     
     # Create payment record
     payment = Payment(
         user_id=data['user_id'],
         restroom_id=data['restroom_id'],
-        owner_id=owner.id,
+        owner_id=restroom.owner_id,
         method=data['method'],
         amount=data['amount'],
-        transfer_image_path=data.get('transfer_image_path'),
+        transfer_image_path=store_image(data.get('transfer_image_path')),
         note=data.get('note', ''),
         status='pending' if data['method'] == 'transfer' else 'confirmed'
     )
     
     db.session.add(payment)
     
+    db.session.commit()
+    refresh_entitlement(payment.user_id, payment.restroom_id)
+    
     # If transfer payment, create notification for owner
     if data['method'] == 'transfer':
-        notification = Notification(
-            owner_id=owner.id,
+        enqueue_notification(
+            owner_id=restroom.owner_id,
             restroom_id=data['restroom_id'],
             user_id=data['user_id'],
             type='payment_confirmation',
-            message=f'Yêu cầu xác nhận thanh toán chuyển khoản {data["amount"]}₫ cho {restroom.name}',
-            is_read=False
+            message=f'Yêu cầu xác nhận thanh toán chuyển khoản {data["amount"]}₫ cho {restroom.name}'
         )
-        db.session.add(notification)
-    
-    db.session.commit()
     
     return jsonify({
         'success': True, 
@@ -988,103 +2570,71 @@ def confirm_payment(payment_id):
         message = f'Thanh toán {payment.amount}₫ bị từ chối'
     
     db.session.commit()
+    refresh_entitlement(payment.user_id, payment.restroom_id)
     
     # Create notification for user
-    notification = Notification(
+    enqueue_notification(
         owner_id=payment.owner_id,
         restroom_id=payment.restroom_id,
         user_id=payment.user_id,
         type='payment_status',
-        message=message,
-        is_read=False
+        message=message
     )
-    db.session.add(notification)
-    db.session.commit()
     
     return jsonify({'success': True, 'status': payment.status})
 
 @app.route('/api/owner/<int:owner_id>/payments', methods=['GET'])
 def get_owner_payments(owner_id):
-    payments = db.session.query(Payment, User, Restroom).join(
+    schema = projection(OWNER_PAYMENT_SCHEMA, *PAYMENT_PAGE_KEYS)
+    query = db.session.query(*schema.columns).join(
         User, Payment.user_id == User.id
     ).join(
         Restroom, Payment.restroom_id == Restroom.id
-    ).filter(Payment.owner_id == owner_id).order_by(
-        Payment.created_at.desc()
-    ).all()
-    
-    payments_data = []
-    for payment, user, restroom in payments:
-        payments_data.append({
-            'id': payment.id,
-            'user_name': user.username,
-            'restroom_name': restroom.name,
-            'method': payment.method,
-            'amount': payment.amount,
-            'status': payment.status,
-            'transfer_image_path': payment.transfer_image_path,
-            'note': payment.note,
-            'created_at': payment.created_at.isoformat(),
-            'confirmed_at': payment.confirmed_at.isoformat() if payment.confirmed_at else None
-        })
+    ).filter(Payment.owner_id == owner_id)
+    if is_page_request(request.args):
+        return paginated_response(query, schema, PAYMENT_PAGE_KEYS, descending=True)
     
-    return jsonify(payments_data)
+    payments = query.order_by(Payment.created_at.desc()).all()
+    return json_response(schema.many(payments))
 
 @app.route('/api/users/<int:user_id>/payments', methods=['GET'])
 def get_user_payments(user_id):
-    payments = db.session.query(Payment, Restroom).join(
+    schema = projection(USER_PAYMENT_SCHEMA, *PAYMENT_PAGE_KEYS)
+    query = db.session.query(*schema.columns).join(
         Restroom, Payment.restroom_id == Restroom.id
-    ).filter(Payment.user_id == user_id).order_by(
-        Payment.created_at.desc()
-    ).all()
-    
-    payments_data = []
-    for payment, restroom in payments:
-        payments_data.append({
-            'id': payment.id,
-            'restroom_name': restroom.name,
-            'method': payment.method,
-            'amount': payment.amount,
-            'status': payment.status,
-            'note': payment.note,
-            'created_at': payment.created_at.isoformat(),
-            'confirmed_at': payment.confirmed_at.isoformat() if payment.confirmed_at else None
-        })
+    ).filter(Payment.user_id == user_id)
+    if is_page_request(request.args):
+        return paginated_response(query, schema, PAYMENT_PAGE_KEYS, descending=True)
     
-    return jsonify(payments_data)
+    payments = query.order_by(Payment.created_at.desc()).all()
+    return json_response(schema.many(payments))
 
 @app.route('/api/users/<int:user_id>/payment-status/<int:restroom_id>', methods=['GET'])
 def check_payment_status(user_id, restroom_id):
     """Check if user has confirmed payment for a specific restroom"""
-    confirmed_payment = Payment.query.filter_by(
-        user_id=user_id,
-        restroom_id=restroom_id,
-        status='confirmed'
-    ).order_by(Payment.created_at.desc()).first()
+    entitlement = payment_entitlement(user_id, restroom_id)
     
-    if confirmed_payment:
+    if entitlement['confirmed_payment_id'] is not None:
         return jsonify({
             'payment_confirmed': True,
-            'payment_id': confirmed_payment.id,
-            'confirmed_at': confirmed_payment.confirmed_at.isoformat() if confirmed_payment.confirmed_at else None
+            'payment_id': entitlement['confirmed_payment_id'],
+            'confirmed_at': entitlement['confirmed_at']
         })
     else:
-        # Check for pending payment
-        pending_payment = Payment.query.filter_by(
-            user_id=user_id,
-            restroom_id=restroom_id,
-            status='pending'
-        ).order_by(Payment.created_at.desc()).first()
-        
         return jsonify({
             'payment_confirmed': False,
-            'has_pending_payment': pending_payment is not None,
-            'pending_payment_id': pending_payment.id if pending_payment else None
+            'has_pending_payment': entitlement['pending_payment_id'] is not None,
+            'pending_payment_id': entitlement['pending_payment_id']
         })
 
 
 
 if __name__ == '__main__':
-    # Reset database with new location data (100m - 2km range)
-    reset_db()
+    # Create or migrate the schema in place; use reset_db() to start over
+    init_db()
+    # Under gunicorn schedule 'flask sweep-usage' (cron/systemd timer) instead
+    sweep_interval = int(os.environ.get('USAGE_SWEEP_SECONDS', 300))
+    # The debug reloader runs this block twice; sweep only in the serving child
+    if sweep_interval > 0 and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        threading.Thread(target=run_usage_sweeper, args=(sweep_interval,), daemon=True).start()
     app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
@@ -0,0 +1,234 @@
+"""ASGI entry point: ``uvicorn asgi:application``.
+
+Short request/response routes run unchanged: the Flask app is mounted through
+asgiref's ``WsgiToAsgi`` and each call runs on a worker thread. The two routes
+that keep mostly idle clients waiting are served on the event loop instead,
+so a waiting client costs a coroutine rather than a thread:
+
+* the chat long-poll, ``GET /api/chat/messages/<id>?since_id=..&wait=..``
+* the event stream, ``GET /api/events/stream``
+
+Their queries go through an async SQLAlchemy engine on aiosqlite and their
+bodies are built with the same schemas, encoders and compression as the Flask
+routes, so paths, parameters and bodies are identical. Anything else, including the error
+cases of those two routes, is handed to Flask, which stays the reference
+implementation. Unless DATABASE_URL is a SQLite file or ASYNC_DATABASE_URL
+names an async driver, every request goes through Flask.
+
+Requires ``pip install -r requirements-asgi.txt``.
+"""
+import asyncio
+import os
+import re
+import time
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.datastructures import Accept, MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import storage
+from app import (
+    CHAT_MESSAGE_SCHEMA, DEFAULT_CHAT_PAGE_SIZE, MAX_CHAT_PAGE_SIZE, MAX_CHAT_WAIT_SECONDS, SSE_KEEPALIVE_SECONDS,
+    Owner, app as flask_app, compressor, db, event_bus, newer_chat_messages, request_metrics
+)
+from compression import choose_encoding, compress
+from events import AsyncSubscription, chat_channel, owner_channel, user_channel
+from serializers import FieldError, check_fields, dumps, encode, fields_arg, negotiate
+
+CHAT_MESSAGES_PATH = re.compile(r'/api/chat/messages/(\d+)')
+EVENTS_STREAM_PATH = '/api/events/stream'
+
+# Flask-CORS sends this on every response
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+
+def async_database_url(url):
+    """The aiosqlite form of a SQLite URL, or ASYNC_DATABASE_URL if set"""
+    if os.environ.get('ASYNC_DATABASE_URL'):
+        return os.environ['ASYNC_DATABASE_URL']
+    if storage.is_sqlite_file(url):
+        return 'sqlite+aiosqlite:' + url[len('sqlite:'):]
+    return None
+
+
+def header(scope, name):
+    """First value of a request header (name in lower case bytes), or None"""
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def create_engine_for(url):
+    if url is None:
+        return None
+    engine = create_async_engine(url)
+    storage.install_sqlite_pragmas(engine.sync_engine)
+    return engine
+
+
+class QueryArgs:
+    """First value of each query parameter, converted like ``request.args.get``"""
+
+    def __init__(self, query_string):
+        self._args = parse_qs(query_string.decode('latin-1'), keep_blank_values=True)
+
+    def get(self, name, default=None, type=None):
+        values = self._args.get(name)
+        if not values:
+            return default
+        if type is None:
+            return values[0]
+        try:
+            return type(values[0])
+        except ValueError:
+            return default
+
+
+class Application:
+    def __init__(self, wsgi_app, database_url):
+        self.wsgi = WsgiToAsgi(wsgi_app)
+        self.engine = create_engine_for(database_url)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'GET' and self.engine is not None:
+            args = QueryArgs(scope['query_string'])
+            match = CHAT_MESSAGES_PATH.fullmatch(scope['path'])
+            if match and await self.long_poll(int(match.group(1)), args, scope, send):
+                return
+            if scope['path'] == EVENTS_STREAM_PATH and await self.stream_events(args, receive, send):
+                return
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engine is not None:
+                    await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def long_poll(self, restroom_id, args, scope, send):
+        """Serve a waiting chat poll; returns False for requests Flask should handle"""
+        since_id = args.get('since_id', type=int)
+        if since_id is None or args.get('before_id', type=int) is not None:
+            return False
+        wait = min(args.get('wait', 0, type=float), MAX_CHAT_WAIT_SECONDS)
+        if not wait > 0:
+            return False
+        limit = args.get('limit', DEFAULT_CHAT_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MAX_CHAT_PAGE_SIZE))
+        try:
+            names = fields_arg(args)
+            check_fields(names, CHAT_MESSAGE_SCHEMA)
+        except FieldError:
+            return False
+        schema = CHAT_MESSAGE_SCHEMA.project(names)
+
+        started = time.perf_counter()
+        statement = newer_chat_messages(restroom_id, since_id, limit, schema)
+        queries = 1
+        # Subscribe before querying so no message slips in between
+        with event_bus.subscribe([chat_channel(restroom_id)], AsyncSubscription) as subscription:
+            messages = await self.fetch(statement)
+            if not messages:
+                await subscription.get(timeout=wait)
+                messages = await self.fetch(statement)
+                queries += 1
+
+        mimetype = negotiate(parse_accept_header(header(scope, b'accept'), MIMEAccept))
+        encode_started = time.perf_counter()
+        body = encode(schema.many(messages), mimetype)
+        serialization_seconds = time.perf_counter() - encode_started
+        headers = [(b'content-type', mimetype.encode()), (b'vary', b'Accept, Accept-Encoding')]
+        encoding = None
+        if len(body) >= compressor.min_bytes:
+            encoding = choose_encoding(parse_accept_header(header(scope, b'accept-encoding'), Accept))
+        if encoding is not None:
+            body = compress(body, encoding)
+            headers.append((b'content-encoding', encoding.encode()))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers + [
+            (b'content-length', str(len(body)).encode()),
+            (b'x-query-count', str(queries).encode()),
+        ] + CORS_HEADERS})
+        await send({'type': 'http.response.body', 'body': body})
+        request_metrics.observe('get_messages', 'GET', 200, time.perf_counter() - started, queries=queries,
+                                serialization_seconds=serialization_seconds, size=len(body))
+        return True
+
+    async def stream_events(self, args, receive, send):
+        """Serve an SSE stream; returns False for requests Flask should handle"""
+        channels = []
+        restroom_id = args.get('restroom_id', type=int)
+        if restroom_id is not None:
+            channels.append(chat_channel(restroom_id))
+
+        owner_id = args.get('owner_id', type=int)
+        owner_email = args.get('owner_email')
+        queries = 0
+        if owner_email:
+            queries += 1
+            owner_id = await self.fetch_scalar(db.select(Owner.id).where(Owner.email == owner_email).limit(1))
+            if owner_id is None:
+                return False
+        if owner_id is not None:
+            channels.append(owner_channel(owner_id))
+
+        user_id = args.get('user_id', type=int)
+        if user_id is not None:
+            channels.append(user_channel(user_id))
+
+        if not channels:
+            return False
+
+        disconnected = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        with event_bus.subscribe(channels, AsyncSubscription) as subscription:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+                (b'x-query-count', str(queries).encode()),
+            ] + CORS_HEADERS})
+            chunk = 'retry: 3000\n\n'
+            try:
+                while not disconnected.done():
+                    await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+                    next_event = asyncio.ensure_future(subscription.get(timeout=SSE_KEEPALIVE_SECONDS))
+                    await asyncio.wait({next_event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                    if not next_event.done():
+                        next_event.cancel()
+                        break
+                    event = next_event.result()
+                    if event is None:
+                        chunk = ': keepalive\n\n'
+                    else:
+                        chunk = f"id: {event['id']}\nevent: {event['type']}\ndata: {dumps(event['data']).decode()}\n\n"
+            except OSError:
+                # The client went away mid-write
+                pass
+            finally:
+                disconnected.cancel()
+        return True
+
+    @staticmethod
+    async def wait_for_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def fetch(self, statement):
+        async with self.engine.connect() as conn:
+            return (await conn.execute(statement)).all()
+
+    async def fetch_scalar(self, statement):
+        async with self.engine.connect() as conn:
+            return (await conn.execute(statement)).scalar()
+
+
+application = Application(flask_app, async_database_url(flask_app.config['SQLALCHEMY_DATABASE_URI']))
@@ -0,0 +1,204 @@
+"""Compare idle connection capacity of the threaded Flask server and the ASGI app.
+
+Starts the API on a throwaway database under a thread-per-request server
+(gunicorn gthread by default, or Werkzeug's threaded server) and under uvicorn
+with asgi.py, then parks N chat long-polls (``wait=``) on each. While they
+wait it measures the latency of ordinary requests and the server's threads
+and memory, then posts one chat message and times how long it takes every
+long-poll to answer. Requires uvicorn, asgiref, aiosqlite and greenlet, plus
+gunicorn for the default Flask server:
+
+    pip install gunicorn uvicorn asgiref aiosqlite greenlet
+    python benchmarks/bench_asgi.py --connections 100 500 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAILED = 599
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(path, env):
+    """An empty schema plus one restroom and a chat user; returns (restroom_id, user_id)"""
+    subprocess.run([sys.executable, '-c', 'import app; app.init_db()'], cwd=BACKEND_DIR, env=env,
+                   check=True, stdout=subprocess.DEVNULL)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO owner (name, email, phone) VALUES ('Bench', 'bench@example.com', '0')")
+    owner_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+    conn.execute(
+        'INSERT INTO restroom (name, address, latitude, longitude, is_free, price, current_users, rating, '
+        "total_reviews, rating_sum, owner_id) VALUES ('Bench', 'Dĩ An', 10.88, 106.79, 1, 0, 0, 0, 0, 0, ?)",
+        (owner_id,)
+    )
+    restroom_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+    conn.execute("INSERT INTO user (username, is_random_user, is_using) VALUES ('bench', 1, 0)")
+    user_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+    conn.commit()
+    conn.close()
+    return restroom_id, user_id
+
+
+def last_message_id(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT COALESCE(MAX(id), 0) FROM chat_message').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def server_command(server, port, args):
+    if server == 'gthread':
+        return ['gunicorn', '-w', '1', '-k', 'gthread', '--threads', str(args.threads),
+                '-b', f'127.0.0.1:{port}', 'app:app']
+    if server == 'werkzeug':
+        return [sys.executable, '-c', f'from app import app; app.run(port={port}, threaded=True)']
+    return [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(port),
+            '--log-level', 'warning', '--backlog', '4096']
+
+
+def process_tree(pid):
+    pids = [pid]
+    for child in pids:
+        try:
+            with open(f'/proc/{child}/task/{child}/children') as f:
+                pids.extend(int(p) for p in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def server_resources(pid):
+    """Threads and resident memory (MB) of the server and its workers (Linux only)"""
+    threads = rss_kb = 0
+    for child in process_tree(pid):
+        try:
+            with open(f'/proc/{child}/status') as f:
+                for line in f:
+                    if line.startswith('Threads:'):
+                        threads += int(line.split()[1])
+                    elif line.startswith('VmRSS:'):
+                        rss_kb += int(line.split()[1])
+        except OSError:
+            return None, None
+    return threads, round(rss_kb / 1024, 1)
+
+
+async def http(port, method, path, body=None, timeout=None):
+    """Send one request on a fresh connection and return the status code"""
+    payload = json.dumps(body).encode() if body is not None else b''
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return FAILED
+    try:
+        writer.write(f'{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode() + payload)
+        await writer.drain()
+        head = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+        return int(head.split()[1])
+    except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+        return FAILED
+    finally:
+        writer.close()
+
+
+async def wait_until_up(port):
+    for _ in range(100):
+        if await http(port, 'GET', '/api/auth/check-username/bench', timeout=1) == 200:
+            return
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+async def measure(port, pid, connections, restroom_id, user_id, since_id, args):
+    polls = []
+    path = f'/api/chat/messages/{restroom_id}?since_id={since_id}&wait={args.wait}'
+    for start in range(0, connections, 100):
+        polls += [asyncio.ensure_future(http(port, 'GET', path, timeout=args.wait + 30))
+                  for _ in range(start, min(start + 100, connections))]
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(args.settle)
+    threads, rss_mb = server_resources(pid)
+
+    async def probe():
+        started = time.perf_counter()
+        status = await http(port, 'GET', f'/api/restrooms/{restroom_id}', timeout=args.probe_timeout)
+        return status, (time.perf_counter() - started) * 1000
+
+    # Probes run while every long-poll is still parked (wait > settle + timeout)
+    probes = await asyncio.gather(*(probe() for _ in range(args.probes)))
+    latencies = sorted(ms for status, ms in probes if status == 200)
+    probe_errors = len(probes) - len(latencies)
+
+    started = time.perf_counter()
+    await http(port, 'POST', '/api/chat/messages',
+               {'restroom_id': restroom_id, 'user_id': user_id, 'message': 'wake'}, timeout=args.wait + 30)
+    statuses = await asyncio.gather(*polls)
+    answered = time.perf_counter() - started
+    return {
+        'connections': connections,
+        'server_threads': threads,
+        'server_rss_mb': rss_mb,
+        'probe_ok': len(latencies),
+        'probe_errors': probe_errors,
+        'probe_p50_ms': round(statistics.median(latencies), 1) if latencies else None,
+        'probe_max_ms': round(latencies[-1], 1) if latencies else None,
+        'polls_ok': sum(1 for status in statuses if status == 200),
+        'polls_failed': sum(1 for status in statuses if status != 200),
+        'all_answered_s': round(answered, 2),
+    }
+
+
+def bench(server, connections, args):
+    """One run on a fresh server, so requests still queued from a previous run do not interfere"""
+    workdir = tempfile.mkdtemp(prefix='restroom-bench-')
+    db_path = os.path.join(workdir, 'bench.db')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}')
+    restroom_id, user_id = prepare_database(db_path, env)
+
+    port = free_port()
+    process = subprocess.Popen(server_command(server, port, args), cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        asyncio.run(wait_until_up(port))
+        result = asyncio.run(measure(port, process.pid, connections, restroom_id, user_id,
+                                     last_message_id(db_path), args))
+    finally:
+        process.terminate()
+        process.wait()
+    return {'server': server, **result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connections', type=int, nargs='+', default=[100, 500, 1000])
+    parser.add_argument('--flask-server', choices=['gthread', 'werkzeug'], default='gthread')
+    parser.add_argument('--threads', type=int, default=32, help='gunicorn gthread threads')
+    parser.add_argument('--wait', type=float, default=30.0, help='long-poll wait in seconds')
+    parser.add_argument('--settle', type=float, default=2.0, help='seconds to let the long-polls park')
+    parser.add_argument('--probes', type=int, default=20)
+    parser.add_argument('--probe-timeout', type=float, default=5.0)
+    args = parser.parse_args()
+    for server in (args.flask_server, 'asgi'):
+        for connections in args.connections:
+            print(json.dumps(bench(server, connections, args)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
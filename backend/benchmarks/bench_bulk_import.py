@@ -0,0 +1,82 @@
+"""Benchmark bulk restroom import time and memory as the file grows.
+
+Generates NDJSON (or CSV) files of synthetic restrooms around Dĩ An, imports
+each with import_restrooms() and reports rows per second and the peak Python
+memory of a second, traced import. Peak memory should not grow with the file:
+
+    python benchmarks/bench_bulk_import.py --sizes 10000 100000 --format csv
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+WORK_DIR = tempfile.mkdtemp(prefix='restroom-bench-')
+DB_PATH = os.path.join(WORK_DIR, 'bench.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, import_restrooms, init_db  # noqa: E402
+
+
+def write_file(path, rows, fmt):
+    rng = random.Random(rows)
+    columns = ['name', 'address', 'latitude', 'longitude', 'is_free', 'price', 'male_sitting', 'images']
+    with open(path, 'w', newline='', encoding='utf-8') as out:
+        writer = csv.writer(out) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(columns)
+        for i in range(rows):
+            is_free = rng.random() < 0.6
+            values = [f'Nhà vệ sinh {i}', f'{i} Đường số {i % 50}, Dĩ An',
+                      round(10.87 + rng.uniform(-0.05, 0.05), 6), round(106.77 + rng.uniform(-0.05, 0.05), 6),
+                      is_free, 0 if is_free else 2000, rng.randint(0, 4), [f'/uploads/{i}.jpg']]
+            if writer:
+                writer.writerow(values[:-1] + [json.dumps(values[-1])])
+            else:
+                out.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False) + '\n')
+
+
+def run_import(path, fmt):
+    with app.app_context(), open(path, 'rb') as stream:
+        return import_restrooms(stream, fmt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+    args = parser.parse_args()
+
+    init_db()
+    for rows in args.sizes:
+        path = os.path.join(WORK_DIR, f'restrooms-{rows}.{args.format}')
+        write_file(path, rows, args.format)
+
+        start = time.perf_counter()
+        report = run_import(path, args.format)
+        elapsed = time.perf_counter() - start
+        assert report.imported == rows and not report.failed, report.as_dict()
+
+        tracemalloc.start()
+        run_import(path, args.format)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(json.dumps({
+            'rows': rows,
+            'format': args.format,
+            'file_mib': round(os.path.getsize(path) / 2 ** 20, 1),
+            'seconds': round(elapsed, 2),
+            'rows_per_second': round(rows / elapsed),
+            'peak_mib': round(peak / 2 ** 20, 1),
+        }), flush=True)
+
+
+if __name__ == '__main__':
+    main()
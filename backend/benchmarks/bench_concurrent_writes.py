@@ -0,0 +1,142 @@
+"""Compare write throughput of stock vs tuned SQLite under gunicorn workers.
+
+Starts the API twice under gunicorn on a throwaway database, once with
+SQLITE_TUNING=0 (rollback journal, no busy timeout) and once with the WAL
+configuration from storage.py, then hammers the write paths (chat messages,
+start/stop usage, reviews) from many client threads. Requires gunicorn:
+
+    pip install gunicorn
+    python benchmarks/bench_concurrent_writes.py --workers 4 --clients 32
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESTROOMS = 20
+USERS = 200
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(path, env):
+    subprocess.run([sys.executable, '-c', 'import app; app.init_db()'], cwd=BACKEND_DIR, env=env,
+                   check=True, stdout=subprocess.DEVNULL)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO owner (name, email, phone) VALUES ('Bench', 'bench@example.com', '0')")
+    owner_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+    conn.executemany(
+        'INSERT INTO restroom (name, address, latitude, longitude, is_free, price, current_users, rating, '
+        'total_reviews, rating_sum, owner_id) VALUES (?, ?, ?, ?, 1, 0, 0, 0, 0, 0, ?)',
+        [(f'Restroom {i}', 'Dĩ An', 10.88 + i * 0.001, 106.79, owner_id) for i in range(RESTROOMS)]
+    )
+    conn.executemany('INSERT INTO user (username, is_random_user, is_using) VALUES (?, 1, 0)',
+                     [(f'bench-{i}',) for i in range(USERS)])
+    conn.commit()
+    conn.close()
+
+
+def request(base, method, path, body=None):
+    data = json.dumps(body or {}).encode()
+    req = urllib.request.Request(base + path, data=data, method=method,
+                                 headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 599
+
+
+def run_load(base, clients, duration):
+    stop_at = time.monotonic() + duration
+    lock = threading.Lock()
+    stats = {'ok': 0, 'errors': 0}
+
+    def client(index):
+        rng = random.Random(index)
+        user_id = index % USERS + 1
+        while time.monotonic() < stop_at:
+            restroom_id = rng.randint(1, RESTROOMS)
+            action = rng.random()
+            if action < 0.4:
+                status = request(base, 'POST', '/api/chat/messages', {
+                    'restroom_id': restroom_id, 'user_id': user_id, 'message': 'bench'})
+            elif action < 0.8:
+                status = request(base, 'POST', f'/api/users/{user_id}/start-using/{restroom_id}')
+                if status < 400:
+                    status = request(base, 'POST', f'/api/users/{user_id}/stop-using')
+            else:
+                status = request(base, 'POST', '/api/reviews', {
+                    'restroom_id': restroom_id, 'user_id': user_id, 'rating': rng.randint(1, 5)})
+            with lock:
+                stats['ok' if status < 400 else 'errors'] += 1
+
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(client, range(clients)))
+    return stats
+
+
+def bench(tuned, args):
+    workdir = tempfile.mkdtemp(prefix='restroom-bench-')
+    db_path = os.path.join(workdir, 'bench.db')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', SQLITE_TUNING='1' if tuned else '0')
+    prepare_database(db_path, env)
+
+    port = free_port()
+    server = subprocess.Popen(
+        ['gunicorn', '-w', str(args.workers), '--threads', str(args.threads), '-b', f'127.0.0.1:{port}', 'app:app'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base = f'http://127.0.0.1:{port}'
+    try:
+        for _ in range(100):
+            if request(base, 'GET', '/api/restrooms?lat=10.88&lng=106.79') == 200:
+                break
+            time.sleep(0.1)
+        stats = run_load(base, args.clients, args.duration)
+    finally:
+        server.terminate()
+        server.wait()
+
+    total = stats['ok'] + stats['errors']
+    return {
+        'config': 'tuned' if tuned else 'stock',
+        'workers': args.workers,
+        'clients': args.clients,
+        'requests': total,
+        'errors': stats['errors'],
+        'ok_per_second': round(stats['ok'] / args.duration, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+    for tuned in (False, True):
+        print(json.dumps(bench(tuned, args)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Benchmark POST /api/restrooms/<id>/arrival with synchronous vs write-behind notifications.
+
+Client threads send arrival notifications concurrently, first with every
+notification committed inside the request, then through the write-behind
+queue. Reports request latency and the number of database commits; the
+queue should cut both:
+
+    python benchmarks/bench_notifications.py --clients 8 32 --requests 100
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='restroom-bench-'), 'bench.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, db, init_db, notification_queue, Notification, Owner, Restroom, User  # noqa: E402
+
+commits = 0
+
+
+def count_commit(connection):
+    global commits
+    commits += 1
+
+
+def run(clients, requests, restroom_id, user_id):
+    global commits
+    barrier = threading.Barrier(clients)
+    timings = []
+    lock = threading.Lock()
+
+    def client():
+        http = app.test_client()
+        local = []
+        barrier.wait()
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = http.post(f'/api/restrooms/{restroom_id}/arrival', json={'user_id': user_id})
+            local.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 201, response.data
+        with lock:
+            timings.extend(local)
+
+    with app.app_context():
+        before = Notification.query.count()
+    commits = 0
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    notification_queue.drain()
+    with app.app_context():
+        stored = Notification.query.count() - before
+
+    timings.sort()
+    return {
+        'requests': len(timings),
+        'stored': stored,
+        'commits': commits,
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'p50_ms': round(statistics.median(timings), 3),
+        'p99_ms': round(timings[int(len(timings) * 0.99) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[8, 32])
+    parser.add_argument('--requests', type=int, default=100, help='per client')
+    args = parser.parse_args()
+
+    init_db()
+    with app.app_context():
+        event.listen(db.engine, 'commit', count_commit)
+        owner = Owner(name='Bench', email='bench-owner@example.com', phone='0900000000')
+        user = User(username='bench')
+        db.session.add_all([owner, user])
+        db.session.flush()
+        restroom = Restroom(name='Bench', address='Dĩ An', latitude=10.88, longitude=106.79, owner_id=owner.id)
+        db.session.add(restroom)
+        db.session.commit()
+        restroom_id, user_id = restroom.id, user.id
+
+    for clients in args.clients:
+        for mode, enabled in (('synchronous', False), ('write_behind', True)):
+            notification_queue.enabled = enabled
+            result = run(clients, args.requests, restroom_id, user_id)
+            print(json.dumps({'mode': mode, 'clients': clients, **result}), flush=True)
+
+
+if __name__ == '__main__':
+    main()
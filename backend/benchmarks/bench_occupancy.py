@@ -0,0 +1,98 @@
+"""Load test start-using / stop-using against a single hot restroom.
+
+Many client threads start and stop sessions on the same restroom at once. At
+the end the restroom's current_users must equal the number of sessions left
+open, and start/stop latency should stay stable as concurrency grows:
+
+    python benchmarks/bench_occupancy.py --clients 8 16 32 --cycles 50
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='restroom-bench-'), 'bench.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, init_db, Restroom, UsageHistory, User  # noqa: E402
+
+
+def run(clients, cycles, restroom_id, user_ids):
+    barrier = threading.Barrier(clients)
+    timings = []
+    failures = []
+    lock = threading.Lock()
+
+    def client(user_id, leave_open):
+        http = app.test_client()
+        local = []
+        barrier.wait()
+        for cycle in range(cycles):
+            for path in (f'/api/users/{user_id}/start-using/{restroom_id}', f'/api/users/{user_id}/stop-using'):
+                if leave_open and cycle == cycles - 1 and 'stop' in path:
+                    continue
+                start = time.perf_counter()
+                response = http.post(path)
+                local.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    failures.append(response.status_code)
+        with lock:
+            timings.extend(local)
+
+    threads = [threading.Thread(target=client, args=(user_id, index % 2 == 0))
+               for index, user_id in enumerate(user_ids[:clients])]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        current_users = db.session.get(Restroom, restroom_id).current_users
+        open_sessions = UsageHistory.query.filter_by(restroom_id=restroom_id, end_time=None).count()
+        # Close everything for the next round
+        for user_id in user_ids[:clients]:
+            app.test_client().post(f'/api/users/{user_id}/stop-using')
+
+    timings.sort()
+    return {
+        'clients': clients,
+        'requests': len(timings),
+        'failures': len(failures),
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'p50_ms': round(statistics.median(timings), 3),
+        'p99_ms': round(timings[int(len(timings) * 0.99) - 1], 3),
+        'current_users': current_users,
+        'open_sessions': open_sessions,
+        'exact': current_users == open_sessions == (clients + 1) // 2,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[8, 16, 32])
+    parser.add_argument('--cycles', type=int, default=50)
+    args = parser.parse_args()
+
+    init_db()
+    with app.app_context():
+        restroom = Restroom(name='Hot restroom', address='Dĩ An', latitude=10.88, longitude=106.79)
+        users = [User(username=f'bench-{i}') for i in range(max(args.clients))]
+        db.session.add(restroom)
+        db.session.add_all(users)
+        db.session.commit()
+        restroom_id = restroom.id
+        user_ids = [user.id for user in users]
+
+    for clients in args.clients:
+        print(json.dumps(run(clients, args.cycles, restroom_id, user_ids)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark page latency of GET /api/users/<id>/payments as paging goes deeper.
+
+Seeds one user with many payments, walks every page with ?limit=&cursor= and
+reports the page latency at several depths, next to the same page fetched
+with LIMIT/OFFSET. Keyset pages should stay flat while OFFSET grows with depth:
+
+    python benchmarks/bench_pagination.py --rows 200000 --limit 50
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='restroom-bench-'), 'bench.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, init_db, Owner, Payment, Restroom, User, USER_PAYMENT_SCHEMA  # noqa: E402
+
+
+START = datetime(2024, 1, 1)
+
+
+def seed_payments(user_id, restroom_id, owner_id, rows):
+    conn = sqlite3.connect(DB_PATH)
+    batch = []
+    for i in range(rows):
+        # Several payments share each timestamp so the id tie-break matters
+        created_at = (START + timedelta(seconds=i // 4)).strftime('%Y-%m-%d %H:%M:%S.%f')
+        batch.append((user_id, restroom_id, owner_id, 'cash', 2000, 'confirmed', created_at))
+        if len(batch) == 50000:
+            conn.executemany('INSERT INTO payment (user_id, restroom_id, owner_id, method, amount, status, created_at) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+            batch = []
+    if batch:
+        conn.executemany('INSERT INTO payment (user_id, restroom_id, owner_id, method, amount, status, created_at) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+    conn.commit()
+    conn.close()
+
+
+def offset_page(user_id, offset, limit):
+    rows = db.session.query(*USER_PAYMENT_SCHEMA.columns).join(
+        Restroom, Payment.restroom_id == Restroom.id
+    ).filter(Payment.user_id == user_id).order_by(
+        Payment.created_at.desc(), Payment.id.desc()
+    ).offset(offset).limit(limit).all()
+    return USER_PAYMENT_SCHEMA.many(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--samples', type=int, default=20, help='pages timed around each depth')
+    args = parser.parse_args()
+
+    init_db()
+    with app.app_context():
+        owner = Owner(name='Bench', email='bench-owner@example.com', phone='0900000000')
+        user = User(username='bench')
+        db.session.add_all([owner, user])
+        db.session.flush()
+        restroom = Restroom(name='Bench', address='Dĩ An', latitude=10.88, longitude=106.79, owner_id=owner.id)
+        db.session.add(restroom)
+        db.session.commit()
+        user_id, restroom_id, owner_id = user.id, restroom.id, owner.id
+    seed_payments(user_id, restroom_id, owner_id, args.rows)
+
+    client = app.test_client()
+    timings = []
+    cursor = None
+    seen = 0
+    while True:
+        url = f'/api/users/{user_id}/payments?limit={args.limit}' + (f'&cursor={cursor}' if cursor else '')
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.data
+        body = response.get_json()
+        seen += len(body['items'])
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+    assert seen == args.rows, (seen, args.rows)
+
+    pages = len(timings)
+    with app.test_request_context():
+        for fraction in (0, 0.1, 0.5, 0.9, 0.99):
+            page = min(int(pages * fraction), pages - args.samples) if pages > args.samples else 0
+            window = timings[page:page + args.samples]
+            offset_timings = []
+            for i in range(page, min(page + args.samples, pages)):
+                start = time.perf_counter()
+                offset_page(user_id, i * args.limit, args.limit)
+                offset_timings.append((time.perf_counter() - start) * 1000)
+            print(json.dumps({
+                'depth_rows': page * args.limit,
+                'keyset_p50_ms': round(statistics.median(window), 3),
+                'offset_p50_ms': round(statistics.median(offset_timings), 3),
+            }), flush=True)
+    print(json.dumps({'pages': pages, 'rows': seen}))
+
+
+if __name__ == '__main__':
+    main()
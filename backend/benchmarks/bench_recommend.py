@@ -0,0 +1,130 @@
+"""Benchmark GET /api/restrooms/recommend against ranking the full list locally.
+
+Seeds N restrooms spread over Dĩ An with random facilities, prices, occupancy
+and ratings, then for random locations and several filter combinations times
+the recommendation endpoint and the client's current approach: fetching
+``GET /api/restrooms`` and scoring every restroom itself. Both must agree on
+the top-k scores. The full list is cached, so its cache is cleared before
+every request; recommendations are never cached:
+
+    python benchmarks/bench_recommend.py --rows 20000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='restroom-bench-'), 'bench.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import (  # noqa: E402
+    MAX_RECOMMEND_RADIUS_M, RESTROOMS_CACHE, Restroom, app, db, recommendation_score, response_cache
+)
+from spatial import encode_geohash, haversine_m  # noqa: E402
+
+CENTER_LAT, CENTER_LNG = 10.8900, 106.7700
+SPREAD_DEG = 0.06
+# (query string, the same filter as a predicate on a serialized restroom)
+FILTERS = (
+    ('', lambda r: True),
+    ('is_free=1', lambda r: r['is_free']),
+    ('gender=female&disabled_access=1',
+     lambda r: r['female_sitting'] > 0 and r['disabled_access']),
+    ('max_price=2000&facilities=male_standing',
+     lambda r: (r['is_free'] or r['price'] <= 2000) and r['male_standing'] > 0),
+)
+
+
+class Scored:
+    """A serialized restroom read like a row by recommendation_score()"""
+
+    def __init__(self, item):
+        self.__dict__.update(item)
+
+
+def seed(rows, rng):
+    db.session.query(Restroom).delete()
+    batch = []
+    for i in range(rows):
+        lat = CENTER_LAT + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+        lng = CENTER_LNG + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+        is_free = rng.random() < 0.7
+        reviews = rng.randrange(20)
+        batch.append({
+            'name': f'Nhà vệ sinh {i}', 'address': f'{i} Đường số {i % 50}, Dĩ An',
+            'latitude': lat, 'longitude': lng, 'geohash': encode_geohash(lat, lng),
+            'is_free': is_free, 'price': 0 if is_free else rng.choice((2000, 3000, 5000)),
+            'current_users': rng.randrange(5), 'rating': round(rng.uniform(1, 5), 2) if reviews else 0.0,
+            'total_reviews': reviews, 'rating_sum': 0, 'admin_contact': 'owner@example.com',
+            'male_standing': rng.randrange(4), 'male_sitting': rng.randrange(3),
+            'female_sitting': rng.randrange(4), 'disabled_access': rng.random() < 0.3,
+        })
+    db.session.execute(db.insert(Restroom), batch)
+    db.session.commit()
+
+
+def local_top(items, lat, lng, keep, limit):
+    """What the client computes today from the full list"""
+    scored = []
+    for item in items:
+        distance = haversine_m(lat, lng, item['latitude'], item['longitude'])
+        if keep(item) and distance <= MAX_RECOMMEND_RADIUS_M:
+            scored.append(round(recommendation_score(distance, Scored(item))))
+    return sorted(scored)[:limit]
+
+
+def timed(client, url):
+    response_cache.invalidate(RESTROOMS_CACHE)
+    start = time.perf_counter()
+    response = client.get(url)
+    return time.perf_counter() - start, response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[20000])
+    parser.add_argument('--points', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        for rows in args.rows:
+            seed(rows, rng)
+            for query, keep in FILTERS:
+                recommend_ms, full_ms, queries = [], [], []
+                for _ in range(args.points):
+                    lat = CENTER_LAT + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+                    lng = CENTER_LNG + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+                    seconds, response = timed(
+                        client, f'/api/restrooms/recommend?lat={lat}&lng={lng}&limit={args.limit}&{query}')
+                    recommend_ms.append(seconds * 1000)
+                    queries.append(int(response.headers['X-Query-Count']))
+                    recommended = [item['score'] for item in response.get_json()]
+
+                    seconds, response = timed(client, '/api/restrooms')
+                    start = time.perf_counter()
+                    expected = local_top(response.get_json(), lat, lng, keep, args.limit)
+                    full_ms.append((seconds + time.perf_counter() - start) * 1000)
+                    full_bytes = len(response.get_data())
+                    assert recommended == expected, (query, lat, lng, recommended, expected)
+                print(json.dumps({
+                    'rows': rows,
+                    'filters': query or None,
+                    'recommend_p50_ms': round(statistics.median(recommend_ms), 2),
+                    'recommend_max_ms': round(max(recommend_ms), 2),
+                    'max_queries': max(queries),
+                    'full_list_p50_ms': round(statistics.median(full_ms), 2),
+                    'full_list_bytes': full_bytes,
+                }), flush=True)
+
+
+if __name__ == '__main__':
+    main()
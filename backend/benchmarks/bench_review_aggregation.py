@@ -0,0 +1,86 @@
+"""Benchmark POST /api/reviews latency as a restroom's review count grows.
+
+The rating aggregate is maintained incrementally, so latency should stay flat
+from 10 to 1M existing reviews. Runs against a throwaway SQLite database:
+
+    python benchmarks/bench_review_aggregation.py --sizes 10 1000 100000 1000000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='restroom-bench-'), 'bench.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, Restroom, User, rebuild_rating_aggregates  # noqa: E402
+
+
+def seed_reviews(restroom_id, user_id, target):
+    """Top the restroom up to ``target`` reviews with raw batched inserts"""
+    conn = sqlite3.connect(DB_PATH)
+    existing = conn.execute('SELECT COUNT(*) FROM review WHERE restroom_id = ?', (restroom_id,)).fetchone()[0]
+    batch = []
+    for i in range(existing, target):
+        batch.append((restroom_id, user_id, i % 5 + 1, 'seed', '', '2024-01-01 00:00:00'))
+        if len(batch) == 50000:
+            conn.executemany('INSERT INTO review (restroom_id, user_id, rating, comment, image_path, created_at) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', batch)
+            batch = []
+    if batch:
+        conn.executemany('INSERT INTO review (restroom_id, user_id, rating, comment, image_path, created_at) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', batch)
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000, 1000000])
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        restroom = Restroom(name='Bench', address='Dĩ An', latitude=10.88, longitude=106.79)
+        user = User(username='bench')
+        db.session.add_all([restroom, user])
+        db.session.commit()
+        restroom_id, user_id = restroom.id, user.id
+
+    client = app.test_client()
+    results = []
+    for size in sorted(args.sizes):
+        seed_reviews(restroom_id, user_id, size)
+        with app.app_context():
+            rebuild_rating_aggregates()
+
+        timings = []
+        for i in range(args.requests):
+            start = time.perf_counter()
+            response = client.post('/api/reviews', json={
+                'restroom_id': restroom_id, 'user_id': user_id, 'rating': i % 5 + 1
+            })
+            timings.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 201, response.data
+
+        timings.sort()
+        results.append({
+            'existing_reviews': size,
+            'p50_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3),
+        })
+        print(json.dumps(results[-1]), flush=True)
+
+    with app.app_context():
+        drifted = rebuild_rating_aggregates()
+    print(json.dumps({'drifted_after_run': drifted}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""Micro-benchmark response serialization: hand-built dicts vs row schemas.
+
+For each payload the legacy path loads full ORM objects, builds the dicts by
+hand (``isoformat()`` per row) and encodes with ``jsonify``; the schema path
+selects only the needed columns, maps rows with a RowSchema and encodes with
+``serializers.dumps`` (orjson when installed).
+Both must produce the same JSON:
+
+    python benchmarks/bench_serialization.py --rows 100 1000 10000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='restroom-bench-'), 'bench.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import jsonify  # noqa: E402
+
+import serializers  # noqa: E402
+from app import (  # noqa: E402
+    app, db, Restroom, Review, UsageHistory, User,
+    RESTROOM_SCHEMA, REVIEW_HISTORY_SCHEMA, USAGE_HISTORY_SCHEMA,
+)
+
+
+def legacy_restrooms():
+    return jsonify([{
+        'id': r.id,
+        'name': r.name,
+        'address': r.address,
+        'latitude': r.latitude,
+        'longitude': r.longitude,
+        'is_free': r.is_free,
+        'price': r.price,
+        'current_users': r.current_users,
+        'rating': r.rating,
+        'total_reviews': r.total_reviews,
+        'admin_contact': r.admin_contact,
+        'image_url': r.image_url,
+        'male_standing': r.male_standing or 0,
+        'male_sitting': r.male_sitting or 0,
+        'female_sitting': r.female_sitting or 0,
+        'disabled_access': r.disabled_access or False
+    } for r in Restroom.query.all()]).get_data()
+
+
+def schema_restrooms():
+    rows = db.session.query(*RESTROOM_SCHEMA.columns).all()
+    return serializers.dumps(RESTROOM_SCHEMA.many(rows))
+
+
+def legacy_history(user_id):
+    usage = db.session.query(UsageHistory, Restroom).join(
+        Restroom, UsageHistory.restroom_id == Restroom.id
+    ).filter(UsageHistory.user_id == user_id).order_by(UsageHistory.created_at.desc()).all()
+    reviews = db.session.query(Review, Restroom).join(
+        Restroom, Review.restroom_id == Restroom.id
+    ).filter(Review.user_id == user_id).order_by(Review.created_at.desc()).all()
+    return jsonify({
+        'usage_history': [{
+            'id': u.id,
+            'type': 'usage',
+            'restroom_name': r.name,
+            'restroom_address': r.address,
+            'start_time': u.start_time.isoformat(),
+            'end_time': u.end_time.isoformat() if u.end_time else None,
+            'duration_minutes': u.duration_minutes,
+            'created_at': u.created_at.isoformat()
+        } for u, r in usage],
+        'reviews': [{
+            'id': rev.id,
+            'type': 'review',
+            'restroom_name': r.name,
+            'restroom_address': r.address,
+            'rating': rev.rating,
+            'comment': rev.comment,
+            'image_path': rev.image_path,
+            'created_at': rev.created_at.isoformat()
+        } for rev, r in reviews]
+    }).get_data()
+
+
+def schema_history(user_id):
+    usage = db.session.query(*USAGE_HISTORY_SCHEMA.columns).join(
+        Restroom, UsageHistory.restroom_id == Restroom.id
+    ).filter(UsageHistory.user_id == user_id).order_by(UsageHistory.created_at.desc()).all()
+    reviews = db.session.query(*REVIEW_HISTORY_SCHEMA.columns).join(
+        Restroom, Review.restroom_id == Restroom.id
+    ).filter(Review.user_id == user_id).order_by(Review.created_at.desc()).all()
+    return serializers.dumps({
+        'usage_history': USAGE_HISTORY_SCHEMA.many(usage),
+        'reviews': REVIEW_HISTORY_SCHEMA.many(reviews)
+    })
+
+
+def seed(rows, user_id):
+    """Reset to ``rows`` restrooms and ``rows`` usage sessions and reviews for one user"""
+    db.session.query(UsageHistory).delete()
+    db.session.query(Review).delete()
+    db.session.query(Restroom).delete()
+    db.session.commit()
+    base = datetime(2024, 1, 1)
+    restrooms = [Restroom(
+        name=f'Nhà vệ sinh {i}', address=f'{i} Đường số 1, Dĩ An',
+        latitude=10.88 + i * 1e-5, longitude=106.79, is_free=i % 2 == 0, price=i % 2 * 2000,
+        admin_contact='0900000000',
+        male_standing=2, female_sitting=3, disabled_access=i % 3 == 0
+    ) for i in range(rows)]
+    db.session.add_all(restrooms)
+    db.session.flush()
+    for i, restroom in enumerate(restrooms):
+        start = base + timedelta(minutes=i)
+        db.session.add(UsageHistory(user_id=user_id, restroom_id=restroom.id, start_time=start,
+                                    end_time=start + timedelta(minutes=5), duration_minutes=5,
+                                    created_at=start))
+        db.session.add(Review(user_id=user_id, restroom_id=restroom.id, rating=i % 5 + 1,
+                              comment='Sạch sẽ', created_at=start))
+    db.session.commit()
+
+
+def measure(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        db.session.expire_all()
+        start = time.perf_counter()
+        body = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with app.test_request_context():
+        db.create_all()
+        user = User(username='bench')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        for rows in args.rows:
+            seed(rows, user_id)
+            for payload, legacy, fast in (
+                ('restrooms', legacy_restrooms, schema_restrooms),
+                ('user_history', lambda: legacy_history(user_id), lambda: schema_history(user_id)),
+            ):
+                legacy_s, legacy_body = measure(legacy, args.repeat)
+                fast_s, fast_body = measure(fast, args.repeat)
+                assert json.loads(legacy_body) == json.loads(fast_body), payload
+                print(json.dumps({
+                    'payload': payload,
+                    'rows': rows,
+                    'encoder': 'orjson' if serializers.orjson else 'json',
+                    'legacy_ms': round(legacy_s * 1000, 3),
+                    'schema_ms': round(fast_s * 1000, 3),
+                    'speedup': round(legacy_s / fast_s, 2),
+                }), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark peak memory of a user's full history: /history vs streamed /timeline.
+
+/history materializes both lists before encoding them; /timeline merges two
+index-ordered cursors and streams the JSON. Peak Python memory (tracemalloc)
+of /timeline should stay flat as the history grows:
+
+    python benchmarks/bench_timeline.py --sizes 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='restroom-bench-'), 'bench.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, init_db, Restroom, User  # noqa: E402
+
+
+def seed_history(user_id, restroom_id, target):
+    """Top the user up to ``target`` usage sessions and ``target`` reviews"""
+    conn = sqlite3.connect(DB_PATH)
+    existing = conn.execute('SELECT COUNT(*) FROM review WHERE user_id = ?', (user_id,)).fetchone()[0]
+    for start in range(existing, target, 50000):
+        rows = range(start, min(start + 50000, target))
+        conn.executemany(
+            'INSERT INTO usage_history (user_id, restroom_id, start_time, end_time, duration_minutes, created_at) '
+            "VALUES (?, ?, datetime('2020-01-01', ? || ' minutes'), datetime('2020-01-01', ? || ' minutes'), 5, "
+            "datetime('2020-01-01', ? || ' minutes'))",
+            [(user_id, restroom_id, i * 10, i * 10 + 5, i * 10) for i in rows]
+        )
+        conn.executemany(
+            'INSERT INTO review (user_id, restroom_id, rating, comment, image_path, created_at) '
+            "VALUES (?, ?, ?, 'Sạch sẽ', '', datetime('2020-01-01', ? || ' minutes'))",
+            [(user_id, restroom_id, i % 5 + 1, i * 10 + 7) for i in rows]
+        )
+    conn.commit()
+    conn.close()
+
+
+def measure(client, url):
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(url, buffered=False)
+    size = sum(len(chunk) for chunk in response.response)
+    response.close()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert response.status_code == 200
+    return elapsed, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    init_db()
+    with app.app_context():
+        restroom = Restroom(name='Bench', address='Dĩ An', latitude=10.88, longitude=106.79)
+        user = User(username='bench')
+        db.session.add_all([restroom, user])
+        db.session.commit()
+        user_id, restroom_id = user.id, restroom.id
+
+    client = app.test_client()
+    for size in sorted(args.sizes):
+        seed_history(user_id, restroom_id, size)
+        for route in ('history', 'timeline'):
+            elapsed, peak, body_bytes = measure(client, f'/api/users/{user_id}/{route}')
+            print(json.dumps({
+                'route': route,
+                'entries': size * 2,
+                'elapsed_ms': round(elapsed * 1000, 1),
+                'peak_mib': round(peak / 2 ** 20, 2),
+                'body_mib': round(body_bytes / 2 ** 20, 2),
+            }), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Compare bytes on the wire and encode time of the restroom list per format.
+
+Seeds N restrooms, then encodes the ``GET /api/restrooms`` payload as JSON and
+as MessagePack, each uncompressed, gzip-compressed and (with the ``brotli``
+package) brotli-compressed. For every variant it reports the body size, the
+server-side encode + compress time, the client-side decompress + decode time,
+and the latency of the full request through the app with matching Accept and
+Accept-Encoding headers (caches cleared each time). Needs msgpack:
+
+    pip install msgpack
+    python benchmarks/bench_wire_formats.py --rows 1000 10000
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='restroom-bench-'), 'bench.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compression  # noqa: E402
+import serializers  # noqa: E402
+from app import RESTROOM_SCHEMA, RESTROOMS_CACHE, Restroom, app, compressor, db, response_cache  # noqa: E402
+
+MSGPACK = serializers.MSGPACK_MIMETYPES[0]
+
+
+def seed(rows):
+    db.session.query(Restroom).delete()
+    db.session.execute(db.insert(Restroom), [{
+        'name': f'Nhà vệ sinh {i}', 'address': f'{i} Đường số {i % 50}, Dĩ An',
+        'latitude': 10.87 + (i % 1000) * 1e-4, 'longitude': 106.77 + (i // 1000) * 1e-3,
+        'is_free': i % 3 != 0, 'price': 0 if i % 3 else 2000, 'current_users': i % 4,
+        'rating': round(3 + (i % 20) / 10, 1), 'total_reviews': i % 40, 'rating_sum': 0,
+        'admin_contact': 'owner@example.com', 'male_standing': 2, 'male_sitting': 1, 'female_sitting': 3,
+        'disabled_access': i % 5 == 0,
+    } for i in range(rows)])
+    db.session.commit()
+
+
+def decode(body, mimetype, encoding):
+    if encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif encoding == 'br':
+        body = compression.brotli.decompress(body)
+    if mimetype == MSGPACK:
+        return serializers.msgpack.unpackb(body)
+    return serializers.loads(body)
+
+
+def best_of(repeat, fn):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    if serializers.msgpack is None:
+        sys.exit('msgpack is not installed: pip install msgpack')
+
+    encodings = [None, 'gzip'] + (['br'] if compression.brotli is not None else [])
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        for rows in args.rows:
+            seed(rows)
+            items = RESTROOM_SCHEMA.many(db.session.query(*RESTROOM_SCHEMA.columns).all())
+            json_bytes = None
+            for mimetype in (serializers.JSON_MIMETYPE, MSGPACK):
+                for encoding in encodings:
+                    def encode():
+                        body = serializers.encode(items, mimetype)
+                        return compression.compress(body, encoding) if encoding else body
+                    encode_s, body = best_of(args.repeat, encode)
+                    decode_s, decoded = best_of(args.repeat, lambda: decode(body, mimetype, encoding))
+                    assert decoded == items, (mimetype, encoding)
+
+                    headers = {'Accept': mimetype, 'Accept-Encoding': encoding or 'identity'}
+
+                    def request():
+                        response_cache.invalidate(RESTROOMS_CACHE)
+                        compressor.clear()
+                        return client.get('/api/restrooms', headers=headers)
+                    request_s, response = best_of(args.repeat, request)
+                    assert response.mimetype == mimetype and response.content_encoding == encoding, headers
+                    assert decode(response.get_data(), mimetype, encoding) == items, headers
+
+                    json_bytes = json_bytes or len(body)
+                    print(json.dumps({
+                        'rows': rows,
+                        'format': 'msgpack' if mimetype == MSGPACK else 'json',
+                        'encoding': encoding or 'identity',
+                        'bytes': len(body),
+                        'vs_json': round(len(body) / json_bytes, 3),
+                        'encode_ms': round(encode_s * 1000, 2),
+                        'decode_ms': round(decode_s * 1000, 2),
+                        'request_ms': round(request_s * 1000, 2),
+                    }), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Check that malformed query parameters and cursors are refused with 400, never a 500.
+
+Sends each request in CASES to a throwaway database and compares the status
+with the expected one. Exits non-zero on any mismatch, so it can gate CI:
+
+    python benchmarks/check_bad_requests.py
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+
+WORKDIR = tempfile.mkdtemp(prefix='restroom-bench-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, reset_db  # noqa: E402
+
+
+def cursor(values):
+    """A hand-made cursor token holding ``values``"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+# (url, expected status)
+CASES = [
+    # Positions must be finite and on the globe, radii finite and positive
+    ('/api/restrooms?lat=10.88&lng=106.79', 200),
+    ('/api/restrooms?lat=nan&lng=106.79', 400),
+    ('/api/restrooms?lat=10.88&lng=inf', 400),
+    ('/api/restrooms?lat=-inf&lng=106.79', 400),
+    ('/api/restrooms?lat=91&lng=106.79', 400),
+    ('/api/restrooms?lat=10.88&lng=-180.5', 400),
+    ('/api/restrooms?lat=10.88&lng=106.79&radius_m=0', 400),
+    ('/api/restrooms?lat=10.88&lng=106.79&radius_m=-5', 400),
+    ('/api/restrooms?lat=10.88&lng=106.79&radius_m=nan', 400),
+    ('/api/restrooms?lat=10.88&lng=106.79&radius_m=inf', 400),
+    ('/api/restrooms?bbox=106.7,10.8,106.9,10.9', 200),
+    ('/api/restrooms?bbox=1,2,nan,4', 400),
+    ('/api/restrooms?bbox=1,2,3,inf', 400),
+    ('/api/restrooms?bbox=-inf,2,3,4', 400),
+    ('/api/restrooms/recommend?lat=10.88&lng=106.79', 200),
+    ('/api/restrooms/recommend?lat=nan&lng=106.79', 400),
+    ('/api/restrooms/recommend?lat=10.88&lng=inf', 400),
+    ('/api/restrooms/recommend?lat=-90.5&lng=106.79', 400),
+    ('/api/restrooms/recommend?lat=10.88&lng=181', 400),
+    ('/api/restrooms/recommend?lat=10.88&lng=106.79&radius_m=0', 400),
+    ('/api/restrooms/recommend?lat=10.88&lng=106.79&radius_m=nan', 400),
+    ('/api/restrooms/recommend?lat=10.88&lng=106.79&radius_m=inf', 400),
+    ('/api/restrooms/catalog?bbox=1,2,nan,4', 400),
+    ('/api/restrooms/status?lat=10.88&lng=106.79', 200),
+    ('/api/restrooms/status?lat=nan&lng=106.79', 400),
+    ('/api/restrooms/status?lat=10.88&lng=200', 400),
+    ('/api/restrooms/status?lat=10.88&lng=106.79&radius_m=inf', 400),
+    ('/api/restrooms/status?bbox=1,2,nan,4', 400),
+    # Cursors are client input: only scalars of the key columns' types, one per key
+    (f'/api/chat/messages/1?cursor={cursor([5])}', 200),
+    ('/api/chat/messages/1?cursor=W3siYSI6MX1d', 400),  # [{"a":1}]
+    (f'/api/chat/messages/1?cursor={cursor([[1]])}', 400),
+    (f'/api/chat/messages/1?cursor={cursor(["5"])}', 400),
+    (f'/api/chat/messages/1?cursor={cursor([True])}', 400),
+    (f'/api/chat/messages/1?cursor={cursor([2 ** 64])}', 400),
+    (f'/api/chat/messages/1?cursor={cursor([5, 6])}', 400),
+    (f'/api/chat/messages/1?cursor={cursor({"id": 5})}', 400),
+    ('/api/chat/messages/1?cursor=not-base64!', 400),
+    (f'/api/owner/1/restrooms?cursor={cursor([{"a": 1}])}', 400),
+    (f'/api/users/1/payments?cursor={cursor(["2024-01-01T00:00:00", 3])}', 200),
+    (f'/api/users/1/payments?cursor={cursor([{"a": 1}, 3])}', 400),
+    (f'/api/users/1/payments?cursor={cursor([20240101, 3])}', 400),
+    (f'/api/users/1/payments?cursor={cursor(["2024-01-01T00:00:00", "3"])}', 400),
+    (f'/api/owner/1/payments?cursor={cursor(["2024-01-01T00:00:00"])}', 400),
+    (f'/api/users/1/history?cursor={cursor([["2024-01-01T00:00:00", {"a": 1}], None])}', 400),
+    (f'/api/users/1/timeline?cursor={cursor(["2024-01-01T00:00:00", "usage", [1]])}', 400),
+    (f'/api/users/1/timeline?cursor={cursor([{"a": 1}, "usage", 1])}', 400),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.parse_args()
+
+    reset_db()
+    client = app.test_client()
+    failed = False
+    for url, expected in CASES:
+        response = client.get(url)
+        ok = response.status_code == expected
+        failed |= not ok
+        print(json.dumps({'url': url, 'status': response.status_code, 'expected': expected, 'ok': ok}))
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""Check every API route against its SQL query budget.
+
+Seeds a throwaway database, calls each route once with the response cache
+cleared and compares the number of statements it ran (the X-Query-Count
+header) with QUERY_BUDGETS in app.py. Exits non-zero if a route is over
+budget, has no budget entry or was not exercised, so it can gate CI. The
+scenario runs twice, with notifications written behind the request and with
+them written synchronously (as when NOTIFICATION_QUEUE_SIZE=0 or the queue
+is full):
+
+    python benchmarks/check_query_budgets.py
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import sys
+import tempfile
+
+WORKDIR = tempfile.mkdtemp(prefix='restroom-bench-')
+DB_PATH = os.path.join(WORKDIR, 'bench.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ['BLOB_STORE_DIR'] = os.path.join(WORKDIR, 'blobs')
+# Report every route instead of failing on the first one over budget
+os.environ['QUERY_BUDGET_STRICT'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import (  # noqa: E402
+    CATALOG_CACHE, QUERY_BUDGETS, RESTROOMS_CACHE, app, db, notification_queue, query_counter, reset_db,
+    response_cache, Notification
+)
+
+OWNER = 'budget-owner@example.com'
+# 1x1 transparent PNG
+IMAGE = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==')
+# Long-lived event stream, not a request/response route
+STREAMED = {'stream_events'}
+
+
+def scenario(ids):
+    """(method, url, body[, check]) for every route, in an order that works.
+
+    A body is JSON, raw text, or bytes sent as a multipart image upload. A
+    check, when given, must hold for the JSON response; it makes sure a step
+    took the path it is meant to measure and not an early return.
+    """
+    restroom, user, paid = ids['restroom'], ids['user'], ids['paid_restroom']
+    return [
+        ('GET', '/api/restrooms', None),
+        ('GET', '/api/restrooms?include=images', None),
+        ('GET', '/api/restrooms?lat=10.88&lng=106.79&radius_m=2000', None),
+        ('GET', '/api/restrooms/recommend?lat=10.88&lng=106.79', None),
+        ('GET', '/api/restrooms/recommend?lat=10.88&lng=106.79&is_free=1&gender=female&include=images', None),
+        ('GET', '/api/restrooms/catalog', None),
+        ('GET', '/api/restrooms/catalog?include=images', None),
+        ('GET', '/api/restrooms/status?lat=10.88&lng=106.79', None),
+        ('GET', f'/api/restrooms/{restroom}', None),
+        ('GET', f'/api/restrooms/{restroom}?fields=name,images,reviews.rating', None),
+        ('POST', '/api/images', IMAGE),
+        ('GET', f'/api/images/{ids["image"]}', None),
+        ('POST', '/api/users', {'username': 'budget-guest'}),
+        ('POST', '/api/reviews', {'restroom_id': restroom, 'user_id': user, 'rating': 4, 'comment': 'ok'}),
+        ('POST', '/api/chat/messages', {'restroom_id': restroom, 'user_id': user, 'message': 'xin chào'}),
+        ('GET', f'/api/chat/messages/{restroom}', None),
+        ('GET', f'/api/chat/messages/{restroom}?limit=10', None),
+        ('GET', f'/api/chat/messages/{restroom}?since_id=0&wait=0.01', None),
+        ('POST', f'/api/restrooms/{restroom}/navigation', {'user_id': user}),
+        ('POST', f'/api/restrooms/{restroom}/arrival', {'user_id': user}),
+        ('POST', f'/api/restrooms/{restroom}/notify-owner', {'user_id': user, 'type': 'help', 'message': 'hết giấy'}),
+        ('POST', '/api/auth/register', {'username': 'budget-user', 'password': 'secret'}),
+        ('POST', '/api/auth/login', {'username': 'budget-user', 'password': 'secret'}),
+        ('POST', '/api/auth/login', {'username': OWNER, 'password': 'secret'}),
+        ('GET', '/api/auth/check-username/budget-user', None),
+        ('POST', f'/api/users/{user}/start-using/{restroom}', None),
+        ('POST', f'/api/users/{user}/stop-using', None),
+        ('GET', f'/api/users/{user}/history', None),
+        ('GET', f'/api/users/{user}/history?limit=10', None),
+        ('GET', f'/api/users/{user}/timeline', None),
+        ('GET', f'/api/users/{user}/timeline?limit=10', None),
+        ('POST', '/api/owner/register', {
+            'owner': {'name': 'Budget', 'email': OWNER, 'phone': '0900000000'},
+            'restrooms': [{'name': 'Budget 2', 'address': 'Dĩ An'}],
+        }),
+        ('GET', f'/api/owner/{ids["owner"]}/restrooms', None),
+        ('GET', f'/api/owner/{OWNER}/restrooms', None),
+        ('GET', f'/api/owner/{OWNER}/restrooms?include=images', None),
+        ('GET', f'/api/owner/{OWNER}/restrooms?fields=name&limit=10', None),
+        ('POST', '/api/owner/restrooms', {'name': 'Budget 3', 'address': 'Dĩ An', 'admin_contact': OWNER,
+                                          'images': [ids['image']]}),
+        ('PUT', f'/api/owner/restrooms/{restroom}', {'name': 'Budget 1', 'images': [ids['image']]}),
+        ('POST', f'/api/owner/{OWNER}/restrooms/import?format=ndjson',
+         '{"name": "Imported", "address": "Dĩ An", "latitude": 10.9, "longitude": 106.8}\n'),
+        ('GET', '/api/restrooms/export?format=ndjson', None),
+        ('GET', f'/api/owner/{OWNER}/notifications', None),
+        ('GET', f'/api/owner/{OWNER}/notifications/unread_count', None),
+        ('PUT', f'/api/owner/notifications/{ids["notification"]}/read', None),
+        # Fresh unread notifications, so the bulk mark-read below changes rows
+        ('POST', f'/api/restrooms/{restroom}/notify-owner', {'user_id': user, 'type': 'paper', 'message': 'hết giấy'}),
+        ('POST', f'/api/restrooms/{restroom}/notify-owner', {'user_id': user, 'type': 'help', 'message': 'cần giúp'}),
+        ('PUT', f'/api/owner/{OWNER}/notifications/read', {'up_to_id': 2 ** 31 - 1},
+         lambda data: data['marked'] >= 2),
+        ('GET', '/api/cache/stats', None),
+        ('GET', '/metrics', None),
+        ('POST', '/api/payments', {'user_id': user, 'restroom_id': paid, 'method': 'transfer', 'amount': 5000}),
+        ('POST', f'/api/payments/{ids["payment"]}/confirm', {'action': 'confirm'}),
+        ('GET', f'/api/owner/{ids["owner"]}/payments', None),
+        ('GET', f'/api/owner/{ids["owner"]}/payments?limit=10', None),
+        ('GET', f'/api/owner/{ids["owner"]}/payments?fields=amount,status&limit=10', None),
+        ('GET', f'/api/users/{user}/payments', None),
+        ('GET', f'/api/users/{user}/payment-status/{paid}', None),
+    ]
+
+
+def seed(client):
+    """An owner with a free and a paid restroom, a user, a notification and a payment"""
+    client.post('/api/owner/register', json={
+        'owner': {'name': 'Budget', 'email': OWNER, 'phone': '0900000000'},
+        'restrooms': [{'name': 'Budget 1', 'address': 'Dĩ An'}, {'name': 'Paid', 'address': 'Dĩ An'}],
+    })
+    restrooms = client.get(f'/api/owner/{OWNER}/restrooms').get_json()
+    owner_id = client.post('/api/auth/login', json={'username': OWNER, 'password': 'x'}).get_json()['id']
+    client.put(f'/api/owner/restrooms/{restrooms[1]["id"]}', json={'is_free': False})
+    user_id = client.post('/api/auth/register', json={'username': 'budget-seed', 'password': 'x'}).get_json()['id']
+    payment = client.post('/api/payments', json={
+        'user_id': user_id, 'restroom_id': restrooms[1]['id'], 'method': 'transfer', 'amount': 5000,
+    }).get_json()
+    image_id = client.post('/api/images', data={'file': (io.BytesIO(IMAGE), 'seed.png')}).get_json()['images'][0]['id']
+    notification_queue.drain()
+    with app.app_context():
+        notification_id = db.session.query(db.func.max(Notification.id)).scalar()
+    return {
+        'owner': owner_id, 'user': user_id, 'restroom': restrooms[0]['id'], 'paid_restroom': restrooms[1]['id'],
+        'payment': payment['payment_id'], 'notification': notification_id, 'image': image_id,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.parse_args()
+
+    client = app.test_client()
+    urls = app.url_map.bind('localhost')
+    failed = False
+    exercised = set()
+    for mode, write_behind in (('write-behind', True), ('synchronous', False)):
+        notification_queue.enabled = write_behind
+        reset_db()
+        ids = seed(client)
+        failed |= run_scenario(client, urls, ids, mode, exercised)
+
+    endpoints = {rule.endpoint for rule in app.url_map.iter_rules()} - {'static'} - STREAMED
+    for endpoint in sorted(endpoints - exercised):
+        failed = True
+        print(json.dumps({'endpoint': endpoint, 'ok': False, 'error': 'not exercised'}))
+    raise SystemExit(1 if failed else 0)
+
+
+def run_scenario(client, urls, ids, mode, exercised):
+    """Call every route once; returns True if one failed"""
+    failed = False
+    for method, url, body, *check in scenario(ids):
+        response_cache.invalidate(RESTROOMS_CACHE, CATALOG_CACHE)
+        if isinstance(body, bytes):
+            kwargs = {'data': {'file': (io.BytesIO(body), 'image.png')}}
+        else:
+            kwargs = {'data': body} if isinstance(body, str) else {'json': body}
+        response = client.open(url, method=method, **kwargs)
+        response.close()
+        notification_queue.drain()
+        endpoint, _ = urls.match(url.split('?')[0], method=method)
+        exercised.add(endpoint)
+        queries = int(response.headers.get('X-Query-Count', 0))
+        budget = query_counter.budget(endpoint)
+        ok = response.status_code < 400 and endpoint in QUERY_BUDGETS and (budget is None or queries <= budget)
+        ok = ok and all(predicate(response.get_json()) for predicate in check)
+        failed |= not ok
+        print(json.dumps({'endpoint': endpoint, 'method': method, 'notifications': mode,
+                          'status': response.status_code, 'queries': queries, 'budget': budget, 'ok': ok},
+                         ensure_ascii=False))
+    return failed
+
+
+if __name__ == '__main__':
+    main()
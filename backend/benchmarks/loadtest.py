@@ -0,0 +1,448 @@
+"""Load test the API with a realistic request mix over a city-scale dataset.
+
+Seeds a synthetic Dĩ An dataset into a temporary SQLite file, then has client
+threads replay a weighted mix of map loads, recommendations, live-status
+refreshes, detail views, chat polling and sending, start/stop usage, payments
+and reviews. Prints one JSON line per route with throughput and p50/p95/p99
+latency, then a total line. The seeded file is kept and reused by runs with the same
+dataset options, so only the first run pays for seeding:
+
+    python benchmarks/loadtest.py --scale 0.01 --clients 8 --duration 20
+    python benchmarks/loadtest.py --output after.json --compare before.json
+
+--url replays against a running server instead of an in-process test client.
+Start that server on the seeded file printed by the run (DATABASE_URL).
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Centre of the bundled seed data (Dĩ An, Bình Dương)
+CENTER_LAT, CENTER_LNG = 10.8900, 106.7700
+# About 7 km either way
+SPREAD_DEG = 0.06
+NOW = datetime(2025, 1, 1)
+HISTORY_DAYS = 365
+CHUNK = 100000
+
+DATASET = {
+    # option: rows at --scale 1
+    'owners': 2000,
+    'users': 50000,
+    'restrooms': 20000,
+    'reviews': 2000000,
+    'messages': 1000000,
+    'usage': 1000000,
+    'payments': 200000,
+}
+
+# Route mix: (scenario, weight)
+MIX = (
+    ('map_load', 30),
+    ('recommend', 5),
+    ('status_refresh', 15),
+    ('restroom_details', 20),
+    ('chat_poll', 15),
+    ('chat_send', 3),
+    ('start_stop_usage', 8),
+    ('payment', 4),
+    ('review', 3),
+    ('history', 2),
+)
+
+
+def timestamp(rng):
+    return (NOW - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+class Dataset:
+    """Id ranges of the synthetic rows, and a skewed picker (popular places see most traffic)"""
+
+    def __init__(self, first_ids, counts):
+        self.first = first_ids
+        self.counts = counts
+
+    def owner(self, rng):
+        return self.first['owner'] + rng.randrange(self.counts['owners'])
+
+    def user(self, rng):
+        return self.first['user'] + rng.randrange(self.counts['users'])
+
+    def restroom(self, rng):
+        count = self.counts['restrooms']
+        if rng.random() < 0.5:
+            # Half of all activity goes to the busiest 5%
+            return self.first['restroom'] + rng.randrange(max(1, count // 20))
+        return self.first['restroom'] + rng.randrange(count)
+
+    def as_dict(self):
+        return {'first': self.first, 'counts': self.counts}
+
+
+def seed(db_path, counts, seed_value):
+    """Create the schema through the app, then bulk-insert the synthetic rows"""
+    from app import init_db
+    from spatial import encode_geohash
+
+    init_db()
+    rng = random.Random(seed_value)
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA synchronous = OFF')
+
+    def first_id(table):
+        return (conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0] or 0) + 1
+
+    def insert(sql, rows):
+        for start in range(0, len(rows), CHUNK):
+            conn.executemany(sql, rows[start:start + CHUNK])
+
+    def insert_generated(sql, total, make_row):
+        for start in range(0, total, CHUNK):
+            conn.executemany(sql, [make_row(i) for i in range(start, min(start + CHUNK, total))])
+
+    first = {table: first_id(table) for table in ('owner', 'user', 'restroom')}
+    dataset = Dataset(first, counts)
+
+    insert('INSERT INTO owner (name, email, phone, unread_notifications, created_at) VALUES (?, ?, ?, 0, ?)', [
+        (f'Chủ {i}', f'owner{i}@loadtest.vn', f'09{i:08d}', timestamp(rng)) for i in range(counts['owners'])
+    ])
+    insert('INSERT INTO user (username, password, is_random_user, is_using, created_at) VALUES (?, ?, ?, 0, ?)', [
+        (f'loadtest-user-{i}', 'secret', i % 3 == 0, timestamp(rng)) for i in range(counts['users'])
+    ])
+
+    restrooms = []
+    for i in range(counts['restrooms']):
+        lat = CENTER_LAT + max(-SPREAD_DEG, min(SPREAD_DEG, rng.gauss(0, SPREAD_DEG / 2)))
+        lng = CENTER_LNG + max(-SPREAD_DEG, min(SPREAD_DEG, rng.gauss(0, SPREAD_DEG / 2)))
+        is_free = rng.random() < 0.7
+        restrooms.append((
+            f'Nhà vệ sinh {i}', f'{i} Đường số {i % 50}, Dĩ An', lat, lng, encode_geohash(lat, lng), is_free,
+            0 if is_free else rng.choice((2000, 3000, 5000)), f'owner{i % counts["owners"]}@loadtest.vn',
+            dataset.owner(rng), rng.randrange(4), rng.randrange(4), rng.randrange(4), rng.random() < 0.3,
+            timestamp(rng),
+        ))
+    insert(
+        'INSERT INTO restroom (name, address, latitude, longitude, geohash, is_free, price, admin_contact, owner_id, '
+        'male_standing, male_sitting, female_sitting, disabled_access, created_at, current_users, rating, '
+        'total_reviews, rating_sum, catalog_version, status_version) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, 0, 0, 0, 0, 0)', restrooms)
+    # Payments need the restroom's owner
+    owners = {first['restroom'] + i: row[8] for i, row in enumerate(restrooms)}
+    del restrooms
+
+    insert_generated(
+        'INSERT INTO review (restroom_id, user_id, rating, comment, image_path, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+        counts['reviews'],
+        lambda i: (dataset.restroom(rng), dataset.user(rng), rng.choice((3, 4, 4, 5, 5, 5)), 'Sạch sẽ', '',
+                   timestamp(rng)))
+    insert_generated(
+        'INSERT INTO chat_message (restroom_id, user_id, message, message_type, is_from_admin, created_at) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        counts['messages'],
+        lambda i: (dataset.restroom(rng), dataset.user(rng), 'Còn giấy không ạ?', 'normal', i % 4 == 0,
+                   timestamp(rng)))
+
+    def usage_row(i):
+        start = NOW - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))
+        minutes = rng.randrange(1, 15)
+        end = start + timedelta(minutes=minutes)
+        return (dataset.user(rng), dataset.restroom(rng), start.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                end.strftime('%Y-%m-%d %H:%M:%S.%f'), minutes, start.strftime('%Y-%m-%d %H:%M:%S.%f'))
+    insert_generated(
+        'INSERT INTO usage_history (user_id, restroom_id, start_time, end_time, duration_minutes, created_at) '
+        'VALUES (?, ?, ?, ?, ?, ?)', counts['usage'], usage_row)
+
+    def payment_row(i):
+        restroom_id = dataset.restroom(rng)
+        created_at = timestamp(rng)
+        return (dataset.user(rng), restroom_id, owners[restroom_id], rng.choice(('cash', 'transfer')), 3000,
+                'confirmed', created_at, created_at)
+    insert_generated(
+        'INSERT INTO payment (user_id, restroom_id, owner_id, method, amount, status, created_at, confirmed_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', counts['payments'], payment_row)
+
+    # Same aggregates as rebuild_rating_aggregates()
+    conn.execute(
+        'UPDATE restroom SET rating_sum = s.rating_sum, total_reviews = s.total_reviews, '
+        'rating = CAST(s.rating_sum AS FLOAT) / s.total_reviews '
+        'FROM (SELECT restroom_id, SUM(rating) AS rating_sum, COUNT(*) AS total_reviews '
+        '      FROM review GROUP BY restroom_id) AS s WHERE s.restroom_id = restroom.id')
+    conn.execute('CREATE TABLE loadtest_dataset (value TEXT NOT NULL)')
+    conn.execute('INSERT INTO loadtest_dataset VALUES (?)', (json.dumps(dataset.as_dict()),))
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+    return dataset
+
+
+def load_dataset(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        value = json.loads(conn.execute('SELECT value FROM loadtest_dataset').fetchone()[0])
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+    return Dataset(value['first'], value['counts'])
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        data = response.get_json(silent=True)
+        response.close()
+        return response.status_code, data
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status, json.loads(response.read() or b'null')
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+
+class Scenarios:
+    """One method per scenario in MIX; each returns [(route, status, seconds)]"""
+
+    def __init__(self, client, dataset, rng):
+        self.client = client
+        self.dataset = dataset
+        self.rng = rng
+
+    def _call(self, route, method, path, body=None):
+        start = time.perf_counter()
+        status, data = self.client.request(method, path, body)
+        return (route, status, time.perf_counter() - start), data
+
+    def _point(self):
+        return (CENTER_LAT + self.rng.uniform(-SPREAD_DEG, SPREAD_DEG),
+                CENTER_LNG + self.rng.uniform(-SPREAD_DEG, SPREAD_DEG))
+
+    def map_load(self):
+        lat, lng = self._point()
+        result, _ = self._call('get_restrooms', 'GET', f'/api/restrooms?lat={lat:.5f}&lng={lng:.5f}&radius_m=1500')
+        return [result]
+
+    def recommend(self):
+        lat, lng = self._point()
+        result, _ = self._call('recommend_restrooms', 'GET',
+                               f'/api/restrooms/recommend?lat={lat:.5f}&lng={lng:.5f}&is_free=1')
+        return [result]
+
+    def status_refresh(self):
+        lat, lng = self._point()
+        result, _ = self._call('get_restroom_status', 'GET',
+                               f'/api/restrooms/status?lat={lat:.5f}&lng={lng:.5f}&radius_m=1500')
+        return [result]
+
+    def restroom_details(self):
+        result, _ = self._call('get_restroom_details', 'GET', f'/api/restrooms/{self.dataset.restroom(self.rng)}')
+        return [result]
+
+    def chat_poll(self):
+        restroom_id = self.dataset.restroom(self.rng)
+        first, data = self._call('get_messages', 'GET', f'/api/chat/messages/{restroom_id}?limit=20')
+        newest = data['items'][0]['id'] if data and data.get('items') else 0
+        second, _ = self._call('get_messages', 'GET', f'/api/chat/messages/{restroom_id}?since_id={newest}')
+        return [first, second]
+
+    def chat_send(self):
+        result, _ = self._call('send_message', 'POST', '/api/chat/messages', {
+            'restroom_id': self.dataset.restroom(self.rng), 'user_id': self.dataset.user(self.rng),
+            'message': 'Còn giấy không ạ?',
+        })
+        return [result]
+
+    def start_stop_usage(self):
+        user_id, restroom_id = self.dataset.user(self.rng), self.dataset.restroom(self.rng)
+        start, _ = self._call('start_using_restroom', 'POST', f'/api/users/{user_id}/start-using/{restroom_id}')
+        stop, _ = self._call('stop_using_restroom', 'POST', f'/api/users/{user_id}/stop-using')
+        # Paid restrooms answer 402 without a payment; that is a valid outcome
+        if start[1] == 402:
+            start = (start[0], 200, start[2])
+        return [start, stop]
+
+    def payment(self):
+        user_id, restroom_id = self.dataset.user(self.rng), self.dataset.restroom(self.rng)
+        pay, _ = self._call('create_payment', 'POST', '/api/payments', {
+            'user_id': user_id, 'restroom_id': restroom_id, 'method': 'cash', 'amount': 3000,
+        })
+        status, _ = self._call('check_payment_status', 'GET', f'/api/users/{user_id}/payment-status/{restroom_id}')
+        return [pay, status]
+
+    def review(self):
+        result, _ = self._call('create_review', 'POST', '/api/reviews', {
+            'restroom_id': self.dataset.restroom(self.rng), 'user_id': self.dataset.user(self.rng),
+            'rating': self.rng.randint(1, 5), 'comment': 'Ổn',
+        })
+        return [result]
+
+    def history(self):
+        result, _ = self._call('get_user_history', 'GET', f'/api/users/{self.dataset.user(self.rng)}/history?limit=20')
+        return [result]
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def replay(make_client, dataset, clients, duration, warmup, seed_value):
+    names = [name for name, _ in MIX]
+    weights = [weight for _, weight in MIX]
+    results = []
+    lock = threading.Lock()
+    started = threading.Barrier(clients + 1)
+
+    def worker(index):
+        rng = random.Random(seed_value * 1000 + index)
+        scenarios = Scenarios(make_client(), dataset, rng)
+        local = []
+        started.wait()
+        warm_until = time.perf_counter() + warmup
+        stop_at = warm_until + duration
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                break
+            samples = getattr(scenarios, rng.choices(names, weights)[0])()
+            if now >= warm_until:
+                local.extend(samples)
+        with lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(results, duration):
+    routes = {}
+    for route, status, seconds in results:
+        routes.setdefault(route, []).append((status, seconds))
+    summary = {}
+    for route, samples in sorted(routes.items()):
+        timings = sorted(seconds * 1000 for _, seconds in samples)
+        summary[route] = {
+            'requests': len(samples),
+            'errors': sum(1 for status, _ in samples if status >= 400),
+            'requests_per_second': round(len(samples) / duration, 1),
+            'p50_ms': round(percentile(timings, 0.50), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'p99_ms': round(percentile(timings, 0.99), 2),
+            'max_ms': round(timings[-1], 2),
+        }
+    timings = sorted(seconds * 1000 for _, _, seconds in results)
+    total = {
+        'requests': len(results),
+        'errors': sum(1 for _, status, _ in results if status >= 400),
+        'requests_per_second': round(len(results) / duration, 1),
+        'p50_ms': round(percentile(timings, 0.50), 2) if timings else None,
+        'p95_ms': round(percentile(timings, 0.95), 2) if timings else None,
+        'p99_ms': round(percentile(timings, 0.99), 2) if timings else None,
+    }
+    return summary, total
+
+
+def compare(summary, baseline_path, tolerance):
+    """Print p95 changes against a saved run; returns the routes that regressed"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['routes']
+    regressed = []
+    for route, stats in summary.items():
+        before = baseline.get(route)
+        if not before or not before['p95_ms']:
+            continue
+        change = stats['p95_ms'] / before['p95_ms'] - 1
+        print(json.dumps({'compare': route, 'p95_ms_before': before['p95_ms'], 'p95_ms_after': stats['p95_ms'],
+                          'change': round(change, 3)}, ensure_ascii=False))
+        if change > tolerance:
+            regressed.append(route)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplies every dataset size (1 = %s)' % ', '.join(f'{v} {k}' for k, v in DATASET.items()))
+    for name in DATASET:
+        parser.add_argument(f'--{name}', type=int, help=f'override the number of {name}')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the dataset and the request mix')
+    parser.add_argument('--db', help='SQLite file to seed or reuse (default: derived from the dataset options)')
+    parser.add_argument('--reseed', action='store_true', help='seed again even if the file exists')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help='seconds measured per run')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds replayed before measuring')
+    parser.add_argument('--url', help='replay against a running server instead of in process')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--compare', help='results JSON of an earlier run; exit 1 if a route regressed')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 increase for --compare')
+    args = parser.parse_args()
+
+    counts = {name: getattr(args, name) or max(1, int(size * args.scale)) for name, size in DATASET.items()}
+    key = hashlib.sha1(json.dumps([counts, args.seed]).encode()).hexdigest()[:12]
+    db_path = os.path.abspath(args.db or os.path.join(tempfile.gettempdir(), f'restroom-loadtest-{key}.db'))
+    if args.reseed:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+
+    dataset = load_dataset(db_path) if os.path.exists(db_path) else None
+    if dataset is None:
+        started = time.perf_counter()
+        dataset = seed(db_path, counts, args.seed)
+        print(json.dumps({'seeded': db_path, 'seconds': round(time.perf_counter() - started, 1), **counts}),
+              flush=True)
+    else:
+        print(json.dumps({'reused': db_path, **dataset.counts}), flush=True)
+
+    if args.url:
+        make_client = lambda: HttpClient(args.url)  # noqa: E731
+    else:
+        from app import app
+        make_client = lambda: InProcessClient(app)  # noqa: E731
+
+    results = replay(make_client, dataset, args.clients, args.duration, args.warmup, args.seed)
+    summary, total = summarize(results, args.duration)
+    for route, stats in summary.items():
+        print(json.dumps({'route': route, **stats}), flush=True)
+    print(json.dumps({'route': 'total', 'clients': args.clients, **total}), flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'dataset': dataset.counts, 'clients': args.clients, 'duration': args.duration,
+                       'target': args.url or 'in-process', 'routes': summary, 'total': total}, f, indent=2)
+    if args.compare and compare(summary, args.compare, args.tolerance):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
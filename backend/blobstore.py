@@ -0,0 +1,144 @@
+"""Content-addressed storage for uploaded images.
+
+A blob is stored once under the SHA-256 of its bytes, which is also its id:
+the same photo uploaded twice, or attached to two restrooms, is one file.
+Files live under ``<root>/<id[:2]>/<id>`` and the thumbnails generated at
+upload time sit next to them as ``<id>.<size>.jpg``. A blob never changes once
+written, so it can be served with an immutable cache header and its id as
+the ETag.
+
+Thumbnails need Pillow; without it only the original is kept and a request
+for a thumbnail size gets the original.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+# Longest edge in pixels of each pre-generated size
+THUMBNAIL_SIZES = {'thumb': 160, 'medium': 640}
+THUMBNAIL_QUALITY = 80
+
+BLOB_ID = re.compile(r'[0-9a-f]{64}')
+DATA_URI = re.compile(r'data:image/[\w.+-]+;base64,', re.IGNORECASE)
+
+
+class UnsupportedImage(ValueError):
+    pass
+
+
+def is_blob_id(value):
+    return isinstance(value, str) and BLOB_ID.fullmatch(value) is not None
+
+
+def sniff_content_type(header):
+    """Content type of an image from its first bytes, or None if it is not a supported image"""
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def decode_data_uri(value):
+    """Bytes of a base64 ``data:image/...`` URI, or None for anything else"""
+    if not isinstance(value, str):
+        return None
+    match = DATA_URI.match(value)
+    if match is None:
+        return None
+    try:
+        return base64.b64decode(value[match.end():], validate=False)
+    except (binascii.Error, ValueError):
+        return None
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, blob_id, size=None):
+        name = blob_id if size is None else f'{blob_id}.{size}.jpg'
+        return os.path.join(self.root, blob_id[:2], name)
+
+    def put(self, data):
+        """Store image bytes; returns (blob_id, created)"""
+        if sniff_content_type(data[:16]) is None:
+            raise UnsupportedImage('Unsupported image type')
+        blob_id = hashlib.sha256(data).hexdigest()
+        path = self.path(blob_id)
+        if os.path.exists(path):
+            return blob_id, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for size, thumbnail in self._thumbnails(data):
+            self._write(self.path(blob_id, size), thumbnail)
+        # The original goes last: once it exists the blob counts as complete
+        self._write(path, data)
+        return blob_id, True
+
+    @staticmethod
+    def _write(path, data):
+        # Write to a temporary file and rename, so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @staticmethod
+    def _thumbnails(data):
+        if Image is None:
+            return
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.load()
+                for size, edge in THUMBNAIL_SIZES.items():
+                    thumbnail = image.convert('RGB')
+                    thumbnail.thumbnail((edge, edge))
+                    out = io.BytesIO()
+                    thumbnail.save(out, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+                    yield size, out.getvalue()
+        except (OSError, ValueError):
+            # Undecodable or truncated image: keep the original only
+            return
+
+    def exists(self, blob_id):
+        return is_blob_id(blob_id) and os.path.exists(self.path(blob_id))
+
+    def sizes(self, blob_id):
+        """Thumbnail sizes stored for a blob"""
+        return [size for size in THUMBNAIL_SIZES if os.path.exists(self.path(blob_id, size))]
+
+    def locate(self, blob_id, size=None):
+        """(path, content type) of a blob or one of its thumbnails, or None if it is not stored.
+
+        A thumbnail size that was not generated falls back to the original.
+        """
+        if not is_blob_id(blob_id):
+            return None
+        if size is not None:
+            path = self.path(blob_id, size)
+            if os.path.exists(path):
+                return path, 'image/jpeg'
+        path = self.path(blob_id)
+        try:
+            with open(path, 'rb') as f:
+                content_type = sniff_content_type(f.read(16))
+        except FileNotFoundError:
+            return None
+        return path, content_type or 'application/octet-stream'
@@ -0,0 +1,198 @@
+"""Streaming CSV/NDJSON import and export helpers.
+
+Import reads records one at a time from a byte stream, validates each one
+against a list of Field specs and hands them out in chunks, so a caller can
+insert every chunk with one executemany in its own transaction. Memory
+depends on the chunk size, not on the file size. Rows that fail validation
+are skipped and reported by line number.
+
+Export turns an iterable of dicts into CSV or NDJSON chunks for a streamed
+response.
+"""
+import csv
+import io
+import itertools
+import json
+
+from serializers import dumps, loads
+
+FORMATS = ('csv', 'ndjson')
+CHUNK_SIZE = 5000
+# Errors beyond this many are counted but not listed in the report
+MAX_REPORTED_ERRORS = 1000
+
+
+# Parsers: turn a raw CSV string or JSON value into a column value or raise ValueError
+def text(max_length):
+    def parse(value):
+        value = str(value).strip()
+        if len(value) > max_length:
+            raise ValueError(f'longer than {max_length} characters')
+        return value
+    return parse
+
+
+def number(low, high):
+    def parse(value):
+        value = float(value)
+        if not low <= value <= high:
+            raise ValueError(f'must be between {low} and {high}')
+        return value
+    return parse
+
+
+def count(value):
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError('must be a whole number')
+    value = int(value)
+    if value < 0:
+        raise ValueError('must not be negative')
+    return value
+
+
+def boolean(value):
+    if isinstance(value, bool):
+        return value
+    normalized = str(value).strip().lower()
+    if normalized in ('1', 'true', 'yes', 'y'):
+        return True
+    if normalized in ('0', 'false', 'no', 'n'):
+        return False
+    raise ValueError('must be true or false')
+
+
+def choice(options):
+    def parse(value):
+        if value not in options:
+            raise ValueError(f"must be one of {', '.join(options)}")
+        return value
+    return parse
+
+
+def choice_list(options):
+    """Comma-separated names, each one of ``options``"""
+    def parse(value):
+        check = choice(options)
+        return [check(name.strip()) for name in value.split(',') if name.strip()]
+    return parse
+
+
+def string_list(value):
+    """A JSON array of strings, given as a list (NDJSON) or JSON text (CSV)"""
+    if isinstance(value, str):
+        value = loads(value)
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError('must be a JSON array of strings')
+    return value
+
+
+class Field:
+    def __init__(self, name, parse, required=False, default=None):
+        self.name = name
+        self.parse = parse
+        self.required = required
+        self.default = default
+
+
+def validate(record, fields):
+    """Return the parsed values of ``record``; raises ValueError naming the bad field"""
+    if not isinstance(record, dict):
+        raise ValueError('record must be an object')
+    values = {}
+    for field in fields:
+        raw = record.get(field.name)
+        if raw is None or raw == '':
+            if field.required:
+                raise ValueError(f'{field.name}: required')
+            values[field.name] = field.default
+            continue
+        try:
+            values[field.name] = field.parse(raw)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'{field.name}: {e}')
+    return values
+
+
+def read_records(stream, fmt):
+    """Yield ``(line_number, record)`` from a binary stream.
+
+    A line that is not valid JSON is yielded as ``(line_number, ValueError)``
+    so the caller can report it and carry on.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'format must be one of {", ".join(FORMATS)}')
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f'invalid JSON: {e}')
+
+
+def chunks(iterable, size=CHUNK_SIZE):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        return {'imported': self.imported, 'failed': self.failed, 'errors': self.errors}
+
+
+def validated_chunks(stream, fmt, fields, report, size=CHUNK_SIZE):
+    """Read, validate and group records; invalid ones go to ``report``"""
+    def valid():
+        for line, record in read_records(stream, fmt):
+            if isinstance(record, Exception):
+                report.error(line, str(record))
+                continue
+            try:
+                yield validate(record, fields)
+            except ValueError as e:
+                report.error(line, str(e))
+    return chunks(valid(), size)
+
+
+def export_lines(items, fmt, columns):
+    """Encode dicts as CSV (with a header) or NDJSON, one chunk of text per batch"""
+    if fmt not in FORMATS:
+        raise ValueError(f'format must be one of {", ".join(FORMATS)}')
+    if fmt == 'ndjson':
+        for batch in chunks(items, 500):
+            yield b''.join(dumps(item) + b'\n' for item in batch)
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in chunks(items, 500):
+        for item in batch:
+            writer.writerow([
+                dumps(item[column]).decode() if isinstance(item[column], list) else item[column]
+                for column in columns
+            ])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
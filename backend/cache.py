@@ -0,0 +1,216 @@
+"""Response cache with strong ETags for read-heavy JSON endpoints.
+
+Cached bodies are keyed by route, URL (host included, as bodies may hold
+absolute URLs), query string and the negotiated format (JSON or MessagePack,
+see serializers.py). Each namespace has a generation counter that is part of
+every key; write paths bump it, which invalidates every cached response of
+that namespace at once. Clients that send ``If-None-Match`` with the current
+ETag get an empty 304. Views whose queries rarely repeat (anything keyed by
+the caller's position) pass ``unless`` to skip the cache rather than fill it
+with entries that are never hit and evict the ones that are.
+
+The store is pluggable through ``RESPONSE_CACHE_URL``:
+
+* ``memory://`` (default) - per-process LRU with TTL.
+* ``sqlite:///path/to/cache.db`` - a cache file shared by the worker
+  processes on one host.
+* ``memcached://host:port`` - a local memcached daemon (needs ``pymemcache``).
+"""
+import functools
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, request
+
+from serializers import response_mimetype
+
+
+class MemoryStore:
+    """Thread-safe LRU of byte values with a per-entry TTL"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl if ttl else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._entries.get(key, (b'0', None))[0]) + 1
+            self._entries[key] = (str(value).encode(), None)
+            self._entries.move_to_end(key)
+            return value
+
+
+class SQLiteStore:
+    """Cache shared by several processes through one SQLite file"""
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                     'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)')
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)',
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def set(self, key, value, ttl=None):
+        conn = self._connection()
+        conn.execute('INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                     (key, value, time.time() + ttl if ttl else None))
+        if hash(key) % 100 == 0:
+            conn.execute('DELETE FROM cache WHERE expires_at < ?', (time.time(),))
+
+    def incr(self, key):
+        conn = self._connection()
+        conn.execute("INSERT INTO cache (key, value) VALUES (?, '0') ON CONFLICT(key) DO NOTHING", (key,))
+        conn.execute('UPDATE cache SET value = CAST(CAST(value AS INTEGER) + 1 AS TEXT) WHERE key = ?', (key,))
+        return int(self.get(key))
+
+
+class MemcachedStore:
+    def __init__(self, host, port):
+        from pymemcache.client.base import Client
+        self.client = Client((host, port), connect_timeout=1, timeout=1)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, expire=int(ttl or 0))
+
+    def incr(self, key):
+        value = self.client.incr(key, 1)
+        if value is None:
+            self.client.add(key, b'0')
+            value = self.client.incr(key, 1)
+        return value
+
+
+def create_store(url=None):
+    url = url or os.environ.get('RESPONSE_CACHE_URL', 'memory://')
+    max_entries = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1024))
+    if url.startswith('memory://'):
+        return MemoryStore(max_entries)
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):], max_entries)
+    if url.startswith('memcached://'):
+        host, _, port = url[len('memcached://'):].partition(':')
+        return MemcachedStore(host or 'localhost', int(port or 11211))
+    raise ValueError(f'Unsupported RESPONSE_CACHE_URL: {url}')
+
+
+def compute_etag(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+def conditional_response(body, etag, mimetype='application/json', cache_control='no-cache'):
+    """Return 304 if the client already holds ``etag``, else the full body"""
+    # Weak comparison, as If-None-Match requires: compressed responses carry the ETag as weak
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    # By default clients may keep the body but must revalidate before using it
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+class ResponseCache:
+    def __init__(self, store, ttl=60):
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _generation(self, namespace):
+        value = self.store.get(f'generation:{namespace}')
+        return int(value) if value else 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.store.incr(f'generation:{namespace}')
+
+    def cached(self, namespace, cache_control='no-cache', unless=None):
+        """Cache a view's 200 JSON responses and answer with ETags
+
+        ``unless`` is called per request; when it returns true the view runs
+        uncached.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if unless is not None and unless():
+                    return view(*args, **kwargs)
+                query = '&'.join(sorted(request.query_string.decode().split('&')))
+                mimetype = response_mimetype()
+                key = f'response:{namespace}:{self._generation(namespace)}:{mimetype}:{request.base_url}?{query}'
+                entry = self.store.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    etag, _, body = entry.partition(b'\n')
+                    return conditional_response(body, etag.decode(), mimetype, cache_control)
+                self.misses += 1
+
+                response = view(*args, **kwargs)
+                if isinstance(response, Response) and response.status_code == 200:
+                    body = response.get_data()
+                    etag = compute_etag(body)
+                    self.store.set(key, etag.encode() + b'\n' + body, self.ttl)
+                    return conditional_response(body, etag, response.mimetype, cache_control)
+                return response
+            return wrapper
+        return decorator
@@ -0,0 +1,79 @@
+"""Content-Encoding for large API responses.
+
+Bodies of at least ``min_bytes`` are compressed when the client accepts it:
+brotli when the ``brotli`` package is installed and the client accepts ``br``,
+gzip otherwise. Smaller bodies are sent as they are, since the compressed
+size would barely differ and the CPU time would not pay off. Streamed
+responses (timeline, export, events) and files are left alone.
+
+Responses served from the response cache carry a strong ETag and would be
+compressed again on every hit, so compressed bodies are kept in a small LRU
+keyed by ETag and encoding. Once compressed, the ETag is sent as weak (as
+nginx does): the bytes on the wire are no longer the ones it was computed
+from, but the content is the same.
+"""
+import gzip
+
+from cache import MemoryStore
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_MIMETYPES = frozenset((
+    'application/json', 'application/msgpack', 'application/x-msgpack', 'application/x-ndjson', 'text/csv',
+))
+
+
+def choose_encoding(accept_encodings):
+    """Best encoding the client accepts from a parsed Accept-Encoding header, or None"""
+    return accept_encodings.best_match(('br', 'gzip') if brotli is not None else ('gzip',))
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+
+class Compressor:
+    def __init__(self, min_bytes=1024, max_cached=256):
+        self.min_bytes = min_bytes
+        self._compressed = MemoryStore(max_cached)
+
+    def clear(self):
+        """Forget the compressed bodies kept for cached responses"""
+        self._compressed = MemoryStore(self._compressed.max_entries)
+
+    def __call__(self, response, accept_encodings):
+        """Compress a finished response in place when it is worth it; returns the response"""
+        if response.status_code == 304:
+            # Repeat the Vary header the full response would have carried
+            response.vary.add('Accept-Encoding')
+            return response
+        if response.status_code != 200 or response.is_streamed or response.direct_passthrough \
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.content_length is not None and response.content_length < self.min_bytes:
+            return response
+        encoding = choose_encoding(accept_encodings)
+        if encoding is None:
+            return response
+
+        etag, weak = response.get_etag()
+        key = f'{etag}:{encoding}' if etag and not weak else None
+        body = self._compressed.get(key) if key else None
+        if body is None:
+            body = compress(response.get_data(), encoding)
+            if key:
+                self._compressed.set(key, body)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,49 @@
+"""Cached payment entitlements for paid restrooms.
+
+An entitlement is the payment state of one (user, restroom) pair: the latest
+confirmed payment, if any, and the latest pending one. Payment writes refresh
+the entry after they commit, and entries expire after ``ttl`` seconds. With
+a per-process store every other worker would keep its old entry until then,
+so payment writes also publish on the event bus and each worker drops its
+copy (see ``app.refresh_entitlement``).
+
+Only entries that grant access are served from the cache. A user without a
+confirmed payment is about to pay or is waiting for the owner, so those
+states are always re-read from the database; a stale entry can never
+lock out a user who has just paid.
+
+Entries live in the same pluggable stores as the response cache (see
+``cache.create_store``).
+"""
+from serializers import dumps, loads
+
+
+class EntitlementCache:
+    def __init__(self, store, ttl=300):
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(user_id, restroom_id):
+        return f'entitlement:{user_id}:{restroom_id}'
+
+    def get(self, user_id, restroom_id):
+        """Return the cached state if it grants access, else None"""
+        value = self.store.get(self._key(user_id, restroom_id))
+        state = loads(value) if value else None
+        if state is not None and state['confirmed_payment_id'] is not None:
+            self.hits += 1
+            return state
+        self.misses += 1
+        return None
+
+    def set(self, user_id, restroom_id, state):
+        self.store.set(self._key(user_id, restroom_id), dumps(state), self.ttl)
+
+    def invalidate(self, user_id, restroom_id):
+        self.store.delete(self._key(user_id, restroom_id))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,260 @@
+"""Publish/subscribe bus that pushes committed writes to connected clients.
+
+Routes publish events after their transaction commits; the SSE stream and the
+chat long-poll subscribe to channels, and in-process caches listen for the
+writes that make their entries stale. The transport is pluggable:
+
+* ``memory://`` (default) fans events out inside one process.
+* ``sqlite:///path/to/events.db`` appends events to a shared SQLite log that
+  every worker process tails, standing in for a real broker (Redis, NATS)
+  when the API runs under several gunicorn workers on one host.
+"""
+import asyncio
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+SUBSCRIBER_QUEUE_SIZE = 1000
+# Internal: payment writes that change a cached entitlement, never streamed to clients
+ENTITLEMENTS_CHANNEL = 'payments:entitlements'
+
+
+def _encode_default(value):
+    # Event payloads may carry datetimes straight from the serializers
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def chat_channel(restroom_id):
+    return f'restroom:{restroom_id}:chat'
+
+
+def owner_channel(owner_id):
+    return f'owner:{owner_id}:notifications'
+
+
+def user_channel(user_id):
+    return f'user:{user_id}:notifications'
+
+
+class Subscription:
+    """Queue of events for a set of channels; use as a context manager"""
+
+    def __init__(self, bus, channels):
+        self.bus = bus
+        self.channels = tuple(channels)
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def get(self, timeout=None):
+        """Return the next event, or None once ``timeout`` seconds pass"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A stalled client must not block publishers; it resyncs via REST
+            pass
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncSubscription(Subscription):
+    """Subscription read from an asyncio event loop.
+
+    Publishers run on ordinary threads, so events are handed to the loop with
+    ``call_soon_threadsafe``; a waiting coroutine holds no thread.
+    """
+
+    def __init__(self, bus, channels):
+        super().__init__(bus, channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    async def get(self, timeout=None):
+        """Return the next event, or None once ``timeout`` seconds pass"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def deliver(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The loop has shut down; nobody is waiting any more
+            pass
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+
+class Listener(Subscription):
+    """Calls ``callback(event)`` on the delivering thread instead of queueing.
+
+    The callback runs on the publisher's or the tailer's thread, so it must be
+    quick; an exception is printed and the event dropped.
+    """
+
+    def __init__(self, bus, channels, callback):
+        self.bus = bus
+        self.channels = tuple(channels)
+        self.callback = callback
+
+    def deliver(self, event):
+        try:
+            self.callback(event)
+        except Exception as e:
+            print(f"Listener on {event['channel']} failed: {e}")
+
+
+class MemoryBackend:
+    """Delivers events straight to subscribers in the same process"""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._deliver = None
+
+    def attach(self, deliver):
+        self._deliver = deliver
+
+    def publish(self, channel, event_type, data):
+        self._deliver({'id': next(self._ids), 'channel': channel, 'type': event_type, 'data': data})
+
+    def close(self):
+        pass
+
+
+class SQLiteBrokerBackend:
+    """Shares events between processes through an append-only SQLite log.
+
+    Each process runs one tailer thread that polls for rows newer than the
+    last one it has seen and hands them to local subscribers. Old rows are
+    pruned so the log stays small.
+    """
+
+    def __init__(self, path, poll_interval=0.1, retention=10000):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._local = threading.local()
+        self._deliver = None
+        self._stop = threading.Event()
+        self._thread = None
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS event_log ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, '
+            'type TEXT NOT NULL, data TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def attach(self, deliver):
+        self._deliver = deliver
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._tail, name='event-bus-tailer', daemon=True)
+            self._thread.start()
+
+    def publish(self, channel, event_type, data):
+        conn = self._connection()
+        cursor = conn.execute(
+            'INSERT INTO event_log (channel, type, data, created_at) VALUES (?, ?, ?, ?)',
+            (channel, event_type, json.dumps(data, default=_encode_default), time.time())
+        )
+        if cursor.lastrowid % 1000 == 0:
+            conn.execute('DELETE FROM event_log WHERE id <= ?', (cursor.lastrowid - self.retention,))
+        conn.commit()
+
+    def _tail(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM event_log').fetchone()[0]
+        while not self._stop.wait(self.poll_interval):
+            try:
+                rows = conn.execute(
+                    'SELECT id, channel, type, data FROM event_log WHERE id > ? ORDER BY id',
+                    (last_id,)
+                ).fetchall()
+            except sqlite3.OperationalError:
+                continue
+            for event_id, channel, event_type, data in rows:
+                last_id = event_id
+                self._deliver({'id': event_id, 'channel': channel, 'type': event_type, 'data': json.loads(data)})
+        conn.close()
+
+    def close(self):
+        self._stop.set()
+
+
+class EventBus:
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        backend.attach(self._deliver)
+
+    def publish(self, channel, event_type, data):
+        self.backend.publish(channel, event_type, data)
+
+    def subscribe(self, channels, subscription_class=Subscription):
+        return self._add(subscription_class(self, channels))
+
+    def listen(self, channels, callback):
+        """Run ``callback(event)`` for every event on ``channels``, in every process the bus reaches"""
+        return self._add(Listener(self, channels, callback))
+
+    def _add(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def _deliver(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(event['channel'], ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+
+def create_event_bus(url=None):
+    """Build a bus from a URL such as ``memory://`` or ``sqlite:///events.db``"""
+    url = url or os.environ.get('EVENT_BUS_URL', 'memory://')
+    if url.startswith('memory://'):
+        return EventBus(MemoryBackend())
+    if url.startswith('sqlite:///'):
+        return EventBus(SQLiteBrokerBackend(url[len('sqlite:///'):]))
+    raise ValueError(f'Unsupported EVENT_BUS_URL: {url}')
@@ -0,0 +1,120 @@
+"""Per-route request metrics in the Prometheus text format.
+
+Each request records its latency, the time and number of SQL statements it
+ran, the time spent encoding the JSON body and the response size, labelled
+with the Flask endpoint. ``render`` writes everything out for a scrape,
+together with the samples of any registered collectors (caches, queues).
+
+Metrics are kept per process: under gunicorn every worker reports its own,
+and Prometheus sums them across the scraped targets.
+"""
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def family(name, kind, help_text, samples):
+    """Text lines of one metric family; ``samples`` holds (labels, value) pairs"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        lines.append(f'{name}{{{_labels(labels)}}} {_number(value)}' if labels else f'{name} {_number(value)}')
+    return lines
+
+
+def histogram_family(name, help_text, histograms):
+    """Text lines of a histogram family; ``histograms`` maps label tuples to Histograms"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for labels, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else _number(bound)
+            lines.append(f'{name}_bucket{{{_labels(labels + (("le", le),))}}} {cumulative}')
+        lines.append(f'{name}_sum{{{_labels(labels)}}} {_number(histogram.sum)}')
+        lines.append(f'{name}_count{{{_labels(labels)}}} {histogram.count}')
+    return lines
+
+
+class RequestMetrics:
+    def __init__(self, prefix='restroom'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.sql_time = {}
+        self.sql_queries = {}
+        self.serialization_time = {}
+        self.response_size = {}
+        self._collectors = []
+
+    def observe(self, endpoint, method, status, seconds, sql_seconds=0.0, queries=0,
+                serialization_seconds=0.0, size=None):
+        route = (('route', endpoint), ('method', method))
+        with self._lock:
+            key = route + (('status', status),)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self._histogram(self.latency, route, LATENCY_BUCKETS).observe(seconds)
+            self._histogram(self.sql_time, route, LATENCY_BUCKETS).observe(sql_seconds)
+            self.sql_queries[route] = self.sql_queries.get(route, 0) + queries
+            self.serialization_time[route] = self.serialization_time.get(route, 0.0) + serialization_seconds
+            if size is not None:
+                self._histogram(self.response_size, route, SIZE_BUCKETS).observe(size)
+
+    @staticmethod
+    def _histogram(histograms, labels, buckets):
+        histogram = histograms.get(labels)
+        if histogram is None:
+            histogram = histograms[labels] = Histogram(buckets)
+        return histogram
+
+    def register(self, collector):
+        """Add a callable returning extra exposition lines on every scrape"""
+        self._collectors.append(collector)
+
+    def render(self):
+        p = self.prefix
+        with self._lock:
+            lines = family(f'{p}_http_requests_total', 'counter', 'Requests served.',
+                           sorted(self.requests.items()))
+            lines += histogram_family(f'{p}_http_request_duration_seconds',
+                                      'Time to handle a request (streamed bodies excluded).', self.latency)
+            lines += histogram_family(f'{p}_http_request_sql_seconds',
+                                      'Time spent in SQL statements per request.', self.sql_time)
+            lines += family(f'{p}_http_request_sql_queries_total', 'counter', 'SQL statements run by requests.',
+                            sorted(self.sql_queries.items()))
+            lines += family(f'{p}_http_response_serialization_seconds_total', 'counter',
+                            'Time spent encoding response bodies.', sorted(self.serialization_time.items()))
+            lines += histogram_family(f'{p}_http_response_size_bytes', 'Size of response bodies.',
+                                      self.response_size)
+        for collector in self._collectors:
+            lines += collector()
+        return '\n'.join(lines) + '\n'
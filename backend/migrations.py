@@ -0,0 +1,226 @@
+"""Versioned schema migrations.
+
+A fresh database is created from the models and stamped with every version.
+An existing database is brought forward by running the migrations it has not
+seen yet, in order, each in its own transaction, so data is never dropped.
+Applied versions are recorded in the ``schema_migrations`` table.
+
+Add a migration by appending a function to MIGRATIONS; never edit or reorder
+one that has shipped. Models must declare the same columns and indexes so
+fresh databases end up identical to migrated ones.
+"""
+import json
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+from spatial import encode_geohash
+
+
+def _has_column(conn, table, column):
+    return column in {c['name'] for c in inspect(conn).get_columns(table)}
+
+
+def _add_column(conn, table, column, ddl):
+    if not _has_column(conn, table, column):
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+
+def _drop_column(conn, table, column):
+    if not _has_column(conn, table, column):
+        return
+    try:
+        conn.execute(text(f'ALTER TABLE {table} DROP COLUMN {column}'))
+    except OperationalError:
+        # SQLite before 3.35 cannot drop columns; leave it empty instead
+        conn.execute(text(f'UPDATE {table} SET {column} = NULL'))
+
+
+def _create_index(conn, name, table, *columns):
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})'))
+
+
+def restroom_geohash(conn):
+    _add_column(conn, 'restroom', 'geohash', 'VARCHAR(9)')
+    _create_index(conn, 'ix_restroom_geohash', 'restroom', 'geohash')
+    rows = conn.execute(text(
+        'SELECT id, latitude, longitude FROM restroom WHERE geohash IS NULL'
+    )).all()
+    if rows:
+        conn.execute(
+            text('UPDATE restroom SET geohash = :geohash WHERE id = :id'),
+            [{'id': id_, 'geohash': encode_geohash(lat, lng)} for id_, lat, lng in rows]
+        )
+
+
+def restroom_rating_sum(conn):
+    _add_column(conn, 'restroom', 'rating_sum', "INTEGER NOT NULL DEFAULT '0'")
+    # Same rules as rebuild_rating_aggregates(): restrooms without reviews
+    # keep their rating but get zeroed counters
+    conn.execute(text(
+        'UPDATE restroom SET '
+        'rating_sum = COALESCE((SELECT SUM(rating) FROM review WHERE review.restroom_id = restroom.id), 0), '
+        'total_reviews = (SELECT COUNT(*) FROM review WHERE review.restroom_id = restroom.id)'
+    ))
+    conn.execute(text(
+        'UPDATE restroom SET rating = CAST(rating_sum AS FLOAT) / total_reviews WHERE total_reviews > 0'
+    ))
+
+
+def chat_message_cursor_index(conn):
+    _create_index(conn, 'ix_chat_message_restroom_id_id', 'chat_message', 'restroom_id', 'id')
+
+
+def hot_lookup_indexes(conn):
+    _create_index(conn, 'ix_restroom_owner_id', 'restroom', 'owner_id')
+    _create_index(conn, 'ix_review_restroom_id_created_at', 'review', 'restroom_id', 'created_at')
+    _create_index(conn, 'ix_review_user_id_created_at', 'review', 'user_id', 'created_at')
+    _create_index(conn, 'ix_usage_history_user_id_created_at', 'usage_history', 'user_id', 'created_at')
+    _create_index(conn, 'ix_usage_history_user_id_restroom_id_end_time', 'usage_history',
+                  'user_id', 'restroom_id', 'end_time')
+    _create_index(conn, 'ix_notification_owner_id_created_at', 'notification', 'owner_id', 'created_at')
+    _create_index(conn, 'ix_payment_user_id_restroom_id_status_created_at', 'payment',
+                  'user_id', 'restroom_id', 'status', 'created_at')
+    _create_index(conn, 'ix_payment_user_id_created_at', 'payment', 'user_id', 'created_at')
+    _create_index(conn, 'ix_payment_owner_id_created_at', 'payment', 'owner_id', 'created_at')
+
+
+def usage_history_open_sessions_index(conn):
+    # Serves occupancy reconciliation: open sessions per restroom
+    _create_index(conn, 'ix_usage_history_restroom_id_end_time', 'usage_history', 'restroom_id', 'end_time')
+
+
+def restroom_versions(conn):
+    _add_column(conn, 'restroom', 'catalog_version', "INTEGER NOT NULL DEFAULT '0'")
+    _add_column(conn, 'restroom', 'status_version', "INTEGER NOT NULL DEFAULT '0'")
+    _create_index(conn, 'ix_restroom_catalog_version', 'restroom', 'catalog_version')
+    _create_index(conn, 'ix_restroom_status_version', 'restroom', 'status_version')
+    # version_counter itself is created from the models by upgrade()
+
+
+def payment_entitlement_index(conn):
+    # Extends the status lookup index so entitlement checks never touch the table
+    _create_index(conn, 'ix_payment_entitlement', 'payment',
+                  'user_id', 'restroom_id', 'status', 'created_at', 'confirmed_at')
+    conn.execute(text('DROP INDEX IF EXISTS ix_payment_user_id_restroom_id_status_created_at'))
+
+
+def owner_unread_notifications(conn):
+    _add_column(conn, 'owner', 'unread_notifications', "INTEGER NOT NULL DEFAULT '0'")
+    _create_index(conn, 'ix_notification_owner_id_is_read_id', 'notification', 'owner_id', 'is_read', 'id')
+    # Same count as rebuild_unread_counters()
+    conn.execute(text(
+        'UPDATE owner SET unread_notifications = '
+        '(SELECT COUNT(*) FROM notification WHERE notification.owner_id = owner.id AND notification.is_read = 0)'
+    ))
+
+
+def restroom_image_table(conn):
+    # restroom_image itself is created from the models by upgrade(); copy the
+    # JSON image lists into it, then drop the column so restroom rows stay small
+    if not _has_column(conn, 'restroom', 'images'):
+        return
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, images FROM restroom WHERE id > :last_id AND images IS NOT NULL AND images != '' "
+            'ORDER BY id LIMIT 500'
+        ), {'last_id': last_id}).all()
+        if not rows:
+            break
+        values = []
+        for restroom_id, images in rows:
+            try:
+                refs = json.loads(images)
+            except ValueError:
+                refs = [images]
+            if not isinstance(refs, list):
+                refs = [refs]
+            refs = [ref for ref in refs if isinstance(ref, str) and ref]
+            values += [{'restroom_id': restroom_id, 'position': position, 'ref': ref}
+                       for position, ref in enumerate(refs)]
+        if values:
+            conn.execute(text(
+                'INSERT INTO restroom_image (restroom_id, position, ref) VALUES (:restroom_id, :position, :ref)'
+            ), values)
+        last_id = rows[-1][0]
+    _drop_column(conn, 'restroom', 'images')
+
+
+def restroom_version_stamps(conn):
+    # Versions are now millisecond stamps on the rows; the shared counter row
+    # is gone. SQLite integers are already 64-bit; PostgreSQL's are not
+    if conn.dialect.name == 'postgresql':
+        for column in ('catalog_version', 'status_version'):
+            conn.execute(text(f'ALTER TABLE restroom ALTER COLUMN {column} TYPE BIGINT'))
+    conn.execute(text('DROP TABLE IF EXISTS version_counter'))
+
+
+MIGRATIONS = [
+    (1, 'restroom_geohash', restroom_geohash),
+    (2, 'restroom_rating_sum', restroom_rating_sum),
+    (3, 'chat_message_cursor_index', chat_message_cursor_index),
+    (4, 'hot_lookup_indexes', hot_lookup_indexes),
+    (5, 'usage_history_open_sessions_index', usage_history_open_sessions_index),
+    (6, 'restroom_versions', restroom_versions),
+    (7, 'payment_entitlement_index', payment_entitlement_index),
+    (8, 'owner_unread_notifications', owner_unread_notifications),
+    (9, 'restroom_image_table', restroom_image_table),
+    (10, 'restroom_version_stamps', restroom_version_stamps),
+]
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, applied_at TIMESTAMP NOT NULL)'
+    ))
+
+
+def _stamp(conn, version, name):
+    conn.execute(
+        text('INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)'),
+        {'version': version, 'name': name, 'applied_at': datetime.utcnow()}
+    )
+
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def upgrade(engine, metadata):
+    """Create missing tables and apply pending migrations.
+
+    Returns the names of the migrations that were run.
+    """
+    with engine.begin() as conn:
+        fresh = not inspect(conn).has_table('restroom')
+        _ensure_version_table(conn)
+        metadata.create_all(conn)
+        if fresh:
+            # Tables were just built from the models, which are already current
+            done = {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+            for version, name, _ in MIGRATIONS:
+                if version not in done:
+                    _stamp(conn, version, name)
+            return []
+
+    ran = []
+    done = applied_versions(engine)
+    for version, name, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            migrate(conn)
+            _stamp(conn, version, name)
+        ran.append(name)
+    return ran
+
+
+def status(engine):
+    """Return (version, name, applied) for every known migration"""
+    done = applied_versions(engine)
+    return [(version, name, version in done) for version, name, _ in MIGRATIONS]
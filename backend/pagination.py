@@ -0,0 +1,124 @@
+"""Keyset pagination for list endpoints.
+
+A page is requested with ``?limit=N`` and continued with ``?cursor=<token>``
+taken from the previous page's ``next_cursor``; ``next_cursor`` is null on the
+last page. The cursor is an opaque token holding the sort key of the last row
+served, so the next page starts with an index seek instead of an OFFSET scan
+and costs the same however deep the client has paged.
+
+Every paginated query must be ordered by its keys, the last of which has to
+be unique (normally the primary key), and the keys must be selected by the
+query so the cursor can be read off the last row.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import DateTime, and_, or_
+
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 200
+
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def is_page_request(args):
+    """True when the client opted into pagination with ?cursor= or ?limit="""
+    return 'cursor' in args or 'limit' in args
+
+
+def page_args(args, default_limit=DEFAULT_PAGE_LIMIT, max_limit=MAX_PAGE_LIMIT):
+    """Parse ?cursor= and ?limit=; raises ValueError on bad input"""
+    limit = args.get('limit', default_limit, type=int)
+    if limit is None or limit < 1:
+        raise ValueError('limit must be a positive integer')
+    token = args.get('cursor')
+    return (decode_cursor(token) if token else None), min(limit, max_limit)
+
+
+# SQLite integers are signed 64-bit; larger values fail in the driver
+SQL_INTEGER_RANGE = range(-2 ** 63, 2 ** 63)
+
+
+def _coerce(key, value):
+    """The cursor value as its key column's Python type; raises ValueError otherwise.
+
+    Cursors come back from clients, so nothing but a scalar of the right type
+    may reach the query.
+    """
+    if value is None:
+        return None
+    if isinstance(key.type, DateTime):
+        if not isinstance(value, str):
+            raise ValueError('Invalid cursor')
+        return datetime.fromisoformat(value)
+    expected = key.type.python_type
+    if expected is float and type(value) is int:
+        value = float(value)
+    # type(), not isinstance(): JSON true/false must not pass as integers
+    if type(value) is not expected:
+        raise ValueError('Invalid cursor')
+    if expected is int and value not in SQL_INTEGER_RANGE:
+        raise ValueError('Invalid cursor')
+    return value
+
+
+def keyset_after(keys, values, descending=False):
+    """Criterion selecting the rows that sort after ``values`` on ``keys``.
+
+    Written as ``k1 >= v1 AND (k1 > v1 OR (k1 = v1 AND k2 > v2) ...)`` so the
+    leading key gives the index a range to seek into.
+    """
+    if len(values) != len(keys):
+        raise ValueError('Invalid cursor')
+    try:
+        values = [_coerce(key, value) for key, value in zip(keys, values)]
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+    def beyond(key, value):
+        return key < value if descending else key > value
+
+    alternatives = []
+    for i, (key, value) in enumerate(zip(keys, values)):
+        equal = [k == v for k, v in zip(keys[:i], values[:i])]
+        alternatives.append(and_(*equal, beyond(key, value)))
+    first, value = keys[0], values[0]
+    return and_(first <= value if descending else first >= value, or_(*alternatives))
+
+
+def keyset_order_by(keys, descending=False):
+    return [key.desc() if descending else key.asc() for key in keys]
+
+
+def keyset_page(query, keys, cursor, limit, descending=False):
+    """Fetch one page of ``query``.
+
+    Returns ``(rows, next_cursor)``; ``next_cursor`` is None on the last page.
+    """
+    if cursor is not None:
+        query = query.filter(keyset_after(keys, cursor, descending))
+    rows = query.order_by(*keyset_order_by(keys, descending)).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]._mapping
+    return rows, encode_cursor([last[key] for key in keys])
+
+
+def page_body(items, next_cursor):
+    return {'items': items, 'next_cursor': next_cursor}
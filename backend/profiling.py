@@ -0,0 +1,76 @@
+"""Sampled request profiles.
+
+A request is profiled when it carries ``X-Profile: <PROFILE_TOKEN>`` or when
+it is picked by the sample rate. The profile is written to ``directory``
+if the request was asked for explicitly or took longer than ``slow_ms``;
+fast sampled requests are discarded. Profiles use cProfile (open them with
+``python -m pstats`` or snakeviz), or pyinstrument's HTML report when
+pyinstrument is installed and selected.
+
+Profiling is off unless a token or a sample rate is configured.
+"""
+import cProfile
+import os
+import random
+import re
+import time
+
+try:
+    import pyinstrument
+except ImportError:  # pragma: no cover - optional dependency
+    pyinstrument = None
+
+PROFILE_HEADER = 'X-Profile'
+
+
+class RequestProfiler:
+    def __init__(self, directory, token=None, sample_rate=0.0, slow_ms=500, engine='cprofile'):
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.engine = 'pyinstrument' if engine == 'pyinstrument' and pyinstrument is not None else 'cprofile'
+        self.written = 0
+
+    @property
+    def enabled(self):
+        return bool(self.token) or self.sample_rate > 0
+
+    def start(self, headers):
+        """Return a running profile for this request, or None"""
+        requested = bool(self.token) and headers.get(PROFILE_HEADER) == self.token
+        if not requested and not (self.sample_rate > 0 and random.random() < self.sample_rate):
+            return None
+        profile = pyinstrument.Profiler() if self.engine == 'pyinstrument' else cProfile.Profile()
+        try:
+            if self.engine == 'cprofile':
+                profile.enable()
+            else:
+                profile.start()
+        except (RuntimeError, ValueError):
+            # Another profiler is already active on this thread
+            return None
+        return requested, profile
+
+    def finish(self, running, endpoint, elapsed):
+        """Stop the profile and write it if it was requested or slow; returns the path"""
+        requested, profile = running
+        if self.engine == 'cprofile':
+            profile.disable()
+        else:
+            profile.stop()
+        if not requested and elapsed * 1000 < self.slow_ms:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', endpoint or 'unknown')
+        self.written += 1
+        stem = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{self.written}-'
+                                            f'{name}-{round(elapsed * 1000)}ms')
+        if self.engine == 'cprofile':
+            path = f'{stem}.prof'
+            profile.dump_stats(path)
+        else:
+            path = f'{stem}.html'
+            with open(path, 'w') as out:
+                out.write(profile.output_html())
+        return path
@@ -0,0 +1,91 @@
+"""Count and time the SQL statements a request runs.
+
+``QueryCounter.install`` hooks an engine's cursor execute events. Every
+statement executed while a recording is active on the same thread is
+appended to that recording, and its execution time added up; statements from
+other threads (the notification writer, the usage sweeper) are not charged
+to the request.
+
+Per-route budgets turn a silent N+1 into a visible failure: ``over_budget``
+compares a recording with the budget of the endpoint that produced it.
+Recordings note whether the request committed, so a strict caller can
+refuse a write before its commit instead of failing one already made.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryRecording:
+    def __init__(self):
+        self.statements = []
+        self.seconds = 0.0
+        self.committed = False
+        self._started = None
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+class QueryCounter:
+    def __init__(self, budgets=None, default_budget=None):
+        self.budgets = budgets or {}
+        self.default_budget = default_budget
+        self._local = threading.local()
+
+    def install(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        recording = getattr(self._local, 'recording', None)
+        if recording is not None:
+            recording.statements.append(statement)
+            recording._started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        recording = getattr(self._local, 'recording', None)
+        if recording is not None and recording._started is not None:
+            recording.seconds += time.perf_counter() - recording._started
+            recording._started = None
+
+    def start(self):
+        """Begin a new recording for this thread"""
+        self._local.recording = QueryRecording()
+        return self._local.recording
+
+    def current(self):
+        """This thread's active recording, or None"""
+        return getattr(self._local, 'recording', None)
+
+    @contextmanager
+    def paused(self):
+        """Do not charge statements run inside the block to this thread's recording"""
+        recording = getattr(self._local, 'recording', None)
+        self._local.recording = None
+        try:
+            yield
+        finally:
+            self._local.recording = recording
+
+    def stop(self):
+        recording = getattr(self._local, 'recording', None)
+        self._local.recording = None
+        return recording
+
+    def budget(self, endpoint):
+        return self.budgets.get(endpoint, self.default_budget)
+
+    def over_budget(self, endpoint, recording):
+        """Return an error message if ``recording`` exceeds the endpoint's budget"""
+        budget = self.budget(endpoint)
+        if budget is None or recording.count <= budget:
+            return None
+        return f'{endpoint} ran {recording.count} queries, budget is {budget}'
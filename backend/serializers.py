@@ -0,0 +1,234 @@
+"""Row serializers and fast JSON encoding for API responses.
+
+Routes select only the columns a response needs (``query.with_entities(
+*schema.columns)``) and turn the resulting row tuples into dicts with a
+precomputed RowSchema, instead of loading full ORM objects and building each
+dict by hand. Bodies are encoded with orjson when it is installed and with the
+standard library otherwise; both produce the same JSON. When msgpack is
+installed, clients that prefer ``application/msgpack`` in their Accept header
+get the same data as MessagePack instead.
+
+Clients can ask for fewer fields with ``?fields=a,b``: ``RowSchema.project``
+narrows a schema to them, so the SELECT reads only those columns and the
+payload carries only those keys.
+"""
+import json
+import time
+from datetime import date, datetime
+
+from flask import Response, g, has_request_context, request
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    def dumps(data):
+        """Encode to UTF-8 JSON bytes"""
+        # orjson writes naive datetimes exactly like datetime.isoformat()
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+else:
+    def dumps(data):
+        """Encode to UTF-8 JSON bytes"""
+        return json.dumps(data, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+    loads = json.loads
+
+
+def negotiate(accept):
+    """Mimetype to encode a response in, given a parsed Accept header.
+
+    JSON unless MessagePack is installed and the client ranks it higher, so
+    browsers and ``*/*`` keep getting JSON.
+    """
+    if msgpack is None:
+        return JSON_MIMETYPE
+    return accept.best_match((JSON_MIMETYPE,) + MSGPACK_MIMETYPES, default=JSON_MIMETYPE)
+
+
+def response_mimetype():
+    return negotiate(request.accept_mimetypes) if has_request_context() else JSON_MIMETYPE
+
+
+def encode(data, mimetype=JSON_MIMETYPE):
+    """Encode to the bytes of a negotiated mimetype; datetimes become ISO strings in both formats"""
+    if mimetype == JSON_MIMETYPE:
+        return dumps(data)
+    return msgpack.packb(data, default=_default)
+
+
+def json_response(data, status=200):
+    """A JSON response, or MessagePack when the request's Accept header prefers it"""
+    mimetype = response_mimetype()
+    started = time.perf_counter()
+    body = encode(data, mimetype)
+    if has_request_context():
+        # Reported per route by the metrics middleware
+        g.serialization_seconds = g.get('serialization_seconds', 0.0) + time.perf_counter() - started
+    response = Response(body, status=status, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
+
+
+# Converters applied to single values while serializing a row
+def json_list(value):
+    return loads(value) if value else []
+
+
+def or_zero(value):
+    return value or 0
+
+
+def or_false(value):
+    return value or False
+
+
+def isoformat(value):
+    """For values sent as strings in payloads that are not encoded by dumps()"""
+    return value.isoformat() if value else None
+
+
+class FieldError(ValueError):
+    """A ``?fields=`` value naming no field or a field the response lacks"""
+
+
+def fields_arg(args):
+    """Field names from ``?fields=a,b``, or None when every field is wanted"""
+    value = args.get('fields')
+    if value is None:
+        return None
+    names = frozenset(name.strip() for name in value.split(',') if name.strip())
+    if not names:
+        raise FieldError('fields must name at least one field')
+    return names
+
+
+def nested_fields(names, parent):
+    """Requested fields of a nested list such as ``reviews.rating``.
+
+    None means all of them (no ``?fields=``, or the parent named alone); an
+    empty set means the list was not asked for.
+    """
+    if names is None or parent in names:
+        return None
+    prefix = parent + '.'
+    return frozenset(name[len(prefix):] for name in names if name.startswith(prefix))
+
+
+def check_fields(names, *schemas, extra=()):
+    """Raise FieldError for requested names that none of the schemas, nor ``extra``, provide"""
+    if names is None:
+        return
+    known = set(extra)
+    for schema in schemas:
+        known |= schema.field_names
+    unknown = sorted(names - known)
+    if unknown:
+        raise FieldError(f"Unknown field(s): {', '.join(unknown)}")
+
+
+class Field:
+    def __init__(self, name, column, convert=None):
+        self.name = name
+        self.column = column
+        self.convert = convert
+
+
+def _as_field(field):
+    # Bare model attributes keep their column name
+    return field if isinstance(field, Field) else Field(field.key, field)
+
+
+class RowSchema:
+    """Maps projected row tuples to response dicts.
+
+    A field named ``parent.child`` is nested as ``{'parent': {'child': ...}}``;
+    the nested dict becomes None when its first value is NULL (outer joins).
+    """
+
+    # Distinct projections kept per schema; past this they are built per request
+    MAX_PROJECTIONS = 64
+
+    def __init__(self, *fields):
+        self.fields = tuple(_as_field(field) for field in fields)
+        self.columns = tuple(field.column for field in self.fields)
+        self._names = tuple(field.name for field in self.fields)
+        self._flat = all('.' not in name for name in self._names)
+        self._converters = tuple((field.name, field.convert) for field in self.fields if field.convert)
+        self._nested = {}
+        for index, name in enumerate(self._names):
+            if '.' in name:
+                parent, child = name.split('.', 1)
+                self._nested.setdefault(parent, []).append((index, child))
+        # Names ?fields= may use: every field, and each nested parent for all its children
+        self.field_names = frozenset(self._names) | frozenset(self._nested)
+        self._projections = {}
+
+    def project(self, names=None, hidden=(), always=('id',)):
+        """A schema serializing only the fields in ``names`` (all when None).
+
+        ``restroom`` selects every ``restroom.*`` field, and the fields in
+        ``always`` are kept so items stay addressable. Columns in ``hidden``
+        are selected after the fields when missing, so a route can still read
+        them off the rows (keyset keys, coordinates) without sending them.
+        Names the schema lacks are ignored; see check_fields().
+        """
+        if names is None and all(any(column is c for c in self.columns) for column in hidden):
+            return self
+        key = (names, tuple(map(id, hidden)), always)
+        schema = self._projections.get(key)
+        if schema is None:
+            fields = self.fields if names is None else tuple(
+                field for field in self.fields
+                if field.name in names or field.name in always or field.name.split('.', 1)[0] in names
+            )
+            schema = RowSchema(*fields)
+            # Rows are zipped with the field names, so trailing hidden columns never reach the payload
+            schema.columns += tuple(column for column in hidden if not any(column is c for c in schema.columns))
+            if len(self._projections) < self.MAX_PROJECTIONS:
+                self._projections[key] = schema
+        return schema
+
+    def serialize(self, row):
+        if self._flat:
+            item = dict(zip(self._names, row))
+        else:
+            item = {name: value for name, value in zip(self._names, row) if '.' not in name}
+            for parent, children in self._nested.items():
+                if row[children[0][0]] is None:
+                    item[parent] = None
+                else:
+                    item[parent] = {child: row[index] for index, child in children}
+        for name, convert in self._converters:
+            if name in item:
+                item[name] = convert(item[name])
+        return item
+
+    def many(self, rows):
+        serialize = self.serialize
+        return [serialize(row) for row in rows]
+
+    def from_object(self, obj, **values):
+        """Serialize an ORM instance; ``values`` supplies fields it lacks"""
+        return self.serialize(tuple(
+            values[field.name] if field.name in values else getattr(obj, field.column.key)
+            for field in self.fields
+        ))
@@ -0,0 +1,138 @@
+"""Geohash helpers used to index restrooms by location.
+
+Every restroom stores a fixed-precision geohash in an indexed column. Because
+geohash cells sharing a prefix are contiguous in string order, a bounding box
+can be answered with a handful of B-tree range scans (one per covering cell)
+followed by an exact haversine filter on the few candidate rows.
+"""
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # ~4.8m x 4.8m cells
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE_LAT = 111320.0
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Encode a coordinate as a geohash string of the given precision"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True  # geohash interleaves bits starting with longitude
+    while len(chars) < precision:
+        if even:
+            mid = (lng_range[0] + lng_range[1]) / 2
+            if longitude >= mid:
+                value = (value << 1) | 1
+                lng_range[0] = mid
+            else:
+                value <<= 1
+                lng_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                value = (value << 1) | 1
+                lat_range[0] = mid
+            else:
+                value <<= 1
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Return (lat_degrees, lng_degrees) spanned by one cell at this precision"""
+    total_bits = precision * 5
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def cover_bbox(min_lat, min_lng, max_lat, max_lng, max_cells=32):
+    """Return the geohash prefixes that together cover a bounding box.
+
+    Picks the finest precision whose covering needs at most ``max_cells``
+    cells, so small boxes scan little and large boxes stay a bounded number
+    of range scans.
+    """
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+    min_lng, max_lng = max(min_lng, -180.0), min(max_lng, 180.0)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_step, lng_step = cell_size(precision)
+        lat_start = math.floor((min_lat + 90.0) / lat_step)
+        lat_end = math.floor((max_lat + 90.0) / lat_step)
+        lng_start = math.floor((min_lng + 180.0) / lng_step)
+        lng_end = math.floor((max_lng + 180.0) / lng_step)
+        if (lat_end - lat_start + 1) * (lng_end - lng_start + 1) > max_cells and precision > 1:
+            continue
+        cells = set()
+        for i in range(lat_start, lat_end + 1):
+            center_lat = min((i + 0.5) * lat_step - 90.0, 90.0)
+            for j in range(lng_start, lng_end + 1):
+                center_lng = min((j + 0.5) * lng_step - 180.0, 180.0)
+                cells.add(encode_geohash(center_lat, center_lng, precision))
+        return sorted(cells)
+    return []
+
+
+def prefix_upper_bound(prefix):
+    """Smallest string greater than every geohash starting with ``prefix``"""
+    # '{' sorts directly after 'z', the last geohash character
+    return prefix + '{'
+
+
+def radius_to_bbox(latitude, longitude, radius_m):
+    """Return (min_lat, min_lng, max_lat, max_lng) enclosing a circle"""
+    dlat = radius_m / METERS_PER_DEGREE_LAT
+    cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+    dlng = radius_m / (METERS_PER_DEGREE_LAT * cos_lat)
+    return latitude - dlat, longitude - dlng, latitude + dlat, longitude + dlng
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def check_position(latitude, longitude):
+    """Raise ValueError unless the coordinate is finite and on the globe"""
+    if not (math.isfinite(latitude) and math.isfinite(longitude)):
+        raise ValueError('lat and lng must be finite numbers')
+    if not -90.0 <= latitude <= 90.0:
+        raise ValueError('lat must be between -90 and 90')
+    if not -180.0 <= longitude <= 180.0:
+        raise ValueError('lng must be between -180 and 180')
+
+
+def check_radius(radius_m):
+    """Raise ValueError unless the radius is a finite, positive number of meters"""
+    if not (math.isfinite(radius_m) and radius_m > 0):
+        raise ValueError('radius_m must be a positive number')
+
+
+def parse_bbox(value):
+    """Parse ``min_lng,min_lat,max_lng,max_lat`` (GeoJSON order).
+
+    Returns (min_lat, min_lng, max_lat, max_lng) or raises ValueError.
+    """
+    parts = [float(p) for p in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError('bbox must be min_lng,min_lat,max_lng,max_lat')
+    if not all(math.isfinite(p) for p in parts):
+        raise ValueError('bbox values must be finite numbers')
+    min_lng, min_lat, max_lng, max_lat = parts
+    if min_lat > max_lat or min_lng > max_lng:
+        raise ValueError('bbox minimums must not exceed maximums')
+    return min_lat, min_lng, max_lat, max_lng
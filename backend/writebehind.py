@@ -0,0 +1,135 @@
+"""Write-behind queue: batch rows off the request path.
+
+Requests put rows on a bounded in-process queue and return. A background
+worker takes whatever arrived during one tick (up to ``batch_size`` rows) and
+hands the batch to ``write``, which inserts it in a single transaction, so a
+burst of N requests costs one commit instead of N.
+
+Rows are never dropped on purpose: when the queue is full or has been shut
+down, ``put`` writes the row synchronously instead. ``close`` (registered with atexit) drains the queue
+before the process exits. A batch whose write keeps failing is retried and
+then reported, not lost silently.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+
+
+class WriteBehindQueue:
+    def __init__(self, write, max_size=10000, interval=0.05, batch_size=500, retries=3, name='write-behind'):
+        self.write = write
+        self.interval = interval
+        self.batch_size = batch_size
+        self.retries = retries
+        self.name = name
+        self.enabled = max_size > 0
+        self._queue = queue.Queue(maxsize=max(max_size, 1))
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closing = threading.Event()
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.synchronous = 0
+        atexit.register(self.close)
+
+    def put(self, row):
+        if self.enabled and not self._closing.is_set():
+            self._ensure_worker()
+            try:
+                self._queue.put_nowait(row)
+                self.enqueued += 1
+                return
+            except queue.Full:
+                pass
+        # Back-pressure instead of loss: the caller pays for its own write
+        self.synchronous += 1
+        self._write([row])
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, so each (gunicorn) worker process starts its own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _take(self):
+        """Block for the first row, then collect more until the tick ends"""
+        try:
+            batch = [self._queue.get(timeout=self.interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if batch:
+                self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
+            elif self._closing.is_set():
+                return
+
+    def _write(self, batch):
+        for attempt in range(1, self.retries + 1):
+            try:
+                self.write(batch)
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    self.failed += len(batch)
+                    print(f"{self.name}: giving up on {len(batch)} row(s) after {attempt} attempts: {e}")
+                    for row in batch:
+                        print(f"{self.name}: unwritten row {row!r}")
+                    return
+                time.sleep(self.interval * 2 ** attempt)
+
+    def drain(self):
+        """Wait until every queued row has been written"""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self, timeout=10):
+        """Stop accepting rows, write what is queued and stop the worker"""
+        self._closing.set()
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            thread.join(timeout)
+        # Anything the worker did not get to is written here
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(leftover), self.batch_size):
+            self._write(leftover[start:start + self.batch_size])
+        for _ in leftover:
+            self._queue.task_done()
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize() if self.enabled else 0,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'batches': self.batches,
+            'synchronous': self.synchronous,
+            'failed': self.failed,
+        }
@@ -52,7 +52,7 @@ const OwnerAccountScreen: React.FC = () => {
             if (!user || !user.email) return;
 
             // Get owner's restrooms
-            const restrooms = await api.getOwnerRestroomsByEmail(user.email);
+            const restrooms = await api.getOwnerRestroomsByEmail(user.email, ['rating', 'total_reviews', 'current_users']);
 
             // Calculate stats from restrooms data
             const totalRestrooms = restrooms.length;
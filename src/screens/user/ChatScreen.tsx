@@ -28,8 +28,11 @@ const ChatScreen: React.FC = () => {
   const [newMessage, setNewMessage] = useState('');
   const [loading, setLoading] = useState(true);
   const flatListRef = useRef<FlatList>(null);
+  // Id of the newest message received from the server, used as the poll cursor
+  const lastMessageIdRef = useRef<number | undefined>(undefined);
 
   useEffect(() => {
+    lastMessageIdRef.current = undefined;
     fetchMessages();
     // Set up polling for new messages
     const interval = setInterval(fetchMessages, 3000);
@@ -38,8 +41,18 @@ const ChatScreen: React.FC = () => {
 
   const fetchMessages = async () => {
     try {
-      const data = await api.getMessages(restaurantId);
-      setMessages(data);
+      const sinceId = lastMessageIdRef.current;
+      const data = await api.getMessages(restaurantId, sinceId);
+      if (sinceId === undefined) {
+        setMessages(data);
+      } else if (data.length > 0) {
+        // Server copies replace optimistic messages (negative ids)
+        const receivedIds = new Set(data.map(m => m.id));
+        setMessages(prev => [...prev.filter(m => m.id > 0 && !receivedIds.has(m.id)), ...data]);
+      }
+      if (data.length > 0) {
+        lastMessageIdRef.current = data[data.length - 1].id;
+      }
       setLoading(false);
     } catch (error) {
       console.error('Error fetching messages:', error);
@@ -63,7 +76,7 @@ const ChatScreen: React.FC = () => {
         setNewMessage('');
         // Add message optimistically
         const optimisticMessage: ChatMessage = {
-          id: Date.now(),
+          id: -Date.now(),
           user_id: user.id,
           message: messageData.message,
           message_type: 'normal',
@@ -6,7 +6,7 @@ export const api = {
   // Restrooms
   getRestrooms: async (): Promise<Restroom[]> => {
     try {
-      const response = await fetch(`${API_BASE_URL}/restrooms`);
+      const response = await fetch(`${API_BASE_URL}/restrooms?include=images`);
       if (!response.ok) throw new Error('Failed to fetch restrooms');
       return await response.json();
     } catch (error) {
@@ -117,9 +117,13 @@ export const api = {
     }
   },
 
-  getMessages: async (restroomId: number): Promise<ChatMessage[]> => {
+  getMessages: async (restroomId: number, sinceId?: number, waitSeconds?: number): Promise<ChatMessage[]> => {
     try {
-      const response = await fetch(`${API_BASE_URL}/chat/messages/${restroomId}`);
+      // With sinceId only newer messages are returned; waitSeconds long-polls for them
+      const params = sinceId !== undefined
+        ? `?since_id=${sinceId}${waitSeconds ? `&wait=${waitSeconds}` : ''}`
+        : '';
+      const response = await fetch(`${API_BASE_URL}/chat/messages/${restroomId}${params}`);
       if (!response.ok) throw new Error('Failed to fetch messages');
       return await response.json();
     } catch (error) {
@@ -296,9 +300,11 @@ export const api = {
     }
   },
 
-  getOwnerRestroomsByEmail: async (email: string): Promise<any[]> => {
+  // Pass fields to fetch only those (plus id), e.g. for stats or pickers
+  getOwnerRestroomsByEmail: async (email: string, fields?: string[]): Promise<any[]> => {
     try {
-      const response = await fetch(`${API_BASE_URL}/owner/${email}/restrooms`);
+      const query = fields ? `fields=${fields.join(',')}` : 'include=images';
+      const response = await fetch(`${API_BASE_URL}/owner/${email}/restrooms?${query}`);
       if (!response.ok) throw new Error('Failed to fetch owner restrooms');
       return await response.json();
     } catch (error) {